@@ -0,0 +1,195 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+Benchmarks CanvasConnection and CanvasStatus against a local FakeCanvasServer.
+
+For each public method, and for a full CanvasStatus.get_course_info run, reports the
+number of HTTP requests, the wall-clock time and the peak traced memory.  Each case gets
+a fresh connection, so nothing is shared between cases.  Run from the repository root:
+
+    python -m benchmarks.bench_canvas --courses 8 --students 200 --assignments 30 --latency 0.02
+
+--save writes the results as JSON; --compare checks them against a saved run and exits
+with status 1 if any case needs more requests, or more than --tolerance times the time or
+memory, than before.  The memory runs are slow with canvasapi's objects; --no-memory skips
+them.  --backend graphql measures GraphQLCanvasConnection instead, so the two APIs' request
+counts and times can be compared.
+"""
+
+from python_canvas_layer.fake_canvas import FakeInstitution, FakeCanvasServer
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.module_index import ModuleItemIndex
+from python_canvas_layer.canvas_status import CanvasStatus
+from typing import Callable, Dict, List, Tuple
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+import warnings
+
+import pandas as pd
+
+
+def _consume(batches) -> int:
+    return sum(len(batch) for batch in batches)
+
+
+def _module_lookups(canvas: CanvasConnection, course) -> int:
+    # One lookup per item, by its full title, against an index built once for the course
+    items = canvas.get_module_items_df(course)
+    titles = list(items['title']) if len(items) else []
+    index = ModuleItemIndex(items)
+    for title in titles:
+        canvas.get_matching_module_url(index, title, 'Quiz')
+    return len(titles)
+
+
+# (name, function of a connection and a course); the course object is fetched beforehand
+CASES: List[Tuple[str, Callable]] = [
+    ('get_course_list', lambda canvas, course: canvas.get_course_list()),
+    ('get_course_list_df', lambda canvas, course: canvas.get_course_list_df()),
+    ('get_active_course_objs', lambda canvas, course: canvas.get_active_course_objs()),
+    ('get_course', lambda canvas, course: canvas.get_course(course.id)),
+    ('get_quizzes_df', lambda canvas, course: canvas.get_quizzes_df(course)),
+    ('get_modules_df', lambda canvas, course: canvas.get_modules_df(course)),
+    ('get_module_items_df', lambda canvas, course: canvas.get_module_items_df(course)),
+    ('get_matching_module_url', _module_lookups),
+    ('get_students_df', lambda canvas, course: canvas.get_students_df(course)),
+    ('get_assignments_df', lambda canvas, course: canvas.get_assignments_df(course)),
+    ('get_student_summaries_df', lambda canvas, course: canvas.get_student_summaries_df(course)),
+    ('get_assignment_submissions_df', lambda canvas, course: canvas.get_assignment_submissions_df(course)),
+    ('get_assignment_submissions_df(bulk=False)',
+     lambda canvas, course: canvas.get_assignment_submissions_df(course, bulk=False)),
+    ('iter_assignment_submissions', lambda canvas, course: _consume(canvas.iter_assignment_submissions(course))),
+]
+
+
+def _measure(server: FakeCanvasServer, run: Callable, memory: bool) -> Dict:
+    # Timing and memory are taken in separate runs, since tracing slows Python down several-fold
+    server.reset_counts()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    requests = server.request_count
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {'requests': requests, 'seconds': elapsed, 'peak_bytes': peak}
+
+
+def run_benchmarks(args) -> pd.DataFrame:
+    institution = FakeInstitution(courses=args.courses, students=args.students, assignments=args.assignments,
+                                  modules=args.modules, items_per_module=args.items_per_module, seed=args.seed)
+    # The GraphQL reader reads the REST API as raw JSON in any case
+    options = {'raw_json': args.raw_json or args.backend == 'graphql', 'typed': args.typed}
+    results = {}
+    with FakeCanvasServer(institution, latency=args.latency, max_per_page=args.per_page) as server:
+        course_id = institution.courses[0]['id']
+        for name, case in CASES:
+            if args.only and name not in args.only:
+                continue
+
+            def run():
+                canvas = CanvasStatus.BACKENDS[args.backend](server.url, 'benchmark-token', **options)
+                course = canvas.get_course(course_id)
+                server.reset_counts()
+                case(canvas, course)
+
+            results[name] = _measure(server, run, args.memory)
+            logging.info('%s: %s', name, results[name])
+
+        if not args.only or 'get_course_info' in args.only:
+            def run():
+                status = CanvasStatus(server.url, 'benchmark-token', [], CanvasStatus.OPTION_ORDER, False,
+                                      max_workers=args.max_workers, backend=args.backend, **options)
+                status.get_course_info()
+
+            results['get_course_info'] = _measure(server, run, args.memory)
+
+    return pd.DataFrame.from_dict(results, orient='index')
+
+
+def compare(results: pd.DataFrame, baseline: pd.DataFrame, tolerance: float, min_seconds: float) -> List[str]:
+    """
+    Returns a description of each case that regressed relative to baseline.  Slowdowns of
+    less than min_seconds are ignored as timing noise.
+    """
+    regressions = []
+    for name in results.index.intersection(baseline.index):
+        now, before = results.loc[name], baseline.loc[name]
+        if now['requests'] > before['requests']:
+            regressions.append('%s: %d requests, was %d' % (name, now['requests'], before['requests']))
+        if now['seconds'] > before['seconds'] * tolerance and now['seconds'] - before['seconds'] > min_seconds:
+            regressions.append('%s: %.3fs, was %.3fs' % (name, now['seconds'], before['seconds']))
+        if pd.notna(now['peak_bytes']) and pd.notna(before['peak_bytes']) and \
+                now['peak_bytes'] > before['peak_bytes'] * tolerance:
+            regressions.append('%s: peak %d bytes, was %d' % (name, now['peak_bytes'], before['peak_bytes']))
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--courses', type=int, default=3)
+    parser.add_argument('--students', type=int, default=40)
+    parser.add_argument('--assignments', type=int, default=10)
+    parser.add_argument('--modules', type=int, default=6)
+    parser.add_argument('--items-per-module', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--per-page', type=int, default=100, help="the server's page size limit")
+    parser.add_argument('--max-workers', type=int, default=1, help='threads for get_course_info')
+    parser.add_argument('--raw-json', action='store_true')
+    parser.add_argument('--typed', action='store_true')
+    parser.add_argument('--backend', choices=sorted(CanvasStatus.BACKENDS), default='rest',
+                        help='read assignments and submissions through the REST or GraphQL API')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the peak memory runs')
+    parser.add_argument('--only', nargs='*', help='run just these cases')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with results saved by --save')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--min-seconds', type=float, default=0.1)
+    args = parser.parse_args(argv)
+    # The fake server is plain HTTP, which canvasapi warns about on every connection
+    warnings.filterwarnings('ignore', message='Canvas may respond unexpectedly')
+
+    results = run_benchmarks(args)
+    with pd.option_context('display.width', 200, 'display.max_rows', None):
+        print(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results.to_dict(orient='index'), f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = pd.DataFrame.from_dict(json.load(f), orient='index')
+        regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
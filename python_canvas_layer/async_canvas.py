@@ -0,0 +1,458 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from canvasapi.exceptions import BadRequest, CanvasException, Conflict, Forbidden, InvalidAccessToken, \
+    ResourceDoesNotExist, Unauthorized, UnprocessableEntity
+from python_canvas_layer.course_info import CourseApi, RecordBatch
+from python_canvas_layer import course_info
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.scheduler import RateLimitScheduler
+from python_canvas_layer.schemas import SCHEMAS, build_frame
+from python_canvas_layer.metrics import MetricsHook, RequestEvent
+from python_canvas_layer.pagination import remaining_pages
+from collections import deque
+import pandas as pd
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Tuple
+
+# aiohttp is optional (pip install python_canvas_layer[async]); only this module needs it
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+
+class AsyncCanvasConnection(CourseApi):
+    """
+    An asyncio counterpart of CanvasConnection, reading the Canvas REST API directly with
+    aiohttp.  Each method is a coroutine returning the same rows (or frames) as the
+    CanvasConnection method of the same name; courses may be given as canvasapi Course
+    objects, course dictionaries from get_course_list, or ids.
+
+    All requests share one pooled, keep-alive session (gzip is negotiated by aiohttp) of at
+    most max_connections connections, and are admitted by a RateLimitScheduler as in
+    CanvasConnection, so many courses can be harvested at once from a single thread:
+
+        async with AsyncCanvasConnection(url, key) as canvas:
+            courses = await canvas.get_course_list()
+            frames = await canvas.gather('get_assignment_submissions_df', courses)
+
+    As with CanvasConnection's PageFetcher, at most page_window pages of one listing are
+    requested ahead of those read.
+    """
+
+    def __init__(self, canvas_url: str, canvas_key: str, max_connections: int = 64, max_connections_per_host: int = 0,
+                 scheduler: RateLimitScheduler = None, typed: bool = False, metrics: MetricsHook = None,
+                 timeout: float = 300.0, page_window: int = 8):
+        if aiohttp is None:
+            raise ImportError('AsyncCanvasConnection needs aiohttp: pip install python_canvas_layer[async]')
+        self.base_url = canvas_url.rstrip('/') + '/api/v1/'
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.scheduler = scheduler or RateLimitScheduler(initial_concurrency=8, max_concurrency=max_connections)
+        self.typed = typed
+        self.metrics = metrics
+        self.timeout = timeout
+        self.page_window = page_window
+        self.courses = None
+        self._headers = {'Authorization': 'Bearer %s' % canvas_key}
+        self._session = None
+        self._slot_free = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self) -> None:
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_connections_per_host,
+                                             keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self._headers,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._slot_free = asyncio.Condition()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def get_rate_limit_budget(self) -> Dict:
+        return self.scheduler.budget
+
+    def build_frame(self, data, entity: str) -> pd.DataFrame:
+        return build_frame(data, SCHEMAS[entity] if self.typed else None)
+
+    def _count_rows(self, entity: str, course_id, rows: int) -> None:
+        if self.metrics is not None:
+            self.metrics.on_rows(entity, course_id, rows)
+
+    @staticmethod
+    def _course_id(course) -> int:
+        if isinstance(course, dict):
+            return course['id']
+        return int(getattr(course, 'id', course))
+
+    async def gather(self, method: str, courses: List[Any], *args, **kwargs) -> List[Any]:
+        """
+        Runs the named method for each course concurrently, returning the results in course order.
+        """
+        call = getattr(self, method)
+        return await asyncio.gather(*[call(course, *args, **kwargs) for course in courses])
+
+    @staticmethod
+    def _error(status: int, body: bytes, headers) -> CanvasException:
+        # The same exceptions canvasapi raises, so callers can handle both connections alike
+        message = body.decode('utf-8', 'replace')
+        if status == 400:
+            return BadRequest(message)
+        elif status == 401:
+            return InvalidAccessToken(message) if 'WWW-Authenticate' in headers else Unauthorized(message)
+        elif status == 403:
+            return Forbidden(message)
+        elif status == 404:
+            return ResourceDoesNotExist('Not Found')
+        elif status == 409:
+            return Conflict(message)
+        elif status == 422:
+            return UnprocessableEntity(message)
+        return CanvasException('Encountered an error: status code %d' % status)
+
+    async def _acquire(self) -> None:
+        async with self._slot_free:
+            while not self.scheduler.try_acquire():
+                await self._slot_free.wait()
+
+    async def _release(self, headers=None, throttled: bool = False) -> None:
+        self.scheduler.release(headers, throttled)
+        async with self._slot_free:
+            self._slot_free.notify_all()
+
+    async def _get(self, url: str, params: List[Tuple[str, Any]] = None) -> Tuple[Any, Dict[str, str]]:
+        """
+        GETs one page (url is relative to the API root unless absolute), retrying throttled
+        requests after a jittered backoff.  Returns the parsed JSON and the page's Link
+        header URLs by rel ('next', 'last', ...).
+        """
+        await self.open()
+        if not url.startswith('http'):
+            url = self.base_url + url
+        attempt = 0
+        while True:
+            await self._acquire()
+            start = time.perf_counter()
+            try:
+                async with self._session.get(url, params=params) as response:
+                    body = await response.read()
+                    status, headers, links = response.status, response.headers, response.links
+                    request_url = str(response.url)
+            except BaseException:
+                await self._release()
+                raise
+
+            throttled = status == 429 or (status == 403 and b'Rate Limit Exceeded' in body)
+            await self._release(headers, throttled)
+            if self.metrics is not None:
+                self.metrics.on_request(RequestEvent('GET', request_url, status, time.perf_counter() - start,
+                                                     len(body), attempt, throttled))
+            if throttled and attempt < self.scheduler.max_retries:
+                delay = self.scheduler.backoff(attempt)
+                logging.info('Canvas rate limit exceeded for %s, retrying in %.2fs', url, delay)
+                if self.metrics is not None:
+                    self.metrics.on_throttle(url, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            if status >= 400:
+                raise AsyncCanvasConnection._error(status, body, headers)
+            return _json_loads(body), {str(rel): str(link['url']) for rel, link in links.items()}
+
+    async def _get_all(self, endpoint: str, params: List[Tuple[str, Any]] = None) -> List[Dict]:
+        """
+        Reads every page of a listing.  When the first page links to a numbered last page,
+        the rest are requested concurrently, up to page_window at a time; otherwise the next
+        links are followed one at a time.
+        """
+        items, links = await self._get(endpoint, list(params or []) + [('per_page', 100)])
+        url = links.get('next')
+        urls = remaining_pages(url, links.get('last')) if url else None
+        if urls is not None:
+            pending = iter(urls)
+            tasks = deque(asyncio.ensure_future(self._get(url)) for _, url in zip(range(self.page_window), pending))
+            try:
+                while tasks:
+                    page, _ = await tasks.popleft()
+                    url = next(pending, None)
+                    if url is not None:
+                        tasks.append(asyncio.ensure_future(self._get(url)))
+                    items.extend(page)
+            finally:
+                # A page failed: don't fetch the rest, and collect what was already under way
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            return items
+
+        while url:
+            page, links = await self._get(url)
+            items.extend(page)
+            url = links.get('next')
+        return items
+
+    @staticmethod
+    def _project(records: List[Dict], fields: List[str], constants: Dict = None) -> Dict[str, List]:
+        constants = constants or {}
+        return {field: [constants[field]] * len(records) if field in constants else
+                [record.get(field) for record in records] for field in fields}
+
+    async def get_course_list(self) -> List[Dict]:
+        if self.courses is None:
+            await self.get_course_list_full()
+        return self.courses
+
+    async def get_course_list_full(self, **filters) -> List[Dict]:
+        """
+        Lists every course visible to the token (narrowed by any GET /courses filters given).
+        """
+        params = []
+        for name, value in filters.items():
+            if isinstance(value, (list, tuple)):
+                params.extend((name + '[]', item) for item in value)
+            else:
+                params.append((name, value))
+        self.courses = [AsyncCanvasConnection._course_row(course) for course in await self._get_all('courses', params)]
+        self._count_rows('courses', None, len(self.courses))
+        return self.courses
+
+    @staticmethod
+    def _course_row(course: Dict) -> Dict:
+        # The columns of CanvasConnection._course_row
+        row = {'id': course['id'], 'name': course.get('name'), 'start_at': course.get('start_at'),
+               'end_at': course.get('end_at'), 'workflow_state': course.get('workflow_state')}
+        if 'sis_course_id' in course:
+            row['sis_course_id'] = course['sis_course_id']
+        row['is_public'] = course.get('is_public')
+        return row
+
+    async def get_course_list_df(self, courses: List[Dict] = None) -> pd.DataFrame:
+        if courses is None:
+            courses = await self.get_course_list()
+        return self.build_frame(courses, 'courses')
+
+    async def get_course(self, course_id) -> Dict:
+        course, _ = await self._get('courses/%d' % int(course_id))
+        return AsyncCanvasConnection._course_row(course)
+
+    async def get_courses_by_id(self, course_ids: List[Any]) -> List[Dict]:
+        """
+        Fetches just the given courses, concurrently, in the order given.
+        """
+        unique = list(dict.fromkeys(str(course_id) for course_id in course_ids))
+        results = await asyncio.gather(*[self.get_course(course_id) for course_id in unique], return_exceptions=True)
+        courses = []
+        for course_id, result in zip(unique, results):
+            if isinstance(result, ResourceDoesNotExist):
+                logging.warning('Course %s not found', course_id)
+            elif isinstance(result, Forbidden):
+                logging.warning('Unauthorized to access course %s', course_id)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                courses.append(result)
+        return courses
+
+    async def _get_assignment_columns(self, course, count: bool = False) -> Dict[str, List]:
+        # As in CanvasConnection, only the rows handed back to the caller are counted
+        assignments = await self._get_all('courses/%d/assignments' % AsyncCanvasConnection._course_id(course))
+        if count:
+            self._count_rows('assignments', AsyncCanvasConnection._course_id(course), len(assignments))
+        return AsyncCanvasConnection._project(assignments, CanvasConnection.ASSIGNMENT_FIELDS)
+
+    async def get_assignments(self, course) -> List[Dict]:
+        return CanvasConnection._to_rows(await self._get_assignment_columns(course, True))
+
+    async def get_assignments_df(self, course) -> pd.DataFrame:
+        return self.build_frame(await self._get_assignment_columns(course, True), 'assignments')
+
+    async def _get_student_columns(self, course) -> Dict[str, List]:
+        course_id = AsyncCanvasConnection._course_id(course)
+        try:
+            students = await self._get_all('courses/%d/search_users' % course_id, [('enrollment_type[]', 'student')])
+        except ResourceDoesNotExist:
+            logging.warning('No students found for course %s', course_id)
+            students = []
+        except Forbidden:
+            logging.warning('Unauthorized to access students for course %s', course_id)
+            students = []
+        self._count_rows('students', course_id, len(students))
+        return AsyncCanvasConnection._project(students, CanvasConnection.STUDENT_FIELDS)
+
+    async def get_students(self, course) -> List[Dict]:
+        return CanvasConnection._to_rows(await self._get_student_columns(course))
+
+    async def get_students_df(self, course) -> pd.DataFrame:
+        return self.build_frame(await self._get_student_columns(course), 'students')
+
+    async def _get_submission_columns(self, course, bulk: bool = True) -> Dict[str, List]:
+        course_id = AsyncCanvasConnection._course_id(course)
+        assignment_ids = (await self._get_assignment_columns(course))['id']
+        order = {assignment_id: i for i, assignment_id in enumerate(assignment_ids)}
+        if bulk:
+            try:
+                submissions = await self._get_all('courses/%d/students/submissions' % course_id,
+                                                  [('student_ids[]', 'all')])
+                submissions = [sub for sub in submissions if sub.get('assignment_id') in order]
+                columns = CanvasConnection._order_by_assignment(AsyncCanvasConnection._project(
+                    submissions, CanvasConnection.SUBMISSION_FIELDS, {'course_id': course_id}), order)
+                self._count_rows('submissions', course_id, len(submissions))
+                return columns
+            except (Forbidden, ResourceDoesNotExist):
+                logging.warning('Bulk submissions unavailable for course %s, fetching per assignment', course_id)
+
+        # One listing per assignment, all at once; as in CanvasConnection, stop at the first refused one
+        results = await asyncio.gather(*[self._get_all('courses/%d/assignments/%d/submissions' % (course_id, aid))
+                                         for aid in assignment_ids], return_exceptions=True)
+        parts = []
+        for result in results:
+            if isinstance(result, (Forbidden, ResourceDoesNotExist)):
+                break
+            elif isinstance(result, BaseException):
+                raise result
+            parts.append(AsyncCanvasConnection._project(result, CanvasConnection.SUBMISSION_FIELDS,
+                                                        {'course_id': course_id}))
+        columns = CanvasConnection._concat_columns(parts, CanvasConnection.SUBMISSION_FIELDS)
+        self._count_rows('submissions', course_id, len(columns['id']))
+        return columns
+
+    async def get_assignment_submissions(self, course, bulk: bool = True) -> List[Dict]:
+        return CanvasConnection._to_rows(await self._get_submission_columns(course, bulk))
+
+    async def get_assignment_submissions_df(self, course, bulk: bool = True) -> pd.DataFrame:
+        return self.build_frame(await self._get_submission_columns(course, bulk), 'submissions')
+
+    async def get_quizzes(self, course) -> List[Dict]:
+        course_id = AsyncCanvasConnection._course_id(course)
+        try:
+            quizzes = await self._get_all('courses/%d/quizzes' % course_id)
+        except ResourceDoesNotExist:
+            logging.warning('No quizzes found for course %s', course_id)
+            quizzes = []
+        self._count_rows('quizzes', course_id, len(quizzes))
+        return [{'id': quiz['id'], 'title': quiz.get('title'), 'published': quiz.get('published'),
+                 'unlock_at': quiz.get('unlock_at'), 'due_at': quiz.get('due_at'), 'lock_at': quiz.get('lock_at')}
+                for quiz in quizzes]
+
+    async def get_quizzes_df(self, course) -> pd.DataFrame:
+        return self.build_frame(await self.get_quizzes(course), 'quizzes')
+
+    async def _load_modules(self, course) -> List[Tuple[Dict, List[Dict]]]:
+        """
+        Lists a course's modules with their items (include[]=items), listing separately
+        only the items of modules whose items Canvas left out.
+        """
+        course_id = AsyncCanvasConnection._course_id(course)
+        modules = await self._get_all('courses/%d/modules' % course_id, [('include[]', 'items')])
+
+        async def items(module):
+            inline = module.get('items')
+            if inline is not None and len(inline) >= module.get('items_count', len(inline)):
+                return inline
+            return await self._get_all('courses/%d/modules/%d/items' % (course_id, module['id']))
+
+        return list(zip(modules, await asyncio.gather(*[items(module) for module in modules])))
+
+    async def get_modules(self, course) -> List[Dict]:
+        modules = []
+        for module, _ in await self._load_modules(course):
+            row = {'id': module['id'], 'name': module.get('name')}
+            if 'published' in module:
+                row['published'] = module['published']
+            row['unlock_at'] = module.get('unlock_at')
+            modules.append(row)
+        self._count_rows('modules', AsyncCanvasConnection._course_id(course), len(modules))
+        return modules
+
+    async def get_modules_df(self, course) -> pd.DataFrame:
+        return self.build_frame(await self.get_modules(course), 'modules')
+
+    async def get_module_items(self, course) -> List[Dict]:
+        module_items = []
+        for module, items in await self._load_modules(course):
+            for item in items:
+                # The same columns as CanvasConnection.get_module_items
+                details = {'module_id': module['id'], 'module_name': module.get('name'), 'id': item['id'],
+                           'title': item.get('title'), 'type': item.get('type')}
+                if 'html_url' in item:
+                    details['html_url'] = item['html_url']
+                if item.get('type') == 'Quiz':
+                    details['url'] = item.get('url')
+                if item.get('type') == 'ExternalUrl':
+                    details['external_url'] = item.get('external_url')
+                module_items.append(details)
+        self._count_rows('module_items', AsyncCanvasConnection._course_id(course), len(module_items))
+        return module_items
+
+    async def get_module_items_df(self, course) -> pd.DataFrame:
+        return self.build_frame(await self.get_module_items(course), 'module_items')
+
+    async def get_student_summaries_df(self, course) -> pd.DataFrame:
+        course_id = AsyncCanvasConnection._course_id(course)
+        try:
+            summaries = await self._get_all('courses/%d/analytics/student_summaries' % course_id)
+        except (Forbidden, ResourceDoesNotExist):
+            return pd.DataFrame()
+        self._count_rows('summaries', course_id, len(summaries))
+        return self.build_frame([{'id': item['id'],
+                                  'page_views': item.get('page_views'),
+                                  'max_page_views': item.get('max_page_views'),
+                                  'participations': item.get('participations'),
+                                  'max_participations': item.get('max_participations'),
+                                  'course_id': course_id} for item in summaries], 'summaries')
+
+    # The get_*_records of CanvasConnection, built from the same columns
+
+    async def get_course_records(self) -> RecordBatch:
+        fields = CanvasConnection.COURSE_RECORD_FIELDS
+        return CanvasConnection._record_batch(course_info.CourseDetails,
+                                              CanvasConnection._row_columns(await self.get_course_list(), fields),
+                                              fields)
+
+    async def get_assignment_records(self, course) -> RecordBatch:
+        return CanvasConnection._record_batch(course_info.Assignment, await self._get_assignment_columns(course, True),
+                                              CanvasConnection.ASSIGNMENT_RECORD_FIELDS)
+
+    async def get_student_records(self, course) -> RecordBatch:
+        return CanvasConnection._person_batch(await self._get_student_columns(course))
+
+    async def get_submission_records(self, course, bulk: bool = True) -> RecordBatch:
+        return CanvasConnection._record_batch(course_info.Submission, await self._get_submission_columns(course, bulk),
+                                              CanvasConnection.SUBMISSION_RECORD_FIELDS)
+
+    async def get_module_records(self, course) -> RecordBatch:
+        fields = CanvasConnection.MODULE_RECORD_FIELDS
+        return CanvasConnection._record_batch(course_info.Module,
+                                              CanvasConnection._row_columns(await self.get_modules(course), fields),
+                                              fields)
@@ -0,0 +1,247 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+class CacheEntry(object):
+    __slots__ = ('url', 'body', 'headers', 'etag', 'stored_at')
+
+    def __init__(self, url: str, body: bytes, headers: Dict[str, str], etag: Optional[str], stored_at: float):
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.etag = etag
+        self.stored_at = stored_at
+
+    def to_response(self) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.url = self.url
+        response.encoding = 'utf-8'
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.body
+        return response
+
+
+class ResponseCache(object):
+    """
+    Base class for caches of successful GET responses, keyed by URL, parameters and token.
+
+    Each endpoint has a time-to-live (the first matching pattern in ttls, else default_ttl).
+    Within it a cached response is served without contacting Canvas; after it, a response
+    with an ETag is revalidated with If-None-Match.  Subclasses provide the storage (and its
+    eviction policy) through _get, _put and _touch.
+    """
+
+    # Seconds a response stays fresh, by endpoint.  Submissions change constantly, so
+    # they are always revalidated; course shells and modules rarely change within a run.
+    DEFAULT_TTLS = [
+        (r'/submissions', 0),
+        (r'/analytics/', 3600),
+        (r'/courses(\?|$)|/courses/\d+(\?|$)', 3600),
+        (r'/modules', 900),
+    ]
+
+    # Response headers worth keeping: pagination links, the validator, and the body type
+    KEPT_HEADERS = ('Link', 'ETag', 'Content-Type')
+
+    def __init__(self, ttls: List[Tuple[str, float]] = None, default_ttl: float = 300.0):
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in
+                     (ttls if ttls is not None else ResponseCache.DEFAULT_TTLS)]
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            lookups = self.hits + self.revalidated + self.misses
+            return {'hits': self.hits,
+                    'revalidated': self.revalidated,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': (self.hits + self.revalidated) / lookups if lookups else 0.0}
+
+    def _count(self, stat: str) -> None:
+        with self._stats_lock:
+            setattr(self, stat, getattr(self, stat) + 1)
+
+    def ttl(self, url: str) -> float:
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    @staticmethod
+    def key(method: str, url: str, params, headers) -> str:
+        # Different tokens can see different data, so the token is part of the key
+        if isinstance(params, dict):
+            params = list(params.items())
+        token = (headers or {}).get('Authorization', '')
+        raw = json.dumps([method, url, sorted([list(p) for p in (params or [])], key=str), token], default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def lookup(self, key: str, url: str) -> Tuple[Optional[CacheEntry], bool]:
+        """
+        Returns the cached entry (or None) and whether it is still fresh; a fresh entry counts as a hit.
+        """
+        entry = self._get(key)
+        if entry is None:
+            return None, False
+        fresh = time.time() - entry.stored_at < self.ttl(url)
+        if fresh:
+            self._count('hits')
+        return entry, fresh
+
+    def store(self, key: str, response: requests.Response) -> None:
+        """
+        Records a response fetched after a miss, keeping it if it was successful.
+        """
+        self._count('misses')
+        if response.status_code != 200:
+            return
+        headers = {name: response.headers[name] for name in ResponseCache.KEPT_HEADERS if name in response.headers}
+        self._put(key, CacheEntry(response.url, response.content, headers, response.headers.get('ETag'), time.time()))
+
+    def refresh(self, key: str) -> None:
+        """
+        Marks an entry that Canvas revalidated (304 Not Modified) as fresh again.
+        """
+        self._count('revalidated')
+        self._touch(key, time.time())
+
+    def _get(self, key: str) -> Optional[CacheEntry]:
+        raise NotImplementedError()
+
+    def _put(self, key: str, entry: CacheEntry) -> None:
+        raise NotImplementedError()
+
+    def _touch(self, key: str, stored_at: float) -> None:
+        raise NotImplementedError()
+
+
+class MemoryResponseCache(ResponseCache):
+    """
+    An in-process LRU cache bounded by total body size.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self._entries[key] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+                self._count('evictions')
+
+    def _touch(self, key: str, stored_at: float) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.stored_at = stored_at
+
+
+class DiskResponseCache(ResponseCache):
+    """
+    A SQLite-backed cache that persists across runs, evicting least recently used
+    responses once the stored bodies exceed max_bytes.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            # A cache can afford to lose its last writes on a crash
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=OFF')
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, url TEXT, etag TEXT, '
+                             'headers TEXT, body BLOB, size INTEGER, stored_at REAL, last_access REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)')
+            self.size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock, self._db:
+            row = self._db.execute('SELECT url, body, headers, etag, stored_at FROM responses WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+        url, body, headers, etag, stored_at = row
+        return CacheEntry(url, body, json.loads(headers), etag, stored_at)
+
+    def _put(self, key: str, entry: CacheEntry) -> None:
+        with self._lock, self._db:
+            old = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            if old:
+                self.size -= old[0]
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (key, entry.url, entry.etag, json.dumps(entry.headers), entry.body, len(entry.body),
+                              entry.stored_at, time.time()))
+            self.size += len(entry.body)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Called with the lock held: drop least recently used entries until back under the limit
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall():
+            if self.size <= self.max_bytes:
+                break
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.size -= size
+            self._count('evictions')
+
+    def _touch(self, key: str, stored_at: float) -> None:
+        with self._lock, self._db:
+            self._db.execute('UPDATE responses SET stored_at = ?, last_access = ? WHERE key = ?',
+                             (stored_at, time.time(), key))
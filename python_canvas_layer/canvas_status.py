@@ -15,99 +15,365 @@
 #####################################################################################################################
 
 from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.graphql_canvas import GraphQLCanvasConnection
+from python_canvas_layer.incremental import SyncStore, IncrementalSync
+from python_canvas_layer.cache import ResponseCache
+from python_canvas_layer.sinks import FrameSink
+from python_canvas_layer.checkpoint import CheckpointStore
+from python_canvas_layer.metrics import MetricsHook
+from python_canvas_layer.schemas import convert_column
 from python_canvas_layer.course_info import CourseWrapper
+from canvasapi.exceptions import CanvasException
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from datetime import datetime
 import pytz
 import logging
+import requests
+import threading
 
-from typing import Tuple, Any, List
+from typing import Tuple, Any, Callable, Iterable, Iterator, List
 
 class CanvasStatus(CourseWrapper):
-    def __init__(self, canvas_url, canvas_key, filter_course_ids: List[str], options: List[str], active: bool):
-        self.canvas = CanvasConnection(canvas_url, canvas_key)
+    # Order in which the options are run (and reported) for each course
+    OPTION_ORDER = ['quizzes', 'modules', 'students', 'assignments', 'summaries', 'submissions']
+
+    # Options that a sink receives in batches as the pages arrive, with what is logged for them
+    STREAMED_OPTIONS = {'students': 'enrolled students',
+                        'assignments': 'course assignments',
+                        'submissions': 'assignment submissions'}
+
+    BACKENDS = {'rest': CanvasConnection, 'graphql': GraphQLCanvasConnection}
+
+    def __init__(self, canvas_url, canvas_key, filter_course_ids: List[str], options: List[str], active: bool,
+                 bulk_submissions: bool = True, max_workers: int = 1, account_id: int = None, term_id: int = None,
+                 sync_store: str = None, cache: ResponseCache = None, raw_json: bool = False,
+                 typed: bool = False, sink: FrameSink = None, batch_size: int = CanvasConnection.BATCH_SIZE,
+                 metrics: MetricsHook = None, page_workers: int = 4, backend: str = 'rest',
+                 checkpoint: str = None):
+        """
+        max_workers > 1 harvests courses, and the options within each course, concurrently on a
+        pool of that many threads.  Results and logged progress come back in the same order as
+        a sequential run.
+
+        Courses are fetched directly when filter_course_ids is given; otherwise, when active
+        is set, only courses Canvas reports as current are listed (for the whole account if
+        account_id is given, optionally restricted to term_id).
+
+        With sync_store (the path of a SQLite file), submissions are kept in that store and
+        only the changes since the previous run are fetched (see IncrementalSync).  A
+        ResponseCache, if given, is used for all of the connection's GETs, raw_json selects
+        the connection's JSON fast path, and typed its schema-typed frames.
+
+        With a sink, frames are written to it rather than collected and returned, so memory
+        does not grow with the number of courses.  Students, assignments and submissions
+        are streamed in batches of at most batch_size rows as Canvas returns them (unless a
+        sync_store is used, which yields each course's table whole); with max_workers > 1
+        batches of different courses may interleave.  The caller closes the sink.
+
+        Progress (course names and row counts) is logged at INFO.  A MetricsHook, if given,
+        receives the connection's request and row events, and its on_run_end is called once
+        get_course_info has finished.
+
+        page_workers is the number of pages of one listing that may be read at a time; see
+        CanvasConnection.  backend 'graphql' reads assignments and submissions through
+        Canvas' GraphQL API (see GraphQLCanvasConnection) rather than the REST API ('rest');
+        it reads the rest of the REST API as raw JSON, so it implies raw_json.
+
+        With checkpoint (the path of a SQLite file; see CheckpointStore), each finished
+        (course, option) unit is recorded along with its frame, and a later run with the same
+        file skips it and returns the recorded frame instead.  A unit that fails with a Canvas
+        or HTTP error, including the refusals that are otherwise logged and skipped, is
+        recorded as failed and the run carries on; the failures are logged at the end (see
+        get_errors) and retried by the next run.  Frames streamed to a sink are not kept in the
+        file, and a unit that fails part way may already have written some batches to it.
+        """
+        if backend not in CanvasStatus.BACKENDS:
+            raise ValueError('backend must be one of %s' % ', '.join(CanvasStatus.BACKENDS))
+        self.canvas = CanvasStatus.BACKENDS[backend](canvas_url, canvas_key, cache=cache,
+                                                     raw_json=raw_json or backend == 'graphql',
+                                                     typed=typed, metrics=metrics, page_workers=page_workers,
+                                                     strict=checkpoint is not None)
         self.course_id_list = filter_course_ids
         self.options = options
         self.active = active
+        self.bulk_submissions = bulk_submissions
+        self.max_workers = max_workers
+        self.account_id = account_id
+        self.term_id = term_id
+        self.sync = IncrementalSync(self.canvas, SyncStore(sync_store)) if sync_store else None
+        self.sink = sink
+        self.batch_size = batch_size
+        self._sink_lock = threading.Lock()
+        self.checkpoint = CheckpointStore(checkpoint) if checkpoint else None
+        if max_workers > 1:
+            self.canvas.set_max_connections(max_workers)
 
-        
-    def get_course_info(self) -> Tuple[Any]:
-        canvas_courses = self.canvas.get_course_list_df()
-        all_assignments = []
-        all_students = []
-        all_submissions = []
-        all_student_summaries = []
+    @staticmethod
+    def _is_current(course, rightnow: datetime) -> bool:
+        """
+        Whether a course is being offered now, by its own dates or, where it has none, its
+        term's (if Canvas included the term).  A course with no end date has not ended.
+        """
+        term = getattr(course, 'term', None) or {}
+        start = getattr(course, 'start_at', None) or term.get('start_at')
+        end = getattr(course, 'end_at', None) or term.get('end_at')
+        return ((start is None or pd.to_datetime(start, utc=True) <= rightnow) and
+                (end is None or rightnow <= pd.to_datetime(end, utc=True)))
 
-        logging.debug('Getting course info from Canvas for {}'.format(self.course_id_list))
+    def _get_courses(self) -> List[Any]:
+        if self.course_id_list and len(self.course_id_list):
+            candidates = self.canvas.get_courses_by_id(self.course_id_list)
+        elif self.active:
+            # Canvas has already picked the current courses, by their dates or their terms'
+            return self.canvas.get_active_course_objs(self.account_id, self.term_id)
+        else:
+            return self.canvas.get_course_list_objs()
 
+        # Courses asked for by id are checked here, if only active ones are wanted
+        courses = []
         rightnow = datetime.utcnow().replace(tzinfo=pytz.utc)
-        for the_course in self.canvas.get_course_list_objs():
+        for the_course in candidates:
+            if not self.active or CanvasStatus._is_current(the_course, rightnow):
+                logging.debug('{} through {}'.format(the_course.start_at, the_course.end_at))
+                courses.append(the_course)
+        return courses
+
+    def _write(self, entity: str, course_id, frame: pd.DataFrame) -> None:
+        with self._sink_lock:
+            self.sink.write(entity, course_id, frame)
+
+    def _finish_course(self, course_id) -> None:
+        with self._sink_lock:
+            self.sink.finish_course(course_id)
+
+    def _stream_option(self, the_course, option: str) -> Tuple[Any, List[str]]:
+        """
+        Fetch one of the STREAMED_OPTIONS for one course, writing each batch to the sink.
+        """
+        if option == 'students':
+            batches = self.canvas.iter_students(the_course, self.batch_size)
+        elif option == 'assignments':
+            batches = self.canvas.iter_assignments(the_course, self.batch_size)
+        else:
+            batches = self.canvas.iter_assignment_submissions(the_course, self.batch_size, self.bulk_submissions)
+
+        count = 0
+        for rows in batches:
+            frame = self.canvas.build_frame(rows, option)
+            self._set_course_id(frame, the_course.id)
+            self._write(option, the_course.id, frame)
+            count += len(frame)
+
+        lines = ['\nRecording ' + CanvasStatus.STREAMED_OPTIONS[option]]
+        if count:
+            lines.append(str(count))
+        return None, lines
+
+    def _set_course_id(self, frame: pd.DataFrame, course_id: int) -> None:
+        # Set after build_frame, so a typed frame needs it converted as the schemas declare it
+        if self.canvas.typed:
+            frame['course_id'] = convert_column([course_id] * len(frame), 'id')
+        else:
+            frame['course_id'] = course_id
+
+    def _get_option(self, the_course, option: str) -> Tuple[Any, List[str]]:
+        """
+        Fetch one option for one course.  Returns the DataFrame to record (or None) along with
+        the lines to log, so that concurrent runs can report in order.
+        """
+        if self.sink and not self.sync and option in CanvasStatus.STREAMED_OPTIONS:
+            return self._stream_option(the_course, option)
+
+        lines = []
+        result = None
+
+        # OPTIONAL but not really needed since Quizzes are also Assignments?
+        if option == 'quizzes':
+            quizzes = self.canvas.get_quizzes_df(the_course)
+            if len(quizzes):
+                self._set_course_id(quizzes, the_course.id)
+                lines.append('\nQuizzes:')
+                lines.append(str(quizzes))
 
-            if self.course_id_list and len(self.course_id_list) and the_course.id not in self.course_id_list:
-                continue
+        # OPTIONAL: do we want modules and module items?
+        elif option == 'modules':
+            modules, module_items = self.canvas.get_modules_and_items_df(the_course)
+            if len(modules):
+                self._set_course_id(modules, the_course.id)
+                lines.append('\nModules:')
+                lines.append(str(modules))
+            if len(module_items):
+                lines.append('\nItems in modules:')
+                lines.append(str(module_items))
+
+        elif option == 'students':
+            lines.append('\nRecording enrolled students')
+            students = self.canvas.get_students_df(the_course)
+            if len(students):
+                self._set_course_id(students, the_course.id)
+                lines.append(str(len(students)))
+                result = students
+
+        elif option == 'assignments':
+            lines.append('\nRecording course assignments')
+            assignments = self.canvas.get_assignments_df(the_course)
+            if len(assignments):
+                self._set_course_id(assignments, the_course.id)
+                lines.append(str(len(assignments)))
+                result = assignments
+
+        # Get general student status, including late days etc
+        elif option == 'summaries':
+            lines.append('\nRecording student summaries')
+            student_summaries = self.canvas.get_student_summaries_df(the_course)
+            if len(student_summaries):
+                lines.append(str(len(student_summaries)))
+                result = student_summaries
+
+        elif option == 'submissions':
+            lines.append('\nRecording assignment submissions')
+            if self.sync:
+                assignments = self.sync.get_assignment_submissions_df(the_course)
             else:
-                print (the_course.name)
-
-            # Ensure the course is currently being offered (ie active)
-            if (True or (not self.active or (the_course.end_at and \
-            (pd.to_datetime(the_course.start_at, utc=True) <= rightnow and rightnow <= pd.to_datetime(the_course.end_at, utc=True))))):
-
-                logging.debug ('{} through {}'.format(the_course.start_at, the_course.end_at))
-
-                # OPTIONAL but not really needed since Quizzes are also Assignments?
-                if 'quizzes' in self.options:
-                    quizzes = self.canvas.get_quizzes_df(the_course)
-                    if len(quizzes):
-                        quizzes['course_id'] = the_course.id
-                        print ('\nQuizzes:')
-                        print(quizzes)
-
-                # OPTIONAL: do we want modules and module items?
-                if 'modules' in self.options:
-                    modules = self.canvas.get_modules_df(the_course)
-                    if len(modules):
-                        modules['course_id'] = the_course.id
-                        print ('\nModules:')
-                        print(modules)
-                    module_items = self.canvas.get_module_items_df(the_course)
-                    if len(module_items):
-                        print ('\nItems in modules:')
-                        print(module_items)
-
-                if 'students' in self.options:
-                    print ('\nRecording enrolled students')
-                    students = self.canvas.get_students_df(the_course)
-                    if len(students):
-                        students['course_id'] = the_course.id
-                        print (len(students))
-                        all_students.append(students)
-
-                if 'assignments' in self.options:
-                    print ('\nRecording course assignments')
-                    assignments = self.canvas.get_assignments_df(the_course)
-                    if len(assignments):
-                        assignments['course_id'] = the_course.id
-                        print(len(assignments))
-                        all_assignments.append(assignments)
-
-                # Get general student status, including late days etc
-                if 'summaries' in self.options:
-                    print ('\nRecording student summaries')
-                    student_summaries = self.canvas.get_student_summaries_df(the_course)
-                    if len(student_summaries):
-                        print (len(student_summaries))
-                        all_student_summaries.append(student_summaries)
-
-                if 'submissions' in self.options:
-                    print ('\nRecording assignment submissions')
-                    assignments = self.canvas.get_assignment_submissions_df(the_course)
-                    if len(assignments):
-                        assignments['course_id'] = the_course.id
-                        print(len(assignments))
-                        all_submissions.append(assignments)
-
-        return ( canvas_courses,
-                all_students,
-                all_assignments,
-                all_submissions,
-                all_student_summaries)
\ No newline at end of file
+                assignments = self.canvas.get_assignment_submissions_df(the_course, self.bulk_submissions)
+            if len(assignments):
+                self._set_course_id(assignments, the_course.id)
+                lines.append(str(len(assignments)))
+                result = assignments
+
+        return result, lines
+
+    def _run_unit(self, the_course, option: str) -> Tuple[Any, List[str], Any]:
+        """
+        Runs _get_option for one unit, unless the checkpoint has it finished already.  With a
+        checkpoint, a Canvas or HTTP error is returned as the third element rather than raised.
+        """
+        if self.checkpoint is None:
+            return self._get_option(the_course, option) + (None,)
+        if self.checkpoint.is_done(the_course.id, option):
+            return self.checkpoint.get_frame(the_course.id, option), ['\n%s already recorded' % option], None
+        try:
+            return self._get_option(the_course, option) + (None,)
+        except (CanvasException, requests.RequestException) as error:
+            return None, [], error
+
+    def get_errors(self) -> pd.DataFrame:
+        """
+        The units of this and earlier runs that failed on their last attempt (empty without a
+        checkpoint, since the first error then ends the run).
+        """
+        if self.checkpoint is None:
+            return pd.DataFrame(columns=['course_id', 'option', 'attempts', 'error', 'updated_at'])
+        return self.checkpoint.get_errors()
+
+    def get_course_info(self) -> Tuple[Any]:
+        """
+        Returns (courses, students, assignments, submissions, summaries): a frame of the
+        courses harvested, then a list of frames per option with one frame per course.
+
+        The courses frame holds only the courses harvested: those of filter_course_ids, or
+        the current ones when active is set, or else every course visible to the token.
+        Earlier versions always listed every visible course there; for that list, call
+        CanvasConnection.get_course_list_df.
+        """
+        logging.debug('Getting course info from Canvas for {}'.format(self.course_id_list))
+
+        courses = self._get_courses()
+        canvas_courses = self.canvas.get_course_list_df(courses)
+        # Course id 0 stands for the course list in the checkpoint
+        if self.sink and not (self.checkpoint and self.checkpoint.is_done(0, 'courses')):
+            self._write('courses', None, canvas_courses)
+            self._finish_course(None)
+            if self.checkpoint:
+                self.checkpoint.mark_done(0, 'courses')
+        results = self._harvest(courses)
+        self._end_run(self.get_errors())
+        return (canvas_courses,) + results
+
+    def _harvest(self, courses: List[Any]) -> Tuple[List]:
+        """
+        Runs the options over courses: the students, assignments, submissions and summaries
+        lists of get_course_info.
+        """
+        results = {'students': [], 'assignments': [], 'summaries': [], 'submissions': []}
+        options = [option for option in CanvasStatus.OPTION_ORDER if option in self.options]
+        units = [(the_course, option) for the_course in courses for option in options]
+
+        # Listings that several options read (assignments, modules) are fetched once per course
+        with self.canvas.run_scope():
+            pool = ThreadPoolExecutor(max_workers=self.max_workers) if self.max_workers > 1 else None
+            try:
+                # Both maps yield in submission order, so output is reported course by course either way
+                if pool:
+                    outputs = CanvasStatus._bounded_map(pool, lambda unit: self._run_unit(*unit), units,
+                                                        2 * self.max_workers)
+                else:
+                    outputs = map(lambda unit: self._run_unit(*unit), units)
+
+                current = None
+                for (the_course, option), (result, lines, error) in zip(units, outputs):
+                    if the_course is not current:
+                        if current is not None:
+                            self.canvas.release_course(current.id)
+                            if self.sink:
+                                self._finish_course(current.id)
+                        logging.info(the_course.name)
+                        current = the_course
+                    for line in lines:
+                        logging.info(line)
+                    if error is not None:
+                        logging.warning('Failed to get %s for course %s: %s', option, the_course.id, error)
+                        self.checkpoint.mark_failed(the_course.id, option, error)
+                        continue
+                    done = self.checkpoint is not None and self.checkpoint.is_done(the_course.id, option)
+                    if result is not None and self.sink:
+                        if not done:
+                            self._write(option, the_course.id, result)
+                    elif result is not None:
+                        results[option].append(result)
+                    if self.checkpoint and not done:
+                        self.checkpoint.mark_done(the_course.id, option, None if self.sink else result)
+                if current is not None and self.sink:
+                    self._finish_course(current.id)
+            finally:
+                if pool:
+                    pool.shutdown(cancel_futures=True)
+
+        return (results['students'],
+                results['assignments'],
+                results['submissions'],
+                results['summaries'])
+
+    @staticmethod
+    def _bounded_map(pool: ThreadPoolExecutor, fn: Callable, items: Iterable, window: int) -> Iterator:
+        """
+        pool.map(fn, items), yielding the results in order, but with at most window items
+        submitted and not yet yielded, so that finished units do not pile up (with their
+        frames) behind a slow one, and a large run is not queued all at once.
+        """
+        pending = iter(items)
+        futures = deque(pool.submit(fn, item) for _, item in zip(range(window), pending))
+        try:
+            while futures:
+                result = futures.popleft().result()
+                item = next(pending, None)
+                if item is not None:
+                    futures.append(pool.submit(fn, item))
+                yield result
+        finally:
+            # The caller stopped early or a unit raised: don't start the rest
+            for future in futures:
+                future.cancel()
+
+    def _end_run(self, errors: pd.DataFrame) -> None:
+        # Logs the units that failed and tells the metrics hook the run is over
+        if len(errors):
+            with pd.option_context('display.width', 200, 'display.max_columns', None,
+                                   'display.max_colwidth', 100):
+                logging.warning('%d course options failed, and will be retried by the next run with this '
+                                'checkpoint:\n%s', len(errors), errors)
+
+        if self.canvas.metrics is not None:
+            self.canvas.metrics.on_run_end()
\ No newline at end of file
@@ -0,0 +1,102 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from datetime import datetime
+import pandas as pd
+import pickle
+import pytz
+import sqlite3
+import threading
+
+from typing import Optional
+
+
+class CheckpointStore(object):
+    """
+    A SQLite file recording the progress of a CanvasStatus run, one (course, option) unit
+    at a time: which units have finished (with the frame each produced, unless it went to a
+    sink) and, for each unit that failed, how often and with what error.  A run given the
+    same file skips the finished units and retries the failed ones.  Delete the file, or
+    call clear(), to start over.
+
+    Several processes may share the file (as ShardedCanvasStatus's workers do), each
+    writing its own units: it is kept in WAL mode, so that reads do not wait for writes,
+    and a write waits up to TIMEOUT seconds for another process's to finish.
+    """
+
+    TIMEOUT = 120
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=CheckpointStore.TIMEOUT, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._lock = threading.RLock()
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS checkpoint_units (course_id INTEGER, option TEXT, '
+                             'status TEXT, attempts INTEGER, error TEXT, updated_at TEXT, frame BLOB, '
+                             'PRIMARY KEY (course_id, option))')
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def clear(self) -> None:
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM checkpoint_units')
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.utcnow().replace(tzinfo=pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def is_done(self, course_id: int, option: str) -> bool:
+        with self._lock:
+            row = self._db.execute('SELECT status FROM checkpoint_units WHERE course_id = ? AND option = ?',
+                                   (course_id, option)).fetchone()
+            return row is not None and row[0] == 'done'
+
+    def get_frame(self, course_id: int, option: str) -> Optional[pd.DataFrame]:
+        """
+        The frame a finished unit produced, or None if it produced none or it was not kept.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT frame FROM checkpoint_units WHERE course_id = ? AND option = ?',
+                                   (course_id, option)).fetchone()
+        return pickle.loads(row[0]) if row and row[0] is not None else None
+
+    def mark_done(self, course_id: int, option: str, frame: pd.DataFrame = None) -> None:
+        data = pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL) if frame is not None else None
+        with self._lock, self._db:
+            self._db.execute('INSERT INTO checkpoint_units VALUES (?, ?, \'done\', 1, NULL, ?, ?) '
+                             'ON CONFLICT (course_id, option) DO UPDATE SET status = \'done\', '
+                             'attempts = attempts + 1, error = NULL, updated_at = excluded.updated_at, '
+                             'frame = excluded.frame',
+                             (course_id, option, CheckpointStore._now(), data))
+
+    def mark_failed(self, course_id: int, option: str, error: BaseException) -> None:
+        message = '%s: %s' % (type(error).__name__, error)
+        with self._lock, self._db:
+            self._db.execute('INSERT INTO checkpoint_units VALUES (?, ?, \'failed\', 1, ?, ?, NULL) '
+                             'ON CONFLICT (course_id, option) DO UPDATE SET status = \'failed\', '
+                             'attempts = attempts + 1, error = excluded.error, updated_at = excluded.updated_at',
+                             (course_id, option, message, CheckpointStore._now()))
+
+    def get_errors(self) -> pd.DataFrame:
+        """
+        The units whose last attempt failed: course_id, option, attempts, error and when.
+        """
+        with self._lock:
+            return pd.read_sql_query('SELECT course_id, option, attempts, error, updated_at FROM checkpoint_units '
+                                     'WHERE status = \'failed\' ORDER BY course_id, option', self._db)
@@ -15,27 +15,62 @@
 #####################################################################################################################
 
 from abc import ABCMeta, abstractmethod
-from typing import List, Tuple, Any
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Type
 from datetime import datetime
 
 import pandas as pd
 
-class CourseDetails:
+class Record(object):
+    """
+    Base of the record types below: a fixed set of fields, kept in __slots__ rather than in
+    a dictionary per instance.  Fields are given by position or name (missing ones are None),
+    and a record iterates over its values in field order.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values, **fields):
+        names = self.__slots__
+        if len(values) > len(names):
+            raise TypeError('{} takes at most {} fields'.format(type(self).__name__, len(names)))
+        for name, value in zip(names, values):
+            setattr(self, name, value)
+        for name in names[len(values):]:
+            setattr(self, name, fields.pop(name, None))
+        if fields:
+            raise TypeError('{} has no fields {}'.format(type(self).__name__, ', '.join(fields)))
+
+    def __iter__(self):
+        for name in self.__slots__:
+            yield getattr(self, name)
+
+    def __eq__(self, other):
+        return type(other) is type(self) and tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __str__(self):
+        return ', '.join('{}'.format(value) for value in self)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__,
+                               ', '.join('{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(zip(self.__slots__, self))
+
+class CourseDetails(Record):
+    __slots__ = ('course_uuid', 'name', 'starts', 'ends')
     course_uuid: str
     name: str
     starts: datetime
     ends: datetime
 
-    def __str__(self, key):
-        return '{}, {}, {}, {}'.format(self.course_uuid, self.name, self.starts, self.ends)
-    
-    def __iter__(self):
-        yield self.course_uuid
-        yield self.name
-        yield self.starts
-        yield self.ends 
-
-class Assignment:
+class Assignment(Record):
+    # CanvasConnection fills late with the assignment's lock_at, the last time submissions are
+    # accepted; Canvas assignments carry no extra-credit points or weight of their own (weights
+    # belong to assignment groups), so ec_points and weight are left None
+    __slots__ = ('assignment_uuid', 'name', 'due', 'late', 'points', 'ec_points', 'weight')
     assignment_uuid: str
     name: str
     due: datetime
@@ -44,7 +79,8 @@ class Assignment:
     ec_points: int
     weight: float
 
-class Person:
+class Person(Record):
+    __slots__ = ('data_id', 'student_id', 'name', 'emails', 'user_id', 'role')
     data_id: str
     student_id: str
     name: str
@@ -52,18 +88,70 @@ class Person:
     user_id: str
     role: str
 
-    def __str__(self, key):
-        return '{}, {}, {}, {}, {}, {}'.format(self.data_id, self.student_id, self.name, self.emails, self.user_id, self.role)
-    
-    def __iter__(self):
-        yield self.data_id
-        yield self.student_id
-        yield self.name
-        yield self.emails
-        yield self.user_id
-        yield self.role
-
-class CourseApi:
+class Submission(Record):
+    __slots__ = ('submission_uuid', 'assignment_uuid', 'data_id', 'score', 'grade', 'submitted', 'graded',
+                 'late', 'missing', 'excused')
+    submission_uuid: str
+    assignment_uuid: str
+    # The Person.data_id of the student
+    data_id: str
+    score: float
+    grade: str
+    submitted: datetime
+    graded: datetime
+    late: bool
+    missing: bool
+    excused: bool
+
+class Module(Record):
+    __slots__ = ('module_uuid', 'name', 'published', 'unlock')
+    module_uuid: str
+    name: str
+    published: bool
+    unlock: datetime
+
+class RecordBatch(object):
+    """
+    Many records of one type, held as one list per field instead of an object per row.
+    Records are built only when indexed or iterated, and to_frame builds a DataFrame from
+    the lists without making any records (pandas converts each list to an array, so the
+    frame holds a copy of the values).
+    """
+    __slots__ = ('record_type', 'columns')
+
+    def __init__(self, record_type: Type[Record], columns: Dict[str, List] = None):
+        columns = columns or {}
+        lengths = set(len(values) for values in columns.values())
+        if len(lengths) > 1:
+            raise ValueError('Columns of a RecordBatch must have the same length')
+        length = lengths.pop() if lengths else 0
+        self.record_type = record_type
+        self.columns = {name: columns[name] if name in columns else [None] * length
+                        for name in record_type.__slots__}
+
+    @staticmethod
+    def from_records(record_type: Type[Record], records: Iterable[Record]) -> 'RecordBatch':
+        columns = {name: [] for name in record_type.__slots__}
+        appends = [column.append for column in columns.values()]
+        for record in records:
+            for append, value in zip(appends, record):
+                append(value)
+        return RecordBatch(record_type, columns)
+
+    def __len__(self) -> int:
+        return len(self.columns[self.record_type.__slots__[0]])
+
+    def __getitem__(self, index: int) -> Record:
+        return self.record_type(*(values[index] for values in self.columns.values()))
+
+    def __iter__(self) -> Iterator[Record]:
+        for values in zip(*self.columns.values()):
+            yield self.record_type(*values)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.columns, columns=list(self.record_type.__slots__))
+
+class CourseApi(metaclass=ABCMeta):
     @abstractmethod
     def get_course_list(self) -> List[CourseDetails]:
          raise NotImplementedError()
@@ -99,6 +187,28 @@ class CourseApi:
     def get_assignment_submissions_df(self, course) -> pd.DataFrame:
         return pd.DataFrame(self.get_assignment_submissions(course))
 
+    # The same data as typed records, stored column-wise (coroutines in AsyncCanvasConnection)
+
+    @abstractmethod
+    def get_course_records(self) -> RecordBatch:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_assignment_records(self, course) -> RecordBatch:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_student_records(self, course) -> RecordBatch:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_submission_records(self, course) -> RecordBatch:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_module_records(self, course) -> RecordBatch:
+        raise NotImplementedError()
+
  
     # @abstractmethod
     # def get_instructors(self, course) -> List[Person]:
@@ -107,7 +217,7 @@ class CourseApi:
     # def get_instructors_df(self) -> pd.DataFrame:
     #     return pd.DataFrame(self.get_instructors())
 
-class CourseWrapper(object):
+class CourseWrapper(metaclass=ABCMeta):
     @abstractmethod
     def get_course_info(self) -> Tuple[Any]:
         """ 
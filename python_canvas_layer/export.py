@@ -0,0 +1,216 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+Columnar export of CanvasStatus results.
+
+ParquetSink writes each entity to a dataset partitioned by course, in Parquet or in the
+Arrow IPC file format, which can be memory-mapped:
+
+    <directory>/<entity>/course_id=<id>/<run>-<n>.parquet
+
+read_dataset loads an entity back, optionally just some columns or courses.
+"""
+
+from python_canvas_layer.sinks import FrameSink
+from python_canvas_layer.schemas import SCHEMAS, apply_schema
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import glob
+import logging
+import os
+import uuid
+
+import pandas as pd
+
+# pyarrow is optional (pip install python_canvas_layer[parquet]); only this module needs it
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def _arrow_types() -> Dict[str, 'pa.DataType']:
+    # The Arrow type of each schemas.py column type
+    return {'id': pa.int64(),
+            'count': pa.int32(),
+            'float': pa.float64(),
+            'datetime': pa.timestamp('us', tz='UTC'),
+            'boolean': pa.bool_(),
+            'category': pa.dictionary(pa.int32(), pa.string())}
+
+
+def arrow_schema(frame: pd.DataFrame, schema: Dict[str, str]) -> 'pa.Schema':
+    """
+    The Arrow schema for frames of an entity: the declared columns get their compact
+    types, and the rest are inferred from frame, with strings for columns that are all null.
+    """
+    types = _arrow_types()
+    fields = []
+    for name in frame.columns:
+        if name in schema:
+            typ = types[schema[name]]
+        else:
+            typ = pa.Schema.from_pandas(frame[[name]], preserve_index=False).field(name).type
+            if pa.types.is_null(typ):
+                typ = pa.string()
+        fields.append(pa.field(name, typ))
+    return pa.schema(fields)
+
+
+class ParquetSink(FrameSink):
+    """
+    Writes each entity to a course-partitioned dataset under directory, one file per
+    course and entity in each run, closed as CanvasStatus finishes the course.  Columns
+    get the compact types of schemas.py (dictionary-encoded categories, nullable integers,
+    UTC timestamps) whether or not the connection is typed.
+
+    format is 'parquet' (compressed with compression, zstd by default) or 'arrow' (Arrow
+    IPC files, uncompressed by default so that they can be memory-mapped).  An Arrow file
+    holds a single dictionary per column, so its batches are kept until the course is
+    finished and written with their dictionaries unified.  Each run adds
+    its own files, so a dataset from an earlier run is appended to, taking its schema from
+    the files already there; with replace, the earlier files of each course written (and
+    of the course list) are deleted instead.
+    """
+
+    def __init__(self, directory: str, format: str = 'parquet', compression: str = None, replace: bool = False):
+        if pa is None:
+            raise ImportError('ParquetSink needs pyarrow; pip install python_canvas_layer[parquet]')
+        if format not in FORMATS:
+            raise ValueError('format must be one of %s' % ', '.join(FORMATS))
+        self.directory = directory
+        self.format = format
+        self.compression = compression if compression is not None else 'zstd' if format == 'parquet' else None
+        self.replace = replace
+        self.run_id = datetime.utcnow().strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        self._schemas: Dict[str, pa.Schema] = {}
+        self._writers: Dict[Tuple[str, Optional[int]], object] = {}
+        self._pending: Dict[Tuple[str, Optional[int]], List[pa.Table]] = {}
+        self._replaced = set()
+        self._files = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def partition(self, entity: str, course_id: Optional[int]) -> str:
+        if course_id is None:
+            return os.path.join(self.directory, entity)
+        return os.path.join(self.directory, entity, 'course_id=%d' % course_id)
+
+    def _schema(self, entity: str, frame: pd.DataFrame) -> 'pa.Schema':
+        schema = self._schemas.get(entity)
+        if schema is None:
+            existing = sorted(glob.glob(os.path.join(self.directory, entity, '**', '*' + FORMATS[self.format]),
+                                        recursive=True))
+            for path in existing:
+                try:
+                    schema = read_schema(path, self.format)
+                    break
+                except (pa.ArrowInvalid, OSError):
+                    # Still being written, by another process's sink
+                    continue
+            if schema is None:
+                schema = arrow_schema(frame, SCHEMAS.get(entity, {}))
+            self._schemas[entity] = schema
+        return schema
+
+    def _open(self, entity: str, course_id: Optional[int], schema: 'pa.Schema'):
+        directory = self.partition(entity, course_id)
+        os.makedirs(directory, exist_ok=True)
+        if self.replace and (entity, course_id) not in self._replaced:
+            self._replaced.add((entity, course_id))
+            for path in glob.glob(os.path.join(directory, '*' + FORMATS[self.format])):
+                if not os.path.basename(path).startswith(self.run_id):
+                    os.remove(path)
+
+        self._files += 1
+        path = os.path.join(directory, '%s-%d%s' % (self.run_id, self._files, FORMATS[self.format]))
+        if self.format == 'parquet':
+            return pq.ParquetWriter(path, schema, compression=self.compression)
+        return pa.ipc.new_file(path, schema, options=pa.ipc.IpcWriteOptions(compression=self.compression))
+
+    def write(self, entity: str, course_id: Optional[int], frame: pd.DataFrame) -> None:
+        if not len(frame):
+            return
+        # The course id is in the partition's path rather than in the files
+        frame = frame.drop(columns=['course_id'], errors='ignore') if course_id is not None else frame.copy()
+        apply_schema(frame, SCHEMAS.get(entity, {}))
+        schema = self._schema(entity, frame)
+        missing = [name for name in frame.columns if name not in schema.names]
+        if missing:
+            logging.warning('Columns %s of %s are not in the dataset and are not written', missing, entity)
+        table = pa.Table.from_pandas(frame.reindex(columns=schema.names), schema=schema, preserve_index=False)
+        if self.format == 'arrow':
+            self._pending.setdefault((entity, course_id), []).append(table)
+            return
+
+        writer = self._writers.get((entity, course_id))
+        if writer is None:
+            writer = self._writers[(entity, course_id)] = self._open(entity, course_id, schema)
+        writer.write_table(table)
+
+    def _flush(self, key: Tuple[str, Optional[int]]) -> None:
+        tables = self._pending.pop(key, None)
+        if tables:
+            with self._open(key[0], key[1], tables[0].schema) as writer:
+                writer.write_table(pa.concat_tables(tables).unify_dictionaries())
+        writer = self._writers.pop(key, None)
+        if writer is not None:
+            writer.close()
+
+    def finish_course(self, course_id: Optional[int]) -> None:
+        for key in [key for key in list(self._writers) + list(self._pending) if key[1] == course_id]:
+            self._flush(key)
+
+    def close(self) -> None:
+        for key in list(self._writers) + list(self._pending):
+            self._flush(key)
+
+
+def read_schema(path: str, format: str = 'parquet') -> 'pa.Schema':
+    if format == 'parquet':
+        schema = pq.read_schema(path)
+    else:
+        with pa.memory_map(path) as source:
+            schema = pa.ipc.open_file(source).schema
+    return schema.remove_metadata()
+
+
+def read_dataset(directory: str, entity: str, format: str = 'parquet', columns: List[str] = None,
+                 course_ids: List[int] = None) -> pd.DataFrame:
+    """
+    Loads one entity of a dataset written by ParquetSink, with its course_id column
+    restored from the partitions.  Only the files of the given courses are read, and
+    Arrow files are memory-mapped.
+    """
+    if pa is None:
+        raise ImportError('read_dataset needs pyarrow; pip install python_canvas_layer[parquet]')
+    path = os.path.join(directory, entity)
+    # The course list is the one entity that is not partitioned
+    partitioned = bool(glob.glob(os.path.join(path, 'course_id=*')))
+    dataset = ds.dataset(path, format='parquet' if format == 'parquet' else 'ipc',
+                         partitioning=ds.partitioning(pa.schema([('course_id', pa.int64())]), flavor='hive')
+                         if partitioned else None,
+                         filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+    where = ds.field('course_id').isin(course_ids) if course_ids is not None and partitioned else None
+    table = dataset.to_table(columns=columns, filter=where)
+    # Nullable integers and booleans come back as pandas' extension types, not floats and objects
+    return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype(), pa.int32(): pd.Int32Dtype(),
+                                         pa.bool_(): pd.BooleanDtype()}.get)
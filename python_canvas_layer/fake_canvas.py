@@ -0,0 +1,557 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+A local stand-in for the subset of the Canvas REST API that CanvasConnection uses.
+
+FakeInstitution generates a deterministic synthetic institution, and FakeCanvasServer
+serves it over HTTP with Link-header pagination, optional per-request latency and
+Canvas-style rate-limit headers, so that CanvasConnection and CanvasStatus can be
+measured without a live Canvas instance.
+
+The server also answers the two GraphQL queries GraphQLCanvasConnection makes; it picks
+the query by its operation name and does not parse the GraphQL itself.
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+from datetime import datetime, timedelta
+from collections import Counter
+from typing import Dict, List, Optional
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+import pytz
+
+
+def _iso(when: datetime) -> str:
+    return when.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeInstitution(object):
+    """
+    Synthetic courses, each with the given numbers of students, assignments and modules, and
+    a submission for every student and assignment.  The same seed gives the same data.
+    One course in four has last year's dates and term, so it is not active.
+    """
+
+    def __init__(self, courses: int = 4, students: int = 40, assignments: int = 12,
+                 modules: int = 6, items_per_module: int = 8, seed: int = 0):
+        rng = random.Random(seed)
+        epoch = datetime(2023, 8, 29, 12, 0, 0)
+        self.courses = []
+        self.users = {}
+        self.assignments = {}
+        self.submissions = {}
+        self.modules = {}
+        self.quizzes = {}
+        self.summaries = {}
+
+        next_user = 1000
+        next_sub = 500000
+        for c in range(courses):
+            course_id = 100 + c
+            active = c % 4 != 3
+            start = epoch if active else epoch - timedelta(days=365)
+            self.courses.append({
+                'id': course_id,
+                'name': 'CIS %d: Synthetic Course %d' % (1000 + c, c),
+                'course_code': 'CIS %d' % (1000 + c),
+                'account_id': 1,
+                'enrollment_term_id': 1 if active else 0,
+                'start_at': _iso(start),
+                'end_at': _iso(start + timedelta(days=120)),
+                'workflow_state': 'available',
+                'sis_course_id': 'SIS-%d' % course_id,
+                'is_public': False,
+                'default_view': 'modules',
+                'time_zone': 'America/New_York',
+                'uuid': hashlib.md5(str(course_id).encode()).hexdigest(),
+            })
+
+            users = []
+            for s in range(students):
+                uid = next_user
+                next_user += 1
+                users.append({
+                    'id': uid,
+                    'name': 'Student %d' % uid,
+                    'sortable_name': '%d, Student' % uid,
+                    'short_name': 'Student %d' % uid,
+                    'login_id': 'student%d' % uid,
+                    'email': 'student%d@example.edu' % uid,
+                    'sis_user_id': str(10000000 + uid),
+                    'created_at': _iso(epoch - timedelta(days=rng.randint(30, 900))),
+                })
+            self.users[course_id] = users
+
+            assigns = []
+            for a in range(assignments):
+                due = epoch + timedelta(days=7 * (a + 1))
+                assigns.append({
+                    'id': 20000 + c * 1000 + a,
+                    'course_id': course_id,
+                    'name': 'Homework %d' % (a + 1),
+                    'description': '<p>Complete the problems in section %d.</p>' % (a + 1),
+                    'due_at': _iso(due),
+                    'unlock_at': _iso(due - timedelta(days=7)),
+                    'lock_at': _iso(due + timedelta(days=3)) if a % 3 else None,
+                    'points_possible': float(rng.choice([10, 20, 50, 100])),
+                    'grading_type': 'points',
+                    'allowed_attempts': -1 if a % 2 else 3,
+                    'muted': False,
+                    'published': True,
+                    'position': a + 1,
+                    'created_at': _iso(epoch),
+                    'updated_at': _iso(epoch + timedelta(days=a)),
+                    'submission_types': ['online_upload'],
+                })
+            self.assignments[course_id] = assigns
+
+            subs = []
+            for assignment in assigns:
+                due = datetime.strptime(assignment['due_at'], '%Y-%m-%dT%H:%M:%SZ')
+                for user in users:
+                    roll = rng.random()
+                    submitted = roll > 0.1
+                    late = submitted and roll > 0.9
+                    excused = not submitted and roll < 0.02
+                    score = round(rng.uniform(0.5, 1.0) * assignment['points_possible'], 1) if submitted else None
+                    submitted_at = due + timedelta(hours=rng.randint(1, 48) if late else -rng.randint(1, 96))
+                    graded_at = submitted_at + timedelta(days=2)
+                    subs.append({
+                        'id': next_sub,
+                        'assignment_id': assignment['id'],
+                        'user_id': user['id'],
+                        'attempt': 1 if submitted else None,
+                        'body': None,
+                        'grade': str(score) if score is not None else None,
+                        'score': score,
+                        'submitted_at': _iso(submitted_at) if submitted else None,
+                        'graded_at': _iso(graded_at) if submitted else None,
+                        'grader_id': 9 if submitted else None,
+                        'excused': excused,
+                        'late_policy_status': 'late' if late else ('missing' if not submitted and not excused else None),
+                        'points_deducted': 1.0 if late else None,
+                        'late': late,
+                        'missing': not submitted and not excused,
+                        'entered_grade': str(score) if score is not None else None,
+                        'entered_score': score,
+                        'workflow_state': 'graded' if submitted else 'unsubmitted',
+                        'submission_type': 'online_upload' if submitted else None,
+                        'seconds_late': 3600 if late else 0,
+                        'grade_matches_current_submission': True,
+                        'preview_url': 'https://canvas.example.edu/courses/%d/assignments/%d/submissions/%d?preview=1'
+                                       % (course_id, assignment['id'], user['id']),
+                        'updated_at': _iso(graded_at if submitted else epoch),
+                    })
+                    next_sub += 1
+            self.submissions[course_id] = subs
+
+            mods = []
+            item_id = 700000 + c * 10000
+            for m in range(modules):
+                items = []
+                for i in range(items_per_module):
+                    typ = ['ExternalUrl', 'Quiz', 'Page', 'Assignment'][i % 4]
+                    item = {
+                        'id': item_id,
+                        'module_id': 3000 + c * 100 + m,
+                        'position': i + 1,
+                        'title': 'Lecture %d.%d' % (m + 1, i + 1) if typ != 'Quiz' else 'Quiz %d.%d' % (m + 1, i + 1),
+                        'indent': 0,
+                        'type': typ,
+                        'html_url': 'https://canvas.example.edu/courses/%d/modules/items/%d' % (course_id, item_id),
+                        'published': True,
+                    }
+                    if typ == 'Quiz':
+                        item['url'] = 'https://canvas.example.edu/api/v1/courses/%d/quizzes/%d' % (course_id, item_id)
+                    if typ == 'ExternalUrl':
+                        item['external_url'] = 'https://videos.example.edu/lecture/%d' % item_id
+                    items.append(item)
+                    item_id += 1
+                mods.append({
+                    'id': 3000 + c * 100 + m,
+                    'name': 'Week %d' % (m + 1),
+                    'position': m + 1,
+                    'unlock_at': _iso(epoch + timedelta(days=7 * m)),
+                    'published': True,
+                    'items_count': len(items),
+                    'items_url': 'https://canvas.example.edu/api/v1/courses/%d/modules/%d/items'
+                                 % (course_id, 3000 + c * 100 + m),
+                    '_items': items,
+                })
+            self.modules[course_id] = mods
+
+            self.quizzes[course_id] = [{
+                'id': 40000 + c * 100 + q,
+                'title': 'Quiz %d' % (q + 1),
+                'published': True,
+                'unlock_at': _iso(epoch + timedelta(days=7 * q)),
+                'due_at': _iso(epoch + timedelta(days=7 * q + 2)),
+                'lock_at': None,
+                'quiz_type': 'assignment',
+            } for q in range(max(1, assignments // 4))]
+
+            self.summaries[course_id] = [{
+                'id': user['id'],
+                'page_views': rng.randint(0, 500),
+                'max_page_views': 500,
+                'participations': rng.randint(0, 50),
+                'max_participations': 50,
+                'tardiness_breakdown': {'missing': 0, 'late': 0, 'on_time': 0, 'floating': 0, 'total': 0},
+            } for user in users]
+
+    def get_course(self, course_id: int) -> Optional[Dict]:
+        for course in self.courses:
+            if course['id'] == course_id:
+                return course
+        return None
+
+
+class FakeCanvasServer(object):
+    """
+    Serves a FakeInstitution on localhost.  Use as a context manager; `url` is the value to
+    pass as the Canvas URL to CanvasConnection.
+    """
+
+    def __init__(self, institution: FakeInstitution = None, latency: float = 0.0, max_per_page: int = 100,
+                 rate_limit: float = 700.0, refill_per_second: float = 10.0, request_cost: float = 1.0,
+                 inline_module_items: int = 50, etags: bool = True):
+        self.institution = institution or FakeInstitution()
+        self.latency = latency
+        self.max_per_page = max_per_page
+        self.rate_limit = rate_limit
+        self.refill_per_second = refill_per_second
+        self.request_cost = request_cost
+        self.inline_module_items = inline_module_items
+        self.etags = etags
+
+        self.requests = Counter()
+        self.throttled = 0
+        self.not_modified = 0
+        self._bucket = rate_limit
+        self._bucket_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:%d' % self._httpd.server_address[1]
+
+    @property
+    def request_count(self) -> int:
+        return sum(self.requests.values())
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.requests.clear()
+            self.throttled = 0
+            self.not_modified = 0
+
+    def start(self) -> 'FakeCanvasServer':
+        server = self
+
+        class Handler(_FakeCanvasHandler):
+            fake = server
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _charge(self, endpoint: str) -> Optional[float]:
+        """
+        Leaky-bucket accounting in the style of Canvas: returns the remaining budget, or
+        None if the request must be throttled.
+        """
+        with self._lock:
+            self.requests[endpoint] += 1
+            now = time.monotonic()
+            self._bucket = min(self.rate_limit, self._bucket + (now - self._bucket_at) * self.refill_per_second)
+            self._bucket_at = now
+            if self._bucket < self.request_cost:
+                self.throttled += 1
+                return None
+            self._bucket -= self.request_cost
+            return self._bucket
+
+
+_ROUTES = [
+    ('courses', re.compile(r'^/api/v1/courses$')),
+    ('course', re.compile(r'^/api/v1/courses/(\d+)$')),
+    ('account_courses', re.compile(r'^/api/v1/accounts/(\d+)/courses$')),
+    ('users', re.compile(r'^/api/v1/courses/(\d+)/(?:search_)?users$')),
+    ('assignments', re.compile(r'^/api/v1/courses/(\d+)/assignments$')),
+    ('assignment_submissions', re.compile(r'^/api/v1/courses/(\d+)/assignments/(\d+)/submissions$')),
+    ('student_submissions', re.compile(r'^/api/v1/courses/(\d+)/students/submissions$')),
+    ('modules', re.compile(r'^/api/v1/courses/(\d+)/modules$')),
+    ('module_items', re.compile(r'^/api/v1/courses/(\d+)/modules/(\d+)/items$')),
+    ('quizzes', re.compile(r'^/api/v1/courses/(\d+)/quizzes$')),
+    ('student_summaries', re.compile(r'^/api/v1/courses/(\d+)/analytics/student_summaries$')),
+]
+
+
+class _FakeCanvasHandler(BaseHTTPRequestHandler):
+    fake: FakeCanvasServer = None
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+        for name, pattern in _ROUTES:
+            match = pattern.match(parsed.path)
+            if match:
+                break
+        else:
+            return self._send(404, {'errors': [{'message': 'The specified resource does not exist.'}]}, endpoint='unknown')
+
+        remaining = self.fake._charge(name)
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        if remaining is None:
+            return self._send_raw(403, b'403 Forbidden (Rate Limit Exceeded)', {'X-Rate-Limit-Remaining': '0.0'})
+
+        ids = [int(g) for g in match.groups()]
+        if name not in ('courses', 'course', 'account_courses') and not self.fake.institution.get_course(ids[0]):
+            return self._send(404, {'errors': [{'message': 'The specified resource does not exist.'}]},
+                              remaining=remaining)
+        body = getattr(self, '_' + name)(params, *ids)
+        if name == 'course':
+            if body is None:
+                return self._send(404, {'errors': [{'message': 'The specified resource does not exist.'}]},
+                                  remaining=remaining)
+            return self._send(200, body, remaining=remaining)
+        return self._send_page(parsed.path, params, body, remaining)
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if parsed.path != '/api/graphql':
+            return self._send(404, {'errors': [{'message': 'The specified resource does not exist.'}]})
+
+        remaining = self.fake._charge('graphql')
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        if remaining is None:
+            return self._send_raw(403, b'403 Forbidden (Rate Limit Exceeded)', {'X-Rate-Limit-Remaining': '0.0'})
+
+        request = json.loads(body or b'{}')
+        operation = re.search(r'query\s+(\w+)', request.get('query', ''))
+        resolve = getattr(self, '_graphql_' + operation.group(1), None) if operation else None
+        if resolve is None:
+            return self._send(200, {'errors': [{'message': 'Unsupported query'}]}, remaining=remaining)
+        return self._send(200, {'data': resolve(request.get('variables') or {})}, remaining=remaining)
+
+    def _graphql_page(self, nodes: List, first: int, after: Optional[str]) -> Dict:
+        # Cursors are opaque to clients; these encode the offset of the next node
+        start = int(base64.b64decode(after)) if after else 0
+        chunk = nodes[start:start + min(int(first), self.fake.max_per_page)]
+        end = start + len(chunk)
+        return {'nodes': chunk, 'pageInfo': {'hasNextPage': end < len(nodes),
+                                             'endCursor': base64.b64encode(str(end).encode()).decode()}}
+
+    @staticmethod
+    def _graphql_time(value: Optional[str], zone) -> Optional[str]:
+        # GraphQL gives times in the user's zone, where REST uses UTC
+        if value is None:
+            return None
+        return pytz.utc.localize(datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')).astimezone(zone).isoformat()
+
+    def _graphql_submissions(self, course_id: int, assignment_id: int) -> List[Dict]:
+        zone = pytz.timezone(self.fake.institution.get_course(course_id)['time_zone'])
+        return [{'_id': str(s['id']), 'assignmentId': str(s['assignment_id']), 'userId': str(s['user_id']),
+                 'grade': s['grade'], 'submittedAt': self._graphql_time(s['submitted_at'], zone),
+                 'gradedAt': self._graphql_time(s['graded_at'], zone),
+                 'graderId': str(s['grader_id']) if s['grader_id'] is not None else None,
+                 'score': s['score'], 'excused': s['excused'], 'latePolicyStatus': s['late_policy_status'],
+                 'deductedPoints': s['points_deducted'], 'late': s['late'], 'missing': s['missing'],
+                 'enteredGrade': s['entered_grade'], 'enteredScore': s['entered_score']}
+                for s in self.fake.institution.submissions[course_id] if s['assignment_id'] == assignment_id]
+
+    def _graphql_CourseAssignments(self, variables: Dict) -> Dict:
+        course = self.fake.institution.get_course(int(variables['courseId']))
+        if course is None:
+            return {'course': None}
+        zone = pytz.timezone(course['time_zone'])
+        nodes = []
+        for a in self.fake.institution.assignments[course['id']]:
+            node = {'_id': str(a['id']), 'name': a['name'], 'dueAt': self._graphql_time(a['due_at'], zone),
+                    'unlockAt': self._graphql_time(a['unlock_at'], zone),
+                    'lockAt': self._graphql_time(a['lock_at'], zone), 'pointsPossible': a['points_possible'],
+                    'allowedAttempts': a['allowed_attempts'], 'muted': a['muted']}
+            nodes.append(node)
+        page = self._graphql_page(nodes, variables['first'], variables.get('after'))
+        if variables.get('withSubmissions'):
+            for node in page['nodes']:
+                node['submissionsConnection'] = self._graphql_page(
+                    self._graphql_submissions(course['id'], int(node['_id'])), variables['submissionsFirst'], None)
+        return {'course': {'assignmentsConnection': page}}
+
+    def _graphql_AssignmentSubmissions(self, variables: Dict) -> Dict:
+        assignment_id = int(variables['assignmentId'])
+        for course_id, assignments in self.fake.institution.assignments.items():
+            if any(a['id'] == assignment_id for a in assignments):
+                nodes = self._graphql_submissions(course_id, assignment_id)
+                return {'assignment': {'submissionsConnection': self._graphql_page(nodes, variables['first'],
+                                                                                   variables.get('after'))}}
+        return {'assignment': None}
+
+    def _courses(self, params):
+        courses = self.fake.institution.courses
+        if params.get('enrollment_state') == ['active'] or params.get('state[]'):
+            courses = [c for c in courses if c['enrollment_term_id'] == 1]
+        if params.get('enrollment_term_id'):
+            term = int(params['enrollment_term_id'][0])
+            courses = [c for c in courses if c['enrollment_term_id'] == term]
+        return courses
+
+    def _account_courses(self, params, account_id):
+        courses = [c for c in self.fake.institution.courses if c['account_id'] == account_id]
+        if params.get('state[]'):
+            courses = [c for c in courses if c['workflow_state'] in params['state[]']]
+        if params.get('enrollment_term_id'):
+            term = int(params['enrollment_term_id'][0])
+            courses = [c for c in courses if c['enrollment_term_id'] == term]
+        if params.get('starts_before'):
+            when = params['starts_before'][0][:19] + 'Z'
+            courses = [c for c in courses if c['start_at'] <= when]
+        if params.get('ends_after'):
+            when = params['ends_after'][0][:19] + 'Z'
+            courses = [c for c in courses if c['end_at'] >= when]
+        return courses
+
+    def _course(self, params, course_id):
+        return self.fake.institution.get_course(course_id)
+
+    def _users(self, params, course_id):
+        return self.fake.institution.users[course_id]
+
+    def _assignments(self, params, course_id):
+        return self.fake.institution.assignments[course_id]
+
+    def _assignment_submissions(self, params, course_id, assignment_id):
+        return [s for s in self.fake.institution.submissions[course_id] if s['assignment_id'] == assignment_id]
+
+    def _student_submissions(self, params, course_id):
+        subs = self.fake.institution.submissions[course_id]
+        if 'assignment_ids[]' in params:
+            wanted = set(int(a) for a in params['assignment_ids[]'])
+            subs = [s for s in subs if s['assignment_id'] in wanted]
+        if 'student_ids[]' in params and 'all' not in params['student_ids[]']:
+            wanted = set(int(u) for u in params['student_ids[]'])
+            subs = [s for s in subs if s['user_id'] in wanted]
+        if 'graded_since' in params:
+            since = params['graded_since'][0].replace('+00:00', 'Z')
+            subs = [s for s in subs if s['graded_at'] and s['graded_at'] >= since]
+        if 'submitted_since' in params:
+            since = params['submitted_since'][0].replace('+00:00', 'Z')
+            subs = [s for s in subs if s['submitted_at'] and s['submitted_at'] >= since]
+        # Canvas orders this endpoint by user, not by assignment
+        return sorted(subs, key=lambda s: (s['user_id'], s['assignment_id']))
+
+    def _modules(self, params, course_id):
+        include_items = 'items' in params.get('include[]', [])
+        ret = []
+        for module in self.fake.institution.modules[course_id]:
+            mod = {k: v for k, v in module.items() if k != '_items'}
+            if include_items and len(module['_items']) <= self.fake.inline_module_items:
+                mod['items'] = module['_items']
+            ret.append(mod)
+        return ret
+
+    def _module_items(self, params, course_id, module_id):
+        for module in self.fake.institution.modules[course_id]:
+            if module['id'] == module_id:
+                return module['_items']
+        return []
+
+    def _quizzes(self, params, course_id):
+        return self.fake.institution.quizzes[course_id]
+
+    def _student_summaries(self, params, course_id):
+        return self.fake.institution.summaries[course_id]
+
+    def _send_page(self, path: str, params: Dict[str, List[str]], items: List, remaining: float):
+        per_page = min(int(params.get('per_page', ['10'])[0]), self.fake.max_per_page)
+        page = int(params.get('page', ['1'])[0])
+        last = max(1, (len(items) + per_page - 1) // per_page)
+        chunk = items[(page - 1) * per_page:page * per_page]
+
+        base = 'http://%s%s' % (self.headers.get('Host'), path)
+
+        def link(p, rel):
+            query = {k: v for k, v in params.items() if k not in ('page', 'per_page')}
+            query['page'] = [str(p)]
+            query['per_page'] = [str(per_page)]
+            return '<%s?%s>; rel="%s"' % (base, urlencode(query, doseq=True), rel)
+
+        links = [link(page, 'current')]
+        if page < last:
+            links.append(link(page + 1, 'next'))
+        if page > 1:
+            links.append(link(page - 1, 'prev'))
+        links.append(link(1, 'first'))
+        links.append(link(last, 'last'))
+        return self._send(200, chunk, remaining=remaining, extra={'Link': ','.join(links)})
+
+    def _send(self, status: int, body, remaining: float = None, extra: Dict[str, str] = None, endpoint=None):
+        data = json.dumps(body).encode('utf-8')
+        headers = dict(extra or {})
+        headers['Content-Type'] = 'application/json; charset=utf-8'
+        if remaining is not None:
+            headers['X-Rate-Limit-Remaining'] = '%.1f' % remaining
+            headers['X-Request-Cost'] = '%.1f' % self.fake.request_cost
+        if status == 200 and self.fake.etags:
+            etag = '"%s"' % hashlib.md5(data).hexdigest()
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                with self.fake._lock:
+                    self.fake.not_modified += 1
+                return self._send_raw(304, b'', headers)
+        return self._send_raw(status, data, headers)
+
+    def _send_raw(self, status: int, data: bytes, headers: Dict[str, str]):
+        self.send_response(status)
+        for key, value in headers.items():
+            if key != 'Content-Type' or data:
+                self.send_header(key, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
@@ -0,0 +1,299 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+Student x assignment gradebooks built from the frames CanvasConnection returns.
+
+Each course is held as a dense block: a float64 array of scores (NaN where there is no
+score) and a uint8 array of flags per cell, one bit each for EXCUSED, MISSING, LATE,
+SUBMITTED and PRESENT (a submission row exists).  Several courses are kept as separate
+blocks, so a department's gradebook costs the sum of its courses' rosters times their
+assignments rather than all students times all assignments.  Blocks are filled and
+summarized with whole-array operations; there are no per-row Python loops.
+"""
+
+from typing import Dict, Iterable, List, Optional, Union
+import warnings
+
+import numpy as np
+import pandas as pd
+
+EXCUSED = 1
+MISSING = 2
+LATE = 4
+SUBMITTED = 8
+PRESENT = 16
+
+FLAGS = {'excused': EXCUSED, 'missing': MISSING, 'late': LATE, 'submitted': SUBMITTED, 'present': PRESENT}
+
+
+def _ids(values: pd.Series) -> np.ndarray:
+    return pd.to_numeric(values).to_numpy(dtype=np.int64)
+
+
+def _floats(values: pd.Series) -> np.ndarray:
+    return pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _bools(values: pd.Series) -> np.ndarray:
+    return values.astype('boolean').to_numpy(dtype=bool, na_value=False)
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    return np.divide(100.0 * numerator, denominator, out=np.full(numerator.shape, np.nan),
+                     where=denominator > 0)
+
+
+class CourseGrades(object):
+    """
+    One course's block: scores[i, j] and flags[i, j] are student_ids[i]'s on
+    assignment_ids[j], whose points possible are points_possible[j].  With a roster (the
+    course's students frame was given), only its students have rows; otherwise every
+    student with a submission does.
+    """
+
+    def __init__(self, course_id: int):
+        self.course_id = course_id
+        self.student_ids = np.empty(0, dtype=np.int64)
+        self.assignment_ids = np.empty(0, dtype=np.int64)
+        self.points_possible = np.empty(0, dtype=np.float64)
+        self.scores = np.empty((0, 0), dtype=np.float64)
+        self.flags = np.empty((0, 0), dtype=np.uint8)
+        self.roster = False
+        self._students = pd.Index(self.student_ids)
+        self._assignments = pd.Index(self.assignment_ids)
+
+    def add_students(self, student_ids: np.ndarray) -> None:
+        new = pd.unique(student_ids[self._students.get_indexer(student_ids) < 0])
+        if len(new):
+            self.student_ids = np.concatenate([self.student_ids, new])
+            self.scores = np.vstack([self.scores, np.full((len(new), self.scores.shape[1]), np.nan)])
+            self.flags = np.vstack([self.flags, np.zeros((len(new), self.flags.shape[1]), dtype=np.uint8)])
+            self._students = pd.Index(self.student_ids)
+
+    def set_assignments(self, assignment_ids: np.ndarray, points_possible: np.ndarray) -> None:
+        """
+        Adds the assignments not already present, as new columns in the order given, and
+        updates the points possible of those that are.
+        """
+        positions = self._assignments.get_indexer(assignment_ids)
+        known = positions >= 0
+        self.points_possible[positions[known]] = points_possible[known]
+        new, first = np.unique(assignment_ids[~known], return_index=True)
+        if len(new):
+            order = np.argsort(first)
+            self.assignment_ids = np.concatenate([self.assignment_ids, new[order]])
+            self.points_possible = np.concatenate([self.points_possible, points_possible[~known][first[order]]])
+            self.scores = np.hstack([self.scores, np.full((self.scores.shape[0], len(new)), np.nan)])
+            self.flags = np.hstack([self.flags, np.zeros((self.flags.shape[0], len(new)), dtype=np.uint8)])
+            self._assignments = pd.Index(self.assignment_ids)
+
+    def scatter(self, student_ids: np.ndarray, assignment_ids: np.ndarray, scores: np.ndarray,
+                flags: np.ndarray) -> int:
+        """
+        Writes submissions into their cells, replacing what was there; those of students or
+        assignments without a row or column are skipped.  Returns the number written.
+        """
+        rows = self._students.get_indexer(student_ids)
+        columns = self._assignments.get_indexer(assignment_ids)
+        keep = (rows >= 0) & (columns >= 0)
+        self.scores[rows[keep], columns[keep]] = scores[keep]
+        self.flags[rows[keep], columns[keep]] = flags[keep]
+        return int(keep.sum())
+
+    def mask(self, flag: int) -> np.ndarray:
+        return (self.flags & flag) != 0
+
+    def student_totals(self) -> pd.DataFrame:
+        """
+        Per student: assignments counted (not excused), graded, submitted, missing, late and
+        excused counts; points earned on graded work; the points possible of graded work and
+        of all counted work; and percent (of graded work) and percent_total (counting
+        ungraded work as zero).
+        """
+        counted = ~self.mask(EXCUSED)
+        graded = counted & ~np.isnan(self.scores)
+        points = np.where(graded, self.scores, 0.0).sum(axis=1)
+        possible = np.nan_to_num(self.points_possible)
+        points_graded = graded @ possible
+        points_possible = counted @ possible
+        return pd.DataFrame({
+            'course_id': np.full(len(self.student_ids), self.course_id, dtype=np.int64),
+            'user_id': self.student_ids,
+            'assignments': counted.sum(axis=1),
+            'graded': graded.sum(axis=1),
+            'submitted': self.mask(SUBMITTED).sum(axis=1),
+            'missing': self.mask(MISSING).sum(axis=1),
+            'late': self.mask(LATE).sum(axis=1),
+            'excused': (~counted).sum(axis=1),
+            'points': points,
+            'points_graded': points_graded,
+            'points_possible': points_possible,
+            'percent': _ratio(points, points_graded),
+            'percent_total': _ratio(points, points_possible),
+        })
+
+    def assignment_totals(self) -> pd.DataFrame:
+        """
+        Per assignment: points possible; graded, submitted, missing, late and excused counts;
+        and the mean and median score and mean percent of the graded, unexcused submissions.
+        """
+        counted = ~self.mask(EXCUSED)
+        graded = counted & ~np.isnan(self.scores)
+        scores = np.where(graded, self.scores, np.nan)
+        with warnings.catch_warnings():
+            # Assignments nobody has been graded on yet have NaN statistics
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(scores, axis=0) if len(self.student_ids) else np.full(len(self.assignment_ids), np.nan)
+            median = np.nanmedian(scores, axis=0) if len(self.student_ids) else mean
+        return pd.DataFrame({
+            'course_id': np.full(len(self.assignment_ids), self.course_id, dtype=np.int64),
+            'assignment_id': self.assignment_ids,
+            'points_possible': self.points_possible,
+            'graded': graded.sum(axis=0),
+            'submitted': self.mask(SUBMITTED).sum(axis=0),
+            'missing': self.mask(MISSING).sum(axis=0),
+            'late': self.mask(LATE).sum(axis=0),
+            'excused': (~counted).sum(axis=0),
+            'mean_score': mean,
+            'median_score': median,
+            'mean_percent': _ratio(mean, np.nan_to_num(self.points_possible)),
+        })
+
+
+class Gradebook(object):
+    """
+    Gradebooks for one or more courses, from the frames of get_assignment_submissions_df and
+    get_assignments_df, and optionally get_students_df (which then decides whose rows there
+    are).  Frames without a course_id column are taken to be for the one course in
+    submissions.  update() applies later submissions (such as IncrementalSync's changes)
+    in place.
+    """
+
+    def __init__(self, submissions: pd.DataFrame, assignments: pd.DataFrame, students: pd.DataFrame = None):
+        self.courses: Dict[int, CourseGrades] = {}
+        self.update(submissions, assignments, students)
+
+    @staticmethod
+    def _by_course(frame: Optional[pd.DataFrame], default: Optional[int]) -> Dict[int, np.ndarray]:
+        # Positions of each course's rows in frame
+        if frame is None or not len(frame):
+            return {}
+        if 'course_id' not in frame.columns:
+            if default is None:
+                raise ValueError('Frames for several courses need a course_id column')
+            return {default: np.arange(len(frame))}
+        groups = frame.groupby('course_id', sort=False).indices
+        return {int(course_id): positions for course_id, positions in groups.items()}
+
+    def update(self, submissions: Union[pd.DataFrame, List[Dict]], assignments: pd.DataFrame = None,
+               students: pd.DataFrame = None) -> List[int]:
+        """
+        Adds any new assignments (and students) and writes the submissions into their cells,
+        replacing earlier values.  Returns the ids of the courses whose submissions changed.
+        """
+        if not isinstance(submissions, pd.DataFrame):
+            submissions = pd.DataFrame(submissions)
+        default = None
+        if len(submissions) and 'course_id' in submissions.columns:
+            course_ids = submissions['course_id'].unique()
+            default = int(course_ids[0]) if len(course_ids) == 1 else None
+        elif len(self.courses) == 1:
+            default = next(iter(self.courses))
+
+        for course_id, positions in Gradebook._by_course(assignments, default).items():
+            rows = assignments.iloc[positions]
+            self._course(course_id).set_assignments(_ids(rows['id']), _floats(rows['points_possible']))
+        for course_id, positions in Gradebook._by_course(students, default).items():
+            course = self._course(course_id)
+            course.roster = True
+            course.add_students(_ids(students['id'].iloc[positions]))
+
+        if not len(submissions):
+            return []
+        student_ids = _ids(submissions['user_id'])
+        assignment_ids = _ids(submissions['assignment_id'])
+        scores = _floats(submissions['score'])
+        flags = (PRESENT
+                 | np.where(_bools(submissions['excused']), EXCUSED, 0)
+                 | np.where(_bools(submissions['missing']), MISSING, 0)
+                 | np.where(_bools(submissions['late']), LATE, 0)
+                 | np.where(submissions['submitted_at'].notna().to_numpy(), SUBMITTED, 0)).astype(np.uint8)
+
+        changed = []
+        for course_id, positions in Gradebook._by_course(submissions, default).items():
+            course = self.courses.get(course_id)
+            if course is None:
+                raise ValueError('No assignments were given for course %s' % course_id)
+            if not course.roster:
+                course.add_students(student_ids[positions])
+            if course.scatter(student_ids[positions], assignment_ids[positions], scores[positions],
+                              flags[positions]):
+                changed.append(course_id)
+        return changed
+
+    def _course(self, course_id: int) -> CourseGrades:
+        course = self.courses.get(course_id)
+        if course is None:
+            course = self.courses[course_id] = CourseGrades(course_id)
+        return course
+
+    def _only(self, course_id: Optional[int]) -> CourseGrades:
+        if course_id is None:
+            if len(self.courses) != 1:
+                raise ValueError('The gradebook has %d courses; give a course_id' % len(self.courses))
+            return next(iter(self.courses.values()))
+        return self.courses[course_id]
+
+    def scores_frame(self, course_id: int = None) -> pd.DataFrame:
+        """
+        The course's scores, one row per student and one column per assignment.
+        """
+        course = self._only(course_id)
+        return pd.DataFrame(course.scores, index=pd.Index(course.student_ids, name='user_id'),
+                            columns=pd.Index(course.assignment_ids, name='assignment_id'))
+
+    def mask_frame(self, flag: str, course_id: int = None) -> pd.DataFrame:
+        """
+        Where the course's cells have one of the FLAGS ('excused', 'missing', 'late',
+        'submitted' or 'present'), shaped as scores_frame.
+        """
+        course = self._only(course_id)
+        return pd.DataFrame(course.mask(FLAGS[flag]), index=pd.Index(course.student_ids, name='user_id'),
+                            columns=pd.Index(course.assignment_ids, name='assignment_id'))
+
+    def student_totals(self, course_ids: Iterable[int] = None) -> pd.DataFrame:
+        """
+        CourseGrades.student_totals for each course (or the given ones), one row per
+        enrollment.
+        """
+        ids = list(self.courses) if course_ids is None else list(course_ids)
+        frames = [self.courses[course_id].student_totals() for course_id in ids]
+        return pd.concat(frames, ignore_index=True) if frames else CourseGrades(0).student_totals()
+
+    def assignment_totals(self, course_ids: Iterable[int] = None) -> pd.DataFrame:
+        """
+        CourseGrades.assignment_totals for each course (or the given ones).
+        """
+        ids = list(self.courses) if course_ids is None else list(course_ids)
+        frames = [self.courses[course_id].assignment_totals() for course_id in ids]
+        return pd.concat(frames, ignore_index=True) if frames else CourseGrades(0).assignment_totals()
+
+    def memory_usage(self) -> int:
+        """
+        Bytes held by the courses' score and flag arrays.
+        """
+        return sum(course.scores.nbytes + course.flags.nbytes for course in self.courses.values())
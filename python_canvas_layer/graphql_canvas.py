@@ -0,0 +1,210 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from canvasapi.course import Course
+from canvasapi.exceptions import CanvasException, ResourceDoesNotExist, Forbidden
+from python_canvas_layer.pycanvas import CanvasConnection
+from datetime import datetime
+import pytz
+import logging
+from typing import Dict, List, Iterator, Optional
+
+# Every field of a submission that CanvasConnection.SUBMISSION_FIELDS reports, bar course_id
+_SUBMISSION_NODE = """
+          _id assignmentId userId grade submittedAt gradedAt graderId score excused
+          latePolicyStatus deductedPoints late missing enteredGrade enteredScore
+"""
+
+# Canvas' default filter leaves out unsubmitted submissions, which the REST listings include
+_SUBMISSION_STATES = '{states: [unsubmitted, submitted, pending_review, graded]}'
+
+# Without a filter, a course with grading periods lists only the current period's
+# assignments; the REST listing has them all
+_ASSIGNMENT_FILTER = '{gradingPeriodId: null}'
+
+COURSE_ASSIGNMENTS_QUERY = """
+query CourseAssignments($courseId: ID!, $first: Int!, $after: String, $withSubmissions: Boolean!,
+                        $submissionsFirst: Int!) {
+  course(id: $courseId) {
+    assignmentsConnection(first: $first, after: $after, filter: %s) {
+      nodes {
+        _id name dueAt unlockAt lockAt pointsPossible allowedAttempts muted
+        submissionsConnection(first: $submissionsFirst, filter: %s) @include(if: $withSubmissions) {
+          nodes {%s}
+          pageInfo { hasNextPage endCursor }
+        }
+      }
+      pageInfo { hasNextPage endCursor }
+    }
+  }
+}
+""" % (_ASSIGNMENT_FILTER, _SUBMISSION_STATES, _SUBMISSION_NODE)
+
+ASSIGNMENT_SUBMISSIONS_QUERY = """
+query AssignmentSubmissions($assignmentId: ID!, $first: Int!, $after: String) {
+  assignment(id: $assignmentId) {
+    submissionsConnection(first: $first, after: $after, filter: %s) {
+      nodes {%s}
+      pageInfo { hasNextPage endCursor }
+    }
+  }
+}
+""" % (_SUBMISSION_STATES, _SUBMISSION_NODE)
+
+
+def _legacy_id(value) -> Optional[int]:
+    return int(value) if value is not None else None
+
+
+def _utc(value: Optional[str]) -> Optional[str]:
+    """
+    A GraphQL DateTime (ISO 8601, in the user's time zone) in the REST API's form, UTC
+    with a trailing Z.
+    """
+    if value is None:
+        return None
+    when = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if when.tzinfo is None:
+        when = pytz.utc.localize(when)
+    return when.astimezone(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class GraphQLCanvasConnection(CanvasConnection):
+    """
+    A CanvasConnection that reads courses' assignments and submissions from Canvas' GraphQL
+    endpoint (POST /api/graphql) instead of the REST listings.  One query returns a page
+    of assignments along with the first page of each one's submissions, asking only for
+    the fields reported; only assignments with more submissions than that need another
+    query.  Ids and dates are converted to the REST API's forms (integers, and UTC times
+    ending in Z), so rows and frames are the same as CanvasConnection's, with submissions
+    in assignment order whether or not bulk is asked for.
+
+    Everything else, including submissions narrowed by assignment, student or date (as
+    IncrementalSync asks for), is read from the REST API as raw JSON.
+    """
+
+    # Assignments per query, and submissions per assignment in each query
+    PAGE_SIZE = 100
+    SUBMISSIONS_PER_ASSIGNMENT = 100
+
+    def __init__(self, canvas_url, canvas_key, **kwargs):
+        # The GraphQL rows are dictionaries, so the REST rows are read the same way
+        if not kwargs.setdefault('raw_json', True):
+            raise ValueError('GraphQLCanvasConnection reads the REST API as raw JSON; raw_json cannot be False')
+        super().__init__(canvas_url, canvas_key, **kwargs)
+
+    def _query(self, query: str, variables: Dict) -> Dict:
+        response = self.canvas.graphql(query, variables)
+        if response.get('errors'):
+            raise CanvasException(response['errors'])
+        return response['data']
+
+    def _assignment_nodes(self, course: Course, with_submissions: bool) -> Iterator[Dict]:
+        after = None
+        while True:
+            data = self._query(COURSE_ASSIGNMENTS_QUERY, {
+                'courseId': str(course.id), 'first': self.PAGE_SIZE, 'after': after,
+                'withSubmissions': with_submissions, 'submissionsFirst': self.SUBMISSIONS_PER_ASSIGNMENT})
+            if data.get('course') is None:
+                raise ResourceDoesNotExist('Course %s not found' % course.id)
+            assignments = data['course']['assignmentsConnection']
+            yield from assignments['nodes']
+            if not assignments['pageInfo']['hasNextPage']:
+                return
+            after = assignments['pageInfo']['endCursor']
+
+    def _submission_nodes(self, assignment: Dict) -> Iterator[Dict]:
+        # The assignment's first page came with it; any further pages are queried for separately
+        submissions = assignment['submissionsConnection']
+        while True:
+            yield from submissions['nodes']
+            if not submissions['pageInfo']['hasNextPage']:
+                return
+            data = self._query(ASSIGNMENT_SUBMISSIONS_QUERY, {
+                'assignmentId': assignment['_id'], 'first': self.SUBMISSIONS_PER_ASSIGNMENT,
+                'after': submissions['pageInfo']['endCursor']})
+            submissions = data['assignment']['submissionsConnection']
+
+    @staticmethod
+    def _assignment_row(node: Dict) -> Dict:
+        return {'id': _legacy_id(node['_id']),
+                'name': node['name'],
+                'due_at': _utc(node['dueAt']),
+                'unlock_at': _utc(node['unlockAt']),
+                'lock_at': _utc(node['lockAt']),
+                'points_possible': node['pointsPossible'],
+                'allowed_attempts': node['allowedAttempts'],
+                'muted': node['muted']}
+
+    @staticmethod
+    def _submission_row(node: Dict) -> Dict:
+        return {'id': _legacy_id(node['_id']),
+                'assignment_id': _legacy_id(node['assignmentId']),
+                'user_id': _legacy_id(node['userId']),
+                'grade': node['grade'],
+                'submitted_at': _utc(node['submittedAt']),
+                'graded_at': _utc(node['gradedAt']),
+                'grader_id': _legacy_id(node['graderId']),
+                'score': node['score'],
+                'excused': node['excused'],
+                'late_policy_status': node['latePolicyStatus'],
+                'points_deducted': node['deductedPoints'],
+                'late': node['late'],
+                'missing': node['missing'],
+                'entered_grade': node['enteredGrade'],
+                'entered_score': node['enteredScore']}
+
+    def _iter_assignment_columns(self, course: Course, batch_size: int = None,
+                                 count: bool = False) -> Iterator[Dict[str, List]]:
+        rows = (GraphQLCanvasConnection._assignment_row(node) for node in self._assignment_nodes(course, False))
+        return self._project_batches(rows, CanvasConnection.ASSIGNMENT_FIELDS, batch_size=batch_size,
+                                     entity='assignments' if count else None, course_id=course.id)
+
+    def _iter_submission_columns_graphql(self, course: Course, batch_size: int = None) -> Iterator[Dict[str, List]]:
+        rows = (GraphQLCanvasConnection._submission_row(node)
+                for assignment in self._assignment_nodes(course, True)
+                for node in self._submission_nodes(assignment))
+        return self._project_batches(rows, CanvasConnection.SUBMISSION_FIELDS, {'course_id': course.id}, batch_size,
+                                     'submissions', course.id)
+
+    def _iter_submission_columns_bulk(self, course: Course, assignment_ids: List[int] = None,
+                                      student_ids: List[int] = None, order: Dict[int, int] = None,
+                                      batch_size: int = None, **filters) -> Iterator[Dict[str, List]]:
+        if assignment_ids is not None or student_ids is not None or filters:
+            return super()._iter_submission_columns_bulk(course, assignment_ids, student_ids, order, batch_size,
+                                                         **filters)
+        return self._iter_submission_columns_graphql(course, batch_size)
+
+    def _get_submission_columns_bulk(self, course: Course, assignment_ids: List[int] = None,
+                                     student_ids: List[int] = None, assignment_order: List[int] = None,
+                                     **filters) -> Dict[str, List]:
+        if assignment_ids is not None or student_ids is not None or filters:
+            return super()._get_submission_columns_bulk(course, assignment_ids, student_ids, assignment_order,
+                                                        **filters)
+        # Already in assignment order, so there is no need to list the assignments first
+        columns = CanvasConnection._concat_columns(list(self._iter_submission_columns_graphql(course)),
+                                                   CanvasConnection.SUBMISSION_FIELDS)
+        logging.info('%d submissions from GraphQL for course %s', len(columns['id']), course.id)
+        return columns
+
+    def _iter_submission_columns_by_assignment(self, course: Course,
+                                               batch_size: int = None) -> Iterator[Dict[str, List]]:
+        try:
+            yield from self._iter_submission_columns_graphql(course, batch_size)
+        except ResourceDoesNotExist as error:
+            self._skip(error, 'No submissions found for course %s', course)
+        except Forbidden as error:
+            self._skip(error, 'Unauthorized to access submissions for course %s', course)
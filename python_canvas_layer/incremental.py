@@ -0,0 +1,235 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from canvasapi.course import Course
+from canvasapi.exceptions import Forbidden, ResourceDoesNotExist
+from datetime import datetime, timedelta
+import pandas as pd
+import pytz
+import json
+import logging
+import sqlite3
+import threading
+
+from typing import List, Dict, Iterable, Optional, Set
+
+
+class SyncStore(object):
+    """
+    A SQLite file holding the last-synced rows of each course's tables, plus the
+    high-water marks used to ask Canvas only for what changed since.  As with
+    CheckpointStore, several processes may share the file, each syncing its own courses.
+    """
+
+    TIMEOUT = 120
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=SyncStore.TIMEOUT, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._lock = threading.RLock()
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS sync_rows (course_id INTEGER, entity TEXT, row_id INTEGER, '
+                             'position INTEGER, data TEXT, PRIMARY KEY (course_id, entity, row_id))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS sync_marks (course_id INTEGER, name TEXT, value TEXT, '
+                             'PRIMARY KEY (course_id, name))')
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def get_rows(self, course_id: int, entity: str) -> List[Dict]:
+        with self._lock:
+            cursor = self._db.execute('SELECT data FROM sync_rows WHERE course_id = ? AND entity = ? '
+                                      'ORDER BY position, row_id', (course_id, entity))
+            return [json.loads(data) for (data,) in cursor]
+
+    def replace_rows(self, course_id: int, entity: str, rows: List[Dict], key: str = 'id') -> None:
+        """
+        Replace all of a course's rows for entity, remembering their order.
+        """
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM sync_rows WHERE course_id = ? AND entity = ?', (course_id, entity))
+            self._db.executemany('INSERT OR REPLACE INTO sync_rows VALUES (?, ?, ?, ?, ?)',
+                                 [(course_id, entity, row[key], position, json.dumps(row))
+                                  for position, row in enumerate(rows)])
+
+    def upsert_rows(self, course_id: int, entity: str, rows: Iterable[Dict], key: str = 'id') -> None:
+        """
+        Insert or update rows: an updated row keeps its place in the order, and new rows
+        follow all of the existing ones, in the order given.
+
+        Positions only order the rows, so they grow with each upsert and deleted rows leave
+        gaps; replace_rows numbers them from 0 again.
+        """
+        with self._lock, self._db:
+            (last,) = self._db.execute('SELECT COALESCE(MAX(position), -1) FROM sync_rows '
+                                       'WHERE course_id = ? AND entity = ?', (course_id, entity)).fetchone()
+            self._db.executemany('INSERT INTO sync_rows VALUES (?, ?, ?, ?, ?) '
+                                 'ON CONFLICT (course_id, entity, row_id) DO UPDATE SET data = excluded.data',
+                                 [(course_id, entity, row[key], last + 1 + i, json.dumps(row))
+                                  for i, row in enumerate(rows)])
+
+    def delete_rows(self, course_id: int, entity: str, row_ids: Iterable[int]) -> None:
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM sync_rows WHERE course_id = ? AND entity = ? AND row_id = ?',
+                                 [(course_id, entity, row_id) for row_id in row_ids])
+
+    def get_mark(self, course_id: int, name: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute('SELECT value FROM sync_marks WHERE course_id = ? AND name = ?',
+                                   (course_id, name)).fetchone()
+            return row[0] if row else None
+
+    def set_mark(self, course_id: int, name: str, value: Optional[str]) -> None:
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO sync_marks VALUES (?, ?, ?)', (course_id, name, value))
+
+
+class IncrementalSync(object):
+    """
+    Keeps a course's submissions in a SyncStore up to date from a CanvasConnection, and
+    serves them from it.
+
+    Students and assignments are small and are re-listed in full on each sync.  After the
+    first pull only these submissions are fetched:
+    submissions submitted or graded since the stored high-water marks; all submissions of
+    assignments that are new, changed, or whose due/lock date has passed since the last sync
+    (Canvas recomputes 'missing' and 'late' then); and all submissions of newly enrolled
+    students.  Rows of dropped students and deleted assignments are removed.  If either
+    listing comes back empty while the store has rows, it may have been refused, so the
+    course is refreshed in full rather than having all of its submissions deleted.
+
+    The frames returned have the same rows as those of a full refresh (see full=True),
+    grouped by assignment in Canvas' order.  Within an assignment, rows keep the place
+    they were first stored in and rows added since the last full refresh follow the older
+    ones, so there the order can differ from that of a full refresh.
+
+    The changes can only be asked for from the bulk submissions endpoint: where Canvas
+    refuses it, each sync is a full refresh, one assignment at a time.
+    """
+
+    # Re-read a little before each mark to allow for clock skew between Canvas servers
+    OVERLAP = timedelta(minutes=5)
+
+    def __init__(self, canvas: CanvasConnection, store: SyncStore):
+        self.canvas = canvas
+        self.store = store
+
+    @staticmethod
+    def _since(mark: str) -> str:
+        when = pd.to_datetime(mark, utc=True) - IncrementalSync.OVERLAP
+        return when.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    @staticmethod
+    def _max_mark(mark: Optional[str], rows: List[Dict], column: str) -> Optional[str]:
+        # Canvas timestamps are all ISO 8601 in UTC ('...Z'), so they order as strings
+        values = [row[column] for row in rows if row[column]]
+        if mark:
+            values.append(mark)
+        return max(values) if values else None
+
+    def get_assignment_submissions(self, course: Course, full: bool = False) -> List[Dict]:
+        """
+        Brings the stored submissions for the course up to date and returns all of them.
+        """
+        rightnow = datetime.utcnow().replace(tzinfo=pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        last_sync = self.store.get_mark(course.id, 'last_sync')
+
+        # The assignments and students as of the last sync
+        old_assignments = {row['id']: row for row in self.store.get_rows(course.id, 'submission_assignments')}
+        old_students = set(row['id'] for row in self.store.get_rows(course.id, 'submission_students'))
+        # Read without counting their rows: only the submissions are handed back
+        assignments = CanvasConnection._to_rows(self.canvas._get_assignment_columns(course))
+        students = CanvasConnection._to_rows(self.canvas._get_student_columns(course))
+        order = [row['id'] for row in assignments]
+
+        delta = None
+        if not full and last_sync is not None and ((old_students and not students) or
+                                                   (old_assignments and not assignments)):
+            # More likely a refused listing than a course emptied since the last sync
+            logging.warning('Course %s listed no students or assignments, refreshing all submissions', course.id)
+        elif not full and last_sync is not None:
+            submitted_mark = self.store.get_mark(course.id, 'submitted_at')
+            graded_mark = self.store.get_mark(course.id, 'graded_at')
+            try:
+                delta = self._get_delta(course, last_sync, rightnow, submitted_mark, graded_mark, old_assignments,
+                                        old_students, assignments, students, order)
+            except (Forbidden, ResourceDoesNotExist):
+                logging.warning('Bulk submissions unavailable for course %s, refreshing all of them', course.id)
+
+        if delta is None:
+            # The same rows as CanvasConnection.get_assignment_submissions, including its fallback
+            rows = self.canvas.get_assignment_submissions(course, assignment_order=order)
+            self.store.replace_rows(course.id, 'submissions', rows)
+            submitted_mark = IncrementalSync._max_mark(None, rows, 'submitted_at')
+            graded_mark = IncrementalSync._max_mark(None, rows, 'graded_at')
+        else:
+            current_assignments = set(order)
+            current_students = set(row['id'] for row in students)
+            dropped_students = old_students - current_students
+            stale = [row['id'] for row in self.store.get_rows(course.id, 'submissions')
+                     if row['assignment_id'] not in current_assignments or row['user_id'] in dropped_students]
+
+            self.store.delete_rows(course.id, 'submissions', stale)
+            self.store.upsert_rows(course.id, 'submissions', delta)
+            submitted_mark = IncrementalSync._max_mark(submitted_mark, delta, 'submitted_at')
+            graded_mark = IncrementalSync._max_mark(graded_mark, delta, 'graded_at')
+            logging.info('Course %s: %d changed submissions, %d removed', course.id, len(delta), len(stale))
+
+        self.store.replace_rows(course.id, 'submission_assignments', assignments)
+        self.store.replace_rows(course.id, 'submission_students', students)
+        self.store.set_mark(course.id, 'submitted_at', submitted_mark)
+        self.store.set_mark(course.id, 'graded_at', graded_mark)
+        self.store.set_mark(course.id, 'last_sync', rightnow)
+
+        # Same order as a full pull: by assignment, and within each in the order Canvas gave
+        # (the store keeps each row's place, and sort is stable)
+        position = {assignment_id: i for i, assignment_id in enumerate(order)}
+        rows = self.store.get_rows(course.id, 'submissions')
+        rows.sort(key=lambda row: position.get(row['assignment_id'], len(position)))
+        return rows
+
+    def _get_delta(self, course: Course, last_sync: str, rightnow: str, submitted_mark: Optional[str],
+                   graded_mark: Optional[str], old_assignments: Dict[int, Dict], old_students: Set[int],
+                   assignments: List[Dict], students: List[Dict], order: List[int]) -> List[Dict]:
+        # The submissions that may have changed since last_sync, from the bulk endpoint
+        refetch = []
+        for row in assignments:
+            old = old_assignments.get(row['id'])
+            passed = [row[column] for column in ('due_at', 'lock_at')
+                      if row[column] and last_sync <= row[column] <= rightnow]
+            if old != row or passed:
+                refetch.append(row['id'])
+        new_students = [row['id'] for row in students if row['id'] not in old_students]
+
+        # Whole listings first, so that rows new to the store are added in Canvas' order
+        delta = []
+        if refetch:
+            delta.extend(self.canvas.get_assignment_submissions_bulk(
+                course, assignment_ids=refetch, assignment_order=order))
+        if new_students:
+            delta.extend(self.canvas.get_assignment_submissions_bulk(
+                course, student_ids=new_students, assignment_order=order))
+        delta.extend(self.canvas.get_assignment_submissions_bulk(
+            course, assignment_order=order, submitted_since=IncrementalSync._since(submitted_mark or last_sync)))
+        delta.extend(self.canvas.get_assignment_submissions_bulk(
+            course, assignment_order=order, graded_since=IncrementalSync._since(graded_mark or last_sync)))
+        return delta
+
+    def get_assignment_submissions_df(self, course: Course, full: bool = False) -> pd.DataFrame:
+        return self.canvas.build_frame(self.get_assignment_submissions(course, full), 'submissions')
@@ -0,0 +1,290 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+Instrumentation hooks for CanvasConnection.
+
+A MetricsHook passed to CanvasConnection (or CanvasStatus) is told about every HTTP
+request, every throttling backoff and the rows produced for each course.  Without one,
+the connection makes no calls and no measurements beyond a None check per request.
+RunMetrics aggregates the events per endpoint and per course and summarizes the run.
+"""
+
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+import logging
+import re
+import threading
+
+import pandas as pd
+
+_COURSE = re.compile(r'/courses/(\d+)')
+_IDS = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_of(url: str) -> Tuple[str, Optional[int]]:
+    """
+    Returns the endpoint of a Canvas URL with its ids replaced by ':id' (and without the
+    host or query), along with the course id it refers to, if any.
+    """
+    path = url.split('?', 1)[0]
+    start = path.find('/api/')
+    if start >= 0:
+        path = path[start:]
+    course = _COURSE.search(path)
+    return _IDS.sub('/:id', path), int(course.group(1)) if course else None
+
+
+class RequestEvent(object):
+    """
+    One HTTP attempt: attempt is 0 for the first try and counts up through throttling
+    retries; cached is set when the response came from the response cache instead.
+    """
+    __slots__ = ('method', 'url', 'endpoint', 'course_id', 'status', 'seconds', 'bytes', 'attempt', 'throttled',
+                 'cached')
+
+    def __init__(self, method: str, url: str, status: int, seconds: float, nbytes: int, attempt: int = 0,
+                 throttled: bool = False, cached: bool = False):
+        self.method = method
+        self.url = url
+        self.endpoint, self.course_id = endpoint_of(url)
+        self.status = status
+        self.seconds = seconds
+        self.bytes = nbytes
+        self.attempt = attempt
+        self.throttled = throttled
+        self.cached = cached
+
+
+class MetricsHook(object):
+    """
+    Base class for instrumentation hooks; each method does nothing unless overridden.
+    Hooks are called from whichever thread made the request, so they must be thread-safe.
+    """
+
+    def on_request(self, event: RequestEvent) -> None:
+        pass
+
+    def on_throttle(self, url: str, seconds: float) -> None:
+        """
+        A throttled request will be retried after sleeping this long.
+        """
+        pass
+
+    def on_rows(self, entity: str, course_id: Optional[int], rows: int) -> None:
+        pass
+
+    def on_run_end(self) -> None:
+        pass
+
+
+class HookList(MetricsHook):
+    """
+    Passes each event on to several hooks.
+    """
+
+    def __init__(self, hooks: List[MetricsHook]):
+        self.hooks = list(hooks)
+
+    def on_request(self, event: RequestEvent) -> None:
+        for hook in self.hooks:
+            hook.on_request(event)
+
+    def on_throttle(self, url: str, seconds: float) -> None:
+        for hook in self.hooks:
+            hook.on_throttle(url, seconds)
+
+    def on_rows(self, entity: str, course_id: Optional[int], rows: int) -> None:
+        for hook in self.hooks:
+            hook.on_rows(entity, course_id, rows)
+
+    def on_run_end(self) -> None:
+        for hook in self.hooks:
+            hook.on_run_end()
+
+
+class EventRecorder(MetricsHook):
+    """
+    Keeps the events it is given, so that they can be replayed into another hook later,
+    e.g. from a worker process into the hook of the process that started it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: List[Tuple] = []
+
+    def on_request(self, event: RequestEvent) -> None:
+        with self._lock:
+            self._events.append(('on_request', event))
+
+    def on_throttle(self, url: str, seconds: float) -> None:
+        with self._lock:
+            self._events.append(('on_throttle', url, seconds))
+
+    def on_rows(self, entity: str, course_id: Optional[int], rows: int) -> None:
+        with self._lock:
+            self._events.append(('on_rows', entity, course_id, rows))
+
+    def drain(self) -> List[Tuple]:
+        """
+        The events recorded since the last drain, oldest first (they are picklable).
+        """
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+    @staticmethod
+    def replay(events: List[Tuple], hook: MetricsHook) -> None:
+        for name, *args in events:
+            getattr(hook, name)(*args)
+
+
+class LoggingHook(MetricsHook):
+    """
+    Logs every event, at DEBUG by default.
+    """
+
+    def __init__(self, level: int = logging.DEBUG):
+        self.level = level
+
+    def on_request(self, event: RequestEvent) -> None:
+        logging.log(self.level, '%s %s: %s, %d bytes in %.3fs%s', event.method, event.url, event.status, event.bytes,
+                    event.seconds, ' (cached)' if event.cached else ' (retry %d)' % event.attempt if event.attempt else '')
+
+    def on_throttle(self, url: str, seconds: float) -> None:
+        logging.log(self.level, 'Throttled on %s, waiting %.2fs', url, seconds)
+
+    def on_rows(self, entity: str, course_id: Optional[int], rows: int) -> None:
+        logging.log(self.level, 'Course %s: %d %s', course_id, rows, entity)
+
+
+class RunMetrics(MetricsHook):
+    """
+    Totals requests, pages (successful responses), cached responses, bytes, retries, time
+    spent in requests and throttling waits per (endpoint, course), a latency histogram per
+    (endpoint, course), and rows per (course, entity).  At the end of a run the summary is logged.
+    """
+
+    # Upper bounds, in seconds, of the latency histogram's buckets (the last is open-ended)
+    LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+    COUNTERS = ['requests', 'pages', 'cached', 'bytes', 'retries', 'seconds', 'throttle_wait']
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters: Dict[Tuple[str, Optional[int]], List[float]] = {}
+            self._latency: Dict[Tuple[str, Optional[int]], List[int]] = {}
+            self._rows: Dict[Tuple[Optional[int], str], int] = {}
+
+    def _counter(self, endpoint: str, course_id: Optional[int]) -> List[float]:
+        # Called with the lock held; the list holds the values of COUNTERS, in order
+        key = (endpoint, course_id)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = [0] * len(RunMetrics.COUNTERS)
+        return counter
+
+    def on_request(self, event: RequestEvent) -> None:
+        with self._lock:
+            counter = self._counter(event.endpoint, event.course_id)
+            if event.cached:
+                counter[2] += 1
+                counter[3] += event.bytes
+                return
+            counter[0] += 1
+            if event.attempt:
+                counter[4] += 1
+            counter[5] += event.seconds
+            if not event.throttled and event.status < 400:
+                counter[1] += 1
+                counter[3] += event.bytes
+            key = (event.endpoint, event.course_id)
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = [0] * (len(RunMetrics.LATENCY_BUCKETS) + 1)
+            histogram[bisect_left(RunMetrics.LATENCY_BUCKETS, event.seconds)] += 1
+
+    def on_throttle(self, url: str, seconds: float) -> None:
+        endpoint, course_id = endpoint_of(url)
+        with self._lock:
+            self._counter(endpoint, course_id)[6] += seconds
+
+    def on_rows(self, entity: str, course_id: Optional[int], rows: int) -> None:
+        with self._lock:
+            key = (course_id, entity)
+            self._rows[key] = self._rows.get(key, 0) + rows
+
+    def summary(self, by: str = 'endpoint') -> pd.DataFrame:
+        """
+        The counters summed by 'endpoint' or by 'course' (course_id), busiest first.  By
+        course, the rows produced for that course are included.
+        """
+        if by not in ('endpoint', 'course'):
+            raise ValueError('summary by must be "endpoint" or "course"')
+        with self._lock:
+            records = [[endpoint, course_id] + list(counter) for (endpoint, course_id), counter in
+                       self._counters.items()]
+            rows = dict(self._rows)
+        if not records:
+            # Nothing to group: the same columns, without any rows
+            if by == 'endpoint':
+                return pd.DataFrame(columns=RunMetrics.COUNTERS, index=pd.Index([], name='endpoint'))
+            return pd.DataFrame(columns=RunMetrics.COUNTERS + ['rows'],
+                                index=pd.Index([], name='course_id', dtype='Int64'))
+        frame = pd.DataFrame(records, columns=['endpoint', 'course_id'] + RunMetrics.COUNTERS)
+        frame['course_id'] = frame['course_id'].astype('Int64')
+        if by == 'endpoint':
+            ret = frame.groupby('endpoint').sum(numeric_only=True).drop(columns=['course_id'])
+        else:
+            ret = frame.groupby('course_id', dropna=False).sum(numeric_only=True)
+            totals = {}
+            for (course_id, _), count in rows.items():
+                totals[course_id] = totals.get(course_id, 0) + count
+            ret['rows'] = pd.Series(totals, dtype='int64').reindex(ret.index).fillna(0).astype('int64')
+        return ret.sort_values('seconds', ascending=False)
+
+    def rows(self) -> pd.DataFrame:
+        """
+        Rows produced, by course and entity.
+        """
+        with self._lock:
+            records = [[course_id, entity, count] for (course_id, entity), count in self._rows.items()]
+        ret = pd.DataFrame(records, columns=['course_id', 'entity', 'rows'])
+        ret['course_id'] = ret['course_id'].astype('Int64')
+        return ret
+
+    def latency_histogram(self, endpoint: str = None, course_id: int = None) -> pd.Series:
+        """
+        Request counts per latency bucket (labelled by upper bound in seconds) for one
+        endpoint and/or one course, or for all of them.
+        """
+        with self._lock:
+            histograms = [histogram for (name, course), histogram in self._latency.items()
+                          if endpoint in (None, name) and course_id in (None, course)]
+        counts = [sum(column) for column in zip(*histograms)] if histograms else \
+            [0] * (len(RunMetrics.LATENCY_BUCKETS) + 1)
+        labels = ['<=%gs' % bound for bound in RunMetrics.LATENCY_BUCKETS] + \
+            ['>%gs' % RunMetrics.LATENCY_BUCKETS[-1]]
+        return pd.Series(counts, index=labels, name=endpoint or ('course %d' % course_id if course_id else 'all'))
+
+    def on_run_end(self) -> None:
+        with pd.option_context('display.width', 200, 'display.max_rows', 50, 'display.max_columns', None):
+            logging.info('Canvas requests by endpoint:\n%s', self.summary('endpoint'))
+            logging.info('Canvas requests by course:\n%s', self.summary('course'))
@@ -0,0 +1,104 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Sorts after any character that can follow a prefix, so prefix + _BEYOND bounds the titles starting with it
+_BEYOND = '\U0010ffff'
+
+
+class _TitleIndex(object):
+    """
+    The titles of one type of module item, sorted, with the frame position of each, and a
+    sparse table of range minima over those positions: a prefix is a contiguous range of
+    the sorted titles, and the first match in frame order is the smallest position in it.
+    """
+
+    def __init__(self, titles: np.ndarray, positions: np.ndarray):
+        order = np.argsort(titles, kind='stable')
+        self.titles = titles[order]
+        levels = [positions[order]]
+        width = 1
+        while 2 * width <= len(positions):
+            previous = levels[-1]
+            levels.append(np.minimum(previous[:-width], previous[width:]))
+            width *= 2
+        # levels[k][i] is the smallest position among sorted titles i .. i + 2**k - 1
+        self.levels = levels
+
+    def first(self, prefixes: np.ndarray) -> np.ndarray:
+        """
+        For each prefix, the frame position of the first title starting with it, or -1.
+        """
+        low = np.searchsorted(self.titles, prefixes, side='left')
+        high = np.searchsorted(self.titles, np.char.add(prefixes, _BEYOND), side='left')
+        ret = np.full(len(prefixes), -1, dtype=np.int64)
+        found = high > low
+        if found.any():
+            low, high = low[found], high[found]
+            k = np.floor(np.log2(high - low)).astype(np.int64)
+            ret[found] = [min(self.levels[level][start], self.levels[level][end - (1 << level)])
+                          for level, start, end in zip(k, low, high)]
+        return ret
+
+
+class ModuleItemIndex(object):
+    """
+    An index over a course's get_module_items_df frame for get_matching_module_url: for each
+    item type, the titles in sorted order, so that finding the first item (in frame order)
+    whose title starts with a prefix takes a binary search rather than a scan of the frame.
+    Build it once per course and look up as many prefixes as needed, singly or in batches.
+    """
+
+    def __init__(self, module_items: pd.DataFrame):
+        self.size = len(module_items)
+        self._urls: Dict[str, List] = {}
+        self._types: Dict[str, _TitleIndex] = {}
+        if not self.size:
+            return
+        for column in ('html_url', 'external_url'):
+            self._urls[column] = list(module_items[column]) if column in module_items.columns else [None] * self.size
+        titles = np.array([str(title) for title in module_items['title']], dtype=str)
+        types = module_items['type'].astype(str).to_numpy()
+        for typ in pd.unique(types):
+            positions = np.flatnonzero(types == typ)
+            self._types[typ] = _TitleIndex(titles[positions], positions)
+
+    @staticmethod
+    def _column(typ: str) -> str:
+        # Quizzes are linked by their Canvas page; other items (external URLs) by their target
+        return 'html_url' if typ == 'Quiz' else 'external_url'
+
+    def lookup(self, index: str, typ: str) -> Optional[str]:
+        """
+        The URL get_matching_module_url returns: that of the first item of type typ whose
+        title starts with index, or None.
+        """
+        return self.lookup_many([index], typ)[0]
+
+    def lookup_many(self, prefixes: Iterable[str], typ: str) -> List[Optional[str]]:
+        """
+        lookup for each of prefixes, in one pass.
+        """
+        prefixes = np.array(list(prefixes), dtype=str)
+        titles = self._types.get(typ)
+        if titles is None or not len(prefixes):
+            return [None] * len(prefixes)
+        urls = self._urls[ModuleItemIndex._column(typ)]
+        return [urls[position] if position >= 0 else None for position in titles.first(prefixes)]
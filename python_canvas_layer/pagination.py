@@ -0,0 +1,145 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import threading
+
+import requests
+
+
+def page_number(url: str) -> Optional[int]:
+    """
+    The page=N of a pagination link, or None if the listing pages by an opaque bookmark.
+    """
+    for name, value in parse_qsl(urlsplit(url).query, keep_blank_values=True):
+        if name == 'page':
+            return int(value) if value.isdigit() else None
+    return None
+
+
+def with_page(url: str, page: int) -> str:
+    """
+    The pagination link url with its page number replaced by page.
+    """
+    parts = urlsplit(url)
+    query = [(name, str(page) if name == 'page' else value)
+             for name, value in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def next_page(response: requests.Response) -> Optional[str]:
+    """
+    The URL of the page after response's, from its rel="next" link or, for the few
+    endpoints that page in the body instead, its meta.pagination.next (as canvasapi's
+    PaginatedList does); None on the last page.
+    """
+    if response.links:
+        link = response.links.get('next')
+        return link['url'] if link else None
+    if response.content.lstrip()[:1] == b'{':
+        try:
+            return response.json()['meta']['pagination']['next']
+        except (KeyError, TypeError, ValueError):
+            return None
+    return None
+
+
+def remaining_pages(next_url: str, last_url: Optional[str]) -> Optional[List[str]]:
+    """
+    The URLs of every page from next_url through last_url, if both are numbered pages;
+    otherwise None, and the pages can only be found by following the next links.
+    """
+    if last_url is None:
+        return None
+    first, last = page_number(next_url), page_number(last_url)
+    if first is None or last is None or last < first:
+        return None
+    return [with_page(next_url, page) for page in range(first, last + 1)]
+
+
+class PageFetcher(object):
+    """
+    Reads the pages of a Canvas listing through a canvasapi Requester, in order.
+
+    After the first page, if Canvas gives a rel="last" link and the links are numbered
+    (page=N), the remaining pages are requested concurrently on a shared pool of
+    max_workers threads, keeping at most window of them outstanding, and are yielded
+    in page order.  Listings paged by bookmarks (or without a last link, or paged by
+    meta.pagination in the body) are read one page at a time by following the next link.
+    """
+
+    def __init__(self, requester, max_workers: int = 4, window: int = None):
+        self.requester = requester
+        self.max_workers = max_workers
+        self.window = window or 2 * max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='canvas-pages')
+            return self._pool
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _get(self, method: str, url: str) -> requests.Response:
+        return self.requester.request(method, _url=url)
+
+    def pages(self, method: str, endpoint: str, url_override: str = None, **params) -> Iterator[requests.Response]:
+        """
+        Yields the responses for each page of the listing at endpoint; params are passed to
+        the Requester for the first request (later pages carry them in their links).
+        """
+        response = self.requester.request(method, endpoint, _url=url_override, **params)
+        yield response
+
+        url = next_page(response)
+        if url is None:
+            return
+        last_link = response.links.get('last')
+        urls = remaining_pages(url, last_link['url'] if last_link else None)
+        if urls is not None and len(urls) > 1 and self.max_workers > 1:
+            yield from self._parallel(method, urls)
+            return
+
+        while url:
+            response = self._get(method, url)
+            yield response
+            url = next_page(response)
+
+    def _parallel(self, method: str, urls: List[str]) -> Iterator[requests.Response]:
+        pool = self._get_pool()
+        pending = iter(urls)
+        futures = deque(pool.submit(self._get, method, url) for _, url in zip(range(self.window), pending))
+        try:
+            while futures:
+                response = futures.popleft().result()
+                url = next(pending, None)
+                if url is not None:
+                    futures.append(pool.submit(self._get, method, url))
+                yield response
+        finally:
+            # The caller stopped early or a page failed: don't fetch the rest
+            for future in futures:
+                future.cancel()
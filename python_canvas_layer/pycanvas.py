@@ -15,22 +15,177 @@
 #####################################################################################################################
 
 from canvasapi import Canvas
+from canvasapi.account import Account
 from canvasapi.course import Course
-from canvasapi.module import Module
+from canvasapi.module import Module, ModuleItem
 from canvasapi.assignment import Assignment
 from canvasapi.exceptions import *
 from canvasapi.paginated_list import PaginatedList
+from canvasapi.util import combine_kwargs
+from requests.adapters import HTTPAdapter
 import pandas as pd
-from python_canvas_layer.course_info import CourseApi
+from python_canvas_layer.course_info import CourseApi, RecordBatch
+from python_canvas_layer import course_info
+from python_canvas_layer.scheduler import RateLimitScheduler, ScheduledSession
+from python_canvas_layer.cache import ResponseCache
+from python_canvas_layer.schemas import SCHEMAS, build_frame
+from python_canvas_layer.metrics import MetricsHook
+from python_canvas_layer.pagination import PageFetcher
+from python_canvas_layer.module_index import ModuleItemIndex
+from python_canvas_layer.run_scope import RunScope
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+import pytz
 import logging
-from typing import List, Dict
+from typing import Any, Callable, List, Dict, Tuple, Iterable, Iterator, Union
+import threading
+
+# orjson is optional; it parses the raw_json transport's pages several times faster
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
 
 class CanvasConnection(CourseApi):
-    def __init__(self, canvas_url, canvas_key):
+    def __init__(self, canvas_url, canvas_key, scheduler: RateLimitScheduler = None, cache: ResponseCache = None,
+                 raw_json: bool = False, typed: bool = False, metrics: MetricsHook = None,
+                 page_workers: int = 4, strict: bool = False):
+        """
+        With raw_json, students, assignments and submissions are read straight from the
+        JSON pages into column buffers, skipping canvasapi's per-row object construction
+        (and its date parsing of every field).  The results are the same either way.
+
+        With typed, the *_df methods return frames with the column types declared in
+        schemas.py (UTC timestamps, nullable integer ids, categoricals and booleans) rather
+        than the object columns pandas infers from the JSON values.
+
+        A MetricsHook (such as metrics.RunMetrics) is told of every request the connection
+        makes and of the rows it produces for each course.
+
+        Listings whose pages Canvas numbers are read up to page_workers pages at a time once
+        the first page gives the last page number; see pagination.PageFetcher.
+
+        Where a course's quizzes, students, summaries or submissions are refused or not
+        found, the connection logs a warning and returns nothing for them; with strict, it
+        raises the error instead.
+
+        Within run_scope, listings that several methods read (a course's assignments and its
+        modules) are requested once and shared.
+        """
         self.canvas = Canvas(canvas_url, canvas_key)
+        self.raw_json = raw_json
+        self.typed = typed
+        self.strict = strict
+        # canvasapi keeps its Requester (and the requests.Session under it) private
+        self._requester = self.canvas._Canvas__requester
+
+        # All HTTP traffic is admitted by the rate-limit scheduler; see get_rate_limit_budget().
+        # GETs are answered from the response cache when one is given; see get_cache_stats().
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.cache = cache
+        self.metrics = metrics
+        self._requester._session = ScheduledSession(self.scheduler, cache, metrics)
+        self._pages = PageFetcher(self._requester, page_workers)
 
-        self.get_course_list_full()
+        # Courses are only listed when first asked for, so constructing a connection is free
+        self.courses = None
+        self.course_objs = None
+
+        # The listings shared within run_scope, and how many scopes are open
+        self._scope = None
+        self._scope_depth = 0
+        self._scope_lock = threading.Lock()
         return
+
+    def set_max_connections(self, max_connections: int) -> None:
+        """
+        Size the HTTP keep-alive pool for the number of threads that will share this connection
+        (the page fetcher's threads are added to it).
+        """
+        max_connections += self._pages.max_workers
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self._requester._session.mount('https://', adapter)
+        self._requester._session.mount('http://', adapter)
+
+    def get_rate_limit_budget(self) -> Dict:
+        """
+        Returns the scheduler's current view of the Canvas rate limit: remaining bucket,
+        last request cost, concurrency limit and requests in flight, and throttling so far.
+        """
+        return self.scheduler.budget
+
+    def get_cache_stats(self) -> Dict:
+        """
+        Returns the response cache's hit, revalidation, miss and eviction counts (empty if
+        there is no cache).
+        """
+        return self.cache.stats if self.cache else {}
+
+    @contextmanager
+    def run_scope(self) -> Iterator[RunScope]:
+        """
+        For the duration of the with block, each course's assignment and module listings are
+        requested from Canvas once, whichever methods (and threads) read them, and kept until
+        the block ends or release_course is called for the course.  Scopes may be nested; the
+        listings are kept until the outermost one ends.
+        """
+        with self._scope_lock:
+            if self._scope is None:
+                self._scope = RunScope()
+            self._scope_depth += 1
+            scope = self._scope
+        try:
+            yield scope
+        finally:
+            with self._scope_lock:
+                self._scope_depth -= 1
+                if not self._scope_depth:
+                    self._scope = None
+
+    def release_course(self, course_id: int) -> None:
+        """
+        Drops the listings of a course that the current run has finished with.
+        """
+        scope = self._scope
+        if scope is not None:
+            scope.release(course_id)
+
+    def _shared(self, course_id: int, endpoint: str, params: Dict, load: Callable[[], Any]) -> Any:
+        # load() once per run scope for this course, endpoint and params; every time outside one
+        scope = self._scope
+        if scope is None:
+            return load()
+        return scope.get(course_id, endpoint, params, load)
+
+    def _shared_records(self, course_id: int, endpoint: str, listing, **kwargs) -> Iterable:
+        """
+        _records, but read once and shared within a run scope (outside one, the records are
+        streamed as usual).
+        """
+        if self._scope is None:
+            return self._records(endpoint, listing, **kwargs)
+        return self._shared(course_id, endpoint, kwargs, lambda: list(self._records(endpoint, listing, **kwargs)))
+
+    def _count_rows(self, entity: str, course_id, rows: int) -> None:
+        if self.metrics is not None:
+            self.metrics.on_rows(entity, course_id, rows)
+
+    def _skip(self, error: CanvasException, message: str, *args) -> None:
+        """
+        Called on an error after which the connection carries on with an empty result: logs
+        the message, or re-raises the error if the connection is strict.
+        """
+        if self.strict:
+            raise error
+        logging.warning(message + ' (%s)', *args, error)
+
+    def build_frame(self, data, entity: str) -> pd.DataFrame:
+        """
+        Builds the frame for entity (a key of schemas.SCHEMAS) from row dictionaries or
+        column lists, applying its schema if the connection is typed.
+        """
+        return build_frame(data, SCHEMAS[entity] if self.typed else None)
     
     def _get_paginated(the_list, paginated: PaginatedList):
         #for item in paginated:
@@ -38,56 +193,142 @@ class CanvasConnection(CourseApi):
 
         the_list.extend([item for item in paginated])
         return the_list
+
+    def _paginate(self, paginated) -> Iterator:
+        """
+        Yields the objects of a canvasapi PaginatedList as iterating it would, but reads the
+        pages through the connection's PageFetcher, so numbered pages arrive concurrently.
+        This reads the PaginatedList's private attributes, so pyproject.toml pins the
+        canvasapi major version; the paging itself is PaginatedList._get_next_page's.
+        """
+        if not isinstance(paginated, PaginatedList):
+            yield from paginated
+            return
+        params = dict(paginated._first_params)
+        # The Requester extends the _kwargs list it is given
+        params['_kwargs'] = list(params.get('_kwargs', []))
+        for response in self._pages.pages(paginated._request_method, paginated._first_url,
+                                          paginated._url_override, **params):
+            page = _json_loads(response.content)
+            if paginated._root:
+                try:
+                    page = page[paginated._root]
+                except KeyError:
+                    raise ValueError('The key <%s> does not exist in the response.' % paginated._root)
+            for element in page:
+                if element is not None:
+                    element.update(paginated._extra_attribs)
+                    yield paginated._content_class(self._requester, element)
     
     def get_course_list(self) -> List[Dict]:
+        if self.courses is None:
+            self.get_course_list_full()
         return self.courses
 
     def get_course_list_objs(self) -> List[Course]:
+        if self.course_objs is None:
+            self.get_course_list_full()
         return self.course_objs
     
-    def get_course_list_df(self) -> pd.DataFrame:
-        return pd.DataFrame(self.get_course_list())
+    def get_course_list_df(self, course_objs: List[Course] = None) -> pd.DataFrame:
+        """
+        Returns a dataframe of the courses visible to the token, or of course_objs if given.
+        """
+        if course_objs is not None:
+            return self.build_frame([CanvasConnection._course_row(course) for course in course_objs], 'courses')
+        return self.build_frame(self.get_course_list(), 'courses')
+
+    @staticmethod
+    def _course_row(course: Course) -> Dict:
+        try:
+            return {
+                'id': course.id,
+                'name': course.name,
+                'start_at': course.start_at,
+                'end_at': course.end_at,
+                'workflow_state': course.workflow_state,
+                # 'course_code': course.course_code,
+                'sis_course_id': course.sis_course_id,
+                # 'integration_id': course.integration_id,
+                # 'hide_final_grades': course.hide_final_grades,
+                'is_public': course.is_public,
+            }
+        except AttributeError:
+            return {
+                'id': course.id,
+                'name': course.name,
+                'start_at': course.start_at,
+                'end_at': course.end_at,
+                'workflow_state': course.workflow_state,
+                # 'course_code': course.course_code,
+                #'sis_course_id': course.sis_course_id,
+                # 'integration_id': course.integration_id,
+                # 'hide_final_grades': course.hide_final_grades,
+                'is_public': course.is_public,
+            }
     
-    def get_course_list_full(self) -> pd.DataFrame:
+    def get_course_list_full(self, **filters) -> pd.DataFrame:
+        """
+        Pages through every course visible to the token (narrowed by any GET /courses
+        filters given) and remembers them for get_course_list and get_course_list_objs.
+        """
         course_list = []
         # CanvasConnection._get_paginated(course_list, 
-        course_list = self.canvas.get_courses(per_page=100)
+        course_list = self._paginate(self.canvas.get_courses(per_page=100, **filters))
         self.courses = []
         self.course_objs = []        
         for course in course_list:
             self.course_objs.append(course)
-            try:
-                self.courses.append({
-                    'id': course.id,
-                    'name': course.name,
-                    'start_at': course.start_at,
-                    'end_at': course.end_at,
-                    'workflow_state': course.workflow_state,
-                    # 'course_code': course.course_code,
-                    'sis_course_id': course.sis_course_id,
-                    # 'integration_id': course.integration_id,
-                    # 'hide_final_grades': course.hide_final_grades,
-                    'is_public': course.is_public,
-                })
-            except AttributeError:
-                self.courses.append({
-                    'id': course.id,
-                    'name': course.name,
-                    'start_at': course.start_at,
-                    'end_at': course.end_at,
-                    'workflow_state': course.workflow_state,
-                    # 'course_code': course.course_code,
-                    #'sis_course_id': course.sis_course_id,
-                    # 'integration_id': course.integration_id,
-                    # 'hide_final_grades': course.hide_final_grades,
-                    'is_public': course.is_public,
-            })
+            self.courses.append(CanvasConnection._course_row(course))
+        self._count_rows('courses', None, len(self.courses))
             
         return self.courses
     
     def get_course(self, course_id: str) -> Course:
         return self.canvas.get_course(course_id)
 
+    def get_courses_by_id(self, course_ids: List[str]) -> List[Course]:
+        """
+        Fetches just the given courses, one request each, in the order given, each with its
+        enrollment term (so that courses dated by their term can be checked).
+        """
+        courses = []
+        seen = set()
+        for course_id in course_ids:
+            if str(course_id) in seen:
+                continue
+            seen.add(str(course_id))
+            try:
+                courses.append(self.canvas.get_course(course_id, include=['term']))
+            except ResourceDoesNotExist:
+                logging.warning('Course %s not found', course_id)
+            except Forbidden:
+                logging.warning('Unauthorized to access course %s', course_id)
+        return courses
+
+    def get_active_course_objs(self, account_id: int = None, term_id: int = None) -> List[Course]:
+        """
+        Lists the courses that Canvas considers current, filtering on the server.
+
+        Without an account this is the token's own courses with active enrollments in
+        available courses; with an account_id (for admin tokens) it is the account's available
+        courses whose dates, or whose term's dates, span the present.  Either can be narrowed
+        to one enrollment term.
+        """
+        if account_id is not None:
+            # Only the id is needed to list an account's courses, so skip fetching the account
+            account = Account(self._requester, {'id': account_id})
+            rightnow = datetime.utcnow().replace(tzinfo=pytz.utc)
+            filters = {'state': ['available'], 'starts_before': rightnow, 'ends_after': rightnow}
+            if term_id is not None:
+                filters['enrollment_term_id'] = term_id
+            return list(self._paginate(account.get_courses(per_page=100, **filters)))
+
+        courses = self._paginate(self.canvas.get_courses(enrollment_state='active', state=['available'],
+                                                         per_page=100))
+        return [course for course in courses
+                if term_id is None or getattr(course, 'enrollment_term_id', None) == term_id]
+
     def get_quizzes(self, course: Course) -> List[Dict]:
         """
         Returns a list of dictionaries containing the quizzes for a course.
@@ -96,27 +337,49 @@ class CanvasConnection(CourseApi):
         try:
             quiz_list = []
             #CanvasConnection._get_paginated(quiz_list, 
-            quiz_list = course.get_quizzes(per_page=100)
+            quiz_list = self._paginate(course.get_quizzes(per_page=100))
             for quiz in quiz_list:
                 quizzes.append({'id':quiz.id,'title':quiz.title,'published':quiz.published,\
                     'unlock_at': quiz.unlock_at, 'due_at': quiz.due_at, 'lock_at': quiz.lock_at, 'published': quiz.published})
-        except ResourceDoesNotExist:
-            logging.warning('No quizzes found for course %s', course)
-            pass
+        except ResourceDoesNotExist as error:
+            self._skip(error, 'No quizzes found for course %s', course)
 
+        self._count_rows('quizzes', course.id, len(quizzes))
         return quizzes
     
     def get_quizzes_df(self, course: Course) -> pd.DataFrame:
-        return pd.DataFrame(self.get_quizzes(course))
+        return self.build_frame(self.get_quizzes(course), 'quizzes')
 
-    def get_modules(self, course: Course) -> List[Dict]:
+    def _load_modules(self, course: Course) -> List[Tuple[Module, List[ModuleItem]]]:
         """
-        Returns a list of dictionaries containing the modules for a course.
+        Lists a course's modules together with their items, using include[]=items so that
+        a course normally costs one paginated request.  Canvas may leave out the items of
+        large modules; only those are listed separately.
+
+        Within a run scope, get_modules and get_module_items share the result.
         """
-        modules = []
-        mods = []
-        CanvasConnection._get_paginated(mods, course.get_modules(per_page=100))
+        return self._shared(course.id, 'courses/%d/modules' % course.id, {'include': ['items'], 'per_page': 100},
+                            lambda: self._fetch_modules(course))
+
+    def _fetch_modules(self, course: Course) -> List[Tuple[Module, List[ModuleItem]]]:
+        mods = list(self._paginate(course.get_modules(include=['items'], per_page=100)))
+        ret = []
         for module in mods:
+            items = getattr(module, 'items', None)
+            if items is None or len(items) < getattr(module, 'items_count', len(items)):
+                mod_items = list(self._paginate(module.get_module_items(per_page=100)))
+            else:
+                mod_items = [ModuleItem(self._requester, dict(item, course_id=course.id)) for item in items]
+            ret.append((module, mod_items))
+        return ret
+
+    def get_modules(self, course: Course, loaded: List[Tuple[Module, List[ModuleItem]]] = None) -> List[Dict]:
+        """
+        Returns a list of dictionaries containing the modules for a course.  loaded, the
+        course's modules as _load_modules returns them, saves listing them again.
+        """
+        modules = []
+        for module, _ in loaded if loaded is not None else self._load_modules(course):
             try:
                 modules.append({
                     'id': module.id,
@@ -131,21 +394,19 @@ class CanvasConnection(CourseApi):
                     'unlock_at': module.unlock_at
                 })
 
+        self._count_rows('modules', course.id, len(modules))
         return modules
     
-    def get_modules_df(self, course: Course) -> pd.DataFrame:
-        return pd.DataFrame(self.get_modules(course))
+    def get_modules_df(self, course: Course, loaded: List[Tuple[Module, List[ModuleItem]]] = None) -> pd.DataFrame:
+        return self.build_frame(self.get_modules(course, loaded), 'modules')
 
-    def get_module_items(self, course: Course) -> List[Dict]:
+    def get_module_items(self, course: Course, loaded: List[Tuple[Module, List[ModuleItem]]] = None) -> List[Dict]:
         """
-        Returns a list of dictionaries containing the module items for a course.
+        Returns a list of dictionaries containing the module items for a course (see
+        get_modules for loaded).
         """
         module_items = []
-        mods = []
-        CanvasConnection._get_paginated(mods, course.get_modules(per_page=100))
-        for module in mods:
-            mod_items = []
-            CanvasConnection._get_paginated(mod_items, module.get_module_items(per_page=100))
+        for module, mod_items in loaded if loaded is not None else self._load_modules(course):
             for item in mod_items:
                 try:
                     details = {
@@ -177,49 +438,167 @@ class CanvasConnection(CourseApi):
                 except:
                     pass
                 module_items.append(details)
+        self._count_rows('module_items', course.id, len(module_items))
         return module_items
 
-    def get_module_items_df(self, course: Course) -> pd.DataFrame:
-        return pd.DataFrame(self.get_module_items(course))
+    def get_module_items_df(self, course: Course,
+                            loaded: List[Tuple[Module, List[ModuleItem]]] = None) -> pd.DataFrame:
+        return self.build_frame(self.get_module_items(course, loaded), 'module_items')
 
-    def get_matching_module_url(self, module_items: List[Module], index: str, typ: str) -> str:
-        matches = module_items[module_items['title'].apply(lambda x: x.startswith(index))]
-        if len(matches):
-            matches = matches[matches['type'] == typ]
+    def get_modules_and_items_df(self, course: Course) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        get_modules_df and get_module_items_df for a course, from one listing of its modules.
+        """
+        loaded = self._load_modules(course)
+        return self.get_modules_df(course, loaded), self.get_module_items_df(course, loaded)
+
+    def get_module_item_index(self, course: Course) -> ModuleItemIndex:
+        """
+        The course's module items, indexed for get_matching_module_url and
+        get_matching_module_urls; build it once and look up as many titles as needed.
+        """
+        return ModuleItemIndex(self.get_module_items_df(course))
+
+    def get_matching_module_url(self, module_items: Union[pd.DataFrame, ModuleItemIndex], index: str,
+                                typ: str) -> str:
+        """
+        The URL of the first module item of type typ whose title starts with index (its
+        html_url for a Quiz, else its external_url), or None.  module_items is the frame from
+        get_module_items_df or, for repeated lookups, a ModuleItemIndex built from it.
+        """
+        if isinstance(module_items, ModuleItemIndex):
+            return module_items.lookup(index, typ)
+        if not len(module_items):
+            return None
+        matches = module_items[module_items['title'].astype(str).str.startswith(index) &
+                               (module_items['type'] == typ)]
         if len(matches):
             if typ == 'Quiz':
                 return matches['html_url'].array[0]
             else:
                 return matches['external_url'].array[0]
-            
+
+    def get_matching_module_urls(self, module_items: Union[pd.DataFrame, ModuleItemIndex], indexes: Iterable[str],
+                                 typ: str) -> List[str]:
+        """
+        get_matching_module_url for each of indexes, from a single index of module_items.
+        """
+        if not isinstance(module_items, ModuleItemIndex):
+            module_items = ModuleItemIndex(module_items)
+        return module_items.lookup_many(indexes, typ)
+
+    ASSIGNMENT_FIELDS = ['id', 'name', 'due_at', 'unlock_at', 'lock_at', 'points_possible',
+                         'allowed_attempts', 'muted']
+
+    STUDENT_FIELDS = ['id', 'name', 'sortable_name', 'login_id', 'email', 'sis_user_id', 'created_at']
+
+    SUBMISSION_FIELDS = ['id', 'assignment_id', 'user_id', 'grade', 'submitted_at', 'graded_at', 'grader_id',
+                         'score', 'excused', 'late_policy_status', 'points_deducted', 'late', 'missing',
+                         'entered_grade', 'entered_score', 'course_id']
+
+    def _get_json_pages(self, endpoint: str, **kwargs) -> Iterator[List[Dict]]:
+        """
+        Yields the pages of a Canvas listing as parsed JSON, in order.
+        """
+        for response in self._pages.pages('GET', endpoint, _kwargs=combine_kwargs(**kwargs)):
+            yield _json_loads(response.content)
+
+    def _records(self, endpoint: str, listing, **kwargs) -> Iterator:
+        """
+        Yields the items of a listing: raw JSON dicts from endpoint when raw_json is set, else
+        the canvasapi objects from calling listing (e.g. course.get_assignments).
+        """
+        if self.raw_json:
+            for page in self._get_json_pages(endpoint, **kwargs):
+                yield from page
+        else:
+            yield from self._paginate(listing(**kwargs))
+
+    def _field(self, record, name: str):
+        return record.get(name) if self.raw_json else getattr(record, name)
+
+    def _project(self, records: Iterable, fields: List[str], constants: Dict = None) -> Dict[str, List]:
+        """
+        Copies the given fields of each record into one list per column.  Columns in
+        constants are filled with that value rather than read from the records.
+        """
+        columns = {field: [] for field in fields}
+        constants = constants or {}
+        read = [(columns[field].append, field) for field in fields if field not in constants]
+        get = dict.get if self.raw_json else getattr
+        count = 0
+        for record in records:
+            for append, field in read:
+                append(get(record, field))
+            count += 1
+        for field, value in constants.items():
+            columns[field] = [value] * count
+        return columns
+
+    def _project_batches(self, records: Iterable, fields: List[str], constants: Dict = None,
+                         batch_size: int = None, entity: str = None,
+                         course_id: int = None) -> Iterator[Dict[str, List]]:
+        """
+        Like _project, but yields the columns of at most batch_size records at a time (all of
+        them at once if batch_size is None), reading the records only as each batch is built.
+        The rows are counted towards the metrics of entity for course_id, unless entity is None.
+        """
+        records = iter(records)
+        while True:
+            columns = self._project(islice(records, batch_size), fields, constants)
+            if not len(columns[fields[0]]):
+                return
+            if entity is not None:
+                self._count_rows(entity, course_id, len(columns[fields[0]]))
+            yield columns
+            if batch_size is None:
+                return
+
+    @staticmethod
+    def _to_rows(columns: Dict[str, List]) -> List[Dict]:
+        names = list(columns.keys())
+        return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+    @staticmethod
+    def _concat_columns(parts: List[Dict[str, List]], fields: List[str]) -> Dict[str, List]:
+        columns = {field: [] for field in fields}
+        for part in parts:
+            for field in fields:
+                columns[field].extend(part[field])
+        return columns
+
+    # Default number of rows in each batch yielded by the iter_* methods
+    BATCH_SIZE = 1000
+
+    # Internal reads of a listing (e.g. the assignment order for submissions) pass count=False,
+    # so that only the rows handed back to the caller count towards the metrics
+    def _iter_assignment_columns(self, course: Course, batch_size: int = None,
+                                 count: bool = False) -> Iterator[Dict[str, List]]:
+        # Assignment objects carry course_id, but it is not one of the columns reported
+        assignments = self._shared_records(course.id, 'courses/%d/assignments' % course.id, course.get_assignments,
+                                           per_page=100)
+        return self._project_batches(assignments, CanvasConnection.ASSIGNMENT_FIELDS, batch_size=batch_size,
+                                     entity='assignments' if count else None, course_id=course.id)
+
+    def _get_assignment_columns(self, course: Course, count: bool = False) -> Dict[str, List]:
+        return CanvasConnection._concat_columns(list(self._iter_assignment_columns(course, count=count)),
+                                                CanvasConnection.ASSIGNMENT_FIELDS)
+
+    def iter_assignments(self, course: Course, batch_size: int = BATCH_SIZE) -> Iterator[List[Dict]]:
+        """
+        Yields the rows of get_assignments in lists of at most batch_size, as the pages arrive.
+        """
+        for columns in self._iter_assignment_columns(course, batch_size, count=True):
+            yield CanvasConnection._to_rows(columns)
+
     def get_assignments(self, course: Course) -> List[Dict]:
         """
         Returns a list of dictionaries containing the assignments for a course.
         """
-        assignments = []
-        # ret = []
-        # CanvasConnection._get_paginated(assignments, 
-        assignments = course.get_assignments(per_page=100)
-        # for assignment in assignments:
-        #     print (vars(assignment).keys())
-        #     ret.append(vars(assignment))
-        #     del(ret[-1]['_requester'])
-        #     del(ret[-1]['description'])
-        #     del(ret[-1]['secure_params'])
-        ret = [{'id': assignment.id,
-                'name': assignment.name,
-                #'description': assignment.description,
-                'due_at': assignment.due_at,
-                'unlock_at': assignment.unlock_at,
-                'lock_at': assignment.lock_at,
-                'points_possible': assignment.points_possible,
-                # 'grading_type': assignment.grading_type,
-                # 'graded': assignment.graded,
-                'allowed_attempts': assignment.allowed_attempts,
-                'muted': assignment.muted,
-                #'quiz_id': assignment.quiz_id,
-            } for assignment in assignments]
-        return ret
+        return CanvasConnection._to_rows(self._get_assignment_columns(course, count=True))
+
+    def get_assignments_df(self, course: Course) -> pd.DataFrame:
+        return self.build_frame(self._get_assignment_columns(course, count=True), 'assignments')
             
     def get_student_summaries_df(self, course: Course) -> pd.DataFrame:
         """
@@ -229,8 +608,8 @@ class CanvasConnection(CourseApi):
             the_list = []
 #            summaries = []
             # CanvasConnection._get_paginated(the_list, 
-            the_list = course.get_course_level_student_summary_data(per_page=100)
-            if isinstance(the_list[0], dict):                
+            the_list = list(self._paginate(course.get_course_level_student_summary_data(per_page=100)))
+            if the_list and isinstance(the_list[0], dict):
                 summaries = [{'id': item['id'],
                         'page_views': item['page_views'],
                         'max_page_views': item['max_page_views'],
@@ -252,85 +631,267 @@ class CanvasConnection(CourseApi):
             #     print(vars(item).keys())
             #     summaries.append(vars(item))
             #     del(summaries[-1]['_requester'])
-            ret = pd.DataFrame(summaries)
+            ret = self.build_frame(summaries, 'summaries')
+            self._count_rows('summaries', course.id, len(summaries))
             # if 'tardiness_breakdown' in ret.columns:
             #     return ret.join(pd.json_normalize(ret['tardiness_breakdown'])).drop(['tardiness_breakdown'], axis=1)
             # else:
             return ret
-        except Forbidden:
+        except Forbidden as error:
+            self._skip(error, 'Unauthorized to access student summaries for course %s', course)
             return pd.DataFrame()
-        except ResourceDoesNotExist:
+        except ResourceDoesNotExist as error:
+            self._skip(error, 'No student summaries found for course %s', course)
             return pd.DataFrame()
 
             
 
-    def get_students(self, course) -> List[Dict]:
-        students = []
-        ret= []
+    def _iter_student_columns(self, course, batch_size: int = None, count: bool = False) -> Iterator[Dict[str, List]]:
         try:
-            # CanvasConnection._get_paginated(students, 
-            students = course.get_users(enrollment_type=['student'], per_page=100)
-            ret = [{'id': student.id,
-                    'name': student.name,
-                    'sortable_name': student.sortable_name,
-                    'login_id': student.login_id,
-                    'email': student.email,
-                    'sis_user_id': student.sis_user_id,
-                    'created_at': student.created_at,
-#                    'pronouns': student.pronouns,
-                    } for student in students]
-            return ret
-        except ResourceDoesNotExist:
-            logging.warning('No students found for course %s', course)
-            pass
-        except Forbidden:
-            logging.warning('Unauthorized to access students for course %s', course)
-            pass
-    
-        return ret
+            students = self._records('courses/%d/search_users' % course.id, course.get_users,
+                                     enrollment_type=['student'], per_page=100)
+            yield from self._project_batches(students, CanvasConnection.STUDENT_FIELDS, batch_size=batch_size,
+                                             entity='students' if count else None, course_id=course.id)
+        except ResourceDoesNotExist as error:
+            self._skip(error, 'No students found for course %s', course)
+        except Forbidden as error:
+            self._skip(error, 'Unauthorized to access students for course %s', course)
+
+    def _get_student_columns(self, course, count: bool = False) -> Dict[str, List]:
+        return CanvasConnection._concat_columns(list(self._iter_student_columns(course, count=count)),
+                                                CanvasConnection.STUDENT_FIELDS)
+
+    def get_students(self, course) -> List[Dict]:
+        return CanvasConnection._to_rows(self._get_student_columns(course, count=True))
+
+    def iter_students(self, course, batch_size: int = BATCH_SIZE) -> Iterator[List[Dict]]:
+        """
+        Yields the rows of get_students in lists of at most batch_size, as the pages arrive.
+        """
+        for columns in self._iter_student_columns(course, batch_size, count=True):
+            yield CanvasConnection._to_rows(columns)
+
+    def get_students_df(self, course) -> pd.DataFrame:
+        return self.build_frame(self._get_student_columns(course, count=True), 'students')
     
-    def get_assignment_submissions(self, course: Course) -> List[Dict]:
+    # Explicit assignment_ids[] lists are sent in chunks to keep the query string within server limits
+    BULK_ASSIGNMENT_CHUNK = 50
+
+    def _get_submission_columns(self, course: Course, bulk: bool = True,
+                                assignment_order: List[int] = None) -> Dict[str, List]:
+        if bulk:
+            try:
+                return self._get_submission_columns_bulk(course, assignment_order=assignment_order)
+            except (Forbidden, ResourceDoesNotExist):
+                logging.warning('Bulk submissions unavailable for course %s, fetching per assignment', course)
+
+        return self._get_submission_columns_by_assignment(course)
+
+    def get_assignment_submissions(self, course: Course, bulk: bool = True,
+                                   assignment_order: List[int] = None) -> List[Dict]:
         """
         Returns a list of dictionaries containing the assignment submissions for a course.
+
+        By default these come from the course-level multi-student submissions endpoint; with
+        bulk=False, or if that endpoint is refused, they are fetched one assignment at a time.
+        assignment_order is as for get_assignment_submissions_bulk.
         """
-        ret = []
-        assignments=[]
-        # CanvasConnection._get_paginated(assignments, 
-        assignments = course.get_assignments(per_page=100)
+        return CanvasConnection._to_rows(self._get_submission_columns(course, bulk, assignment_order))
+
+    def iter_assignment_submissions(self, course: Course, batch_size: int = BATCH_SIZE,
+                                    bulk: bool = True) -> Iterator[List[Dict]]:
+        """
+        Yields the rows of get_assignment_submissions in lists of at most batch_size, as the
+        pages arrive.  From the bulk endpoint they come in Canvas' order (grouped by student)
+        rather than by assignment, since putting them in assignment order means holding
+        all of them.
+        """
+        batches = None
+        if bulk:
+            batches = self._iter_submission_columns_bulk(course, batch_size=batch_size)
+            try:
+                # Canvas refuses the listing on its first page, before anything has been yielded
+                first = next(batches, None)
+            except (Forbidden, ResourceDoesNotExist):
+                logging.warning('Bulk submissions unavailable for course %s, fetching per assignment', course)
+                batches = None
+        if batches is None:
+            batches = self._iter_submission_columns_by_assignment(course, batch_size)
+        elif first is not None:
+            yield CanvasConnection._to_rows(first)
+        for columns in batches:
+            yield CanvasConnection._to_rows(columns)
+
+    def _assignment_positions(self, course: Course, assignment_ids: List[int] = None,
+                              assignment_order: List[int] = None) -> Dict[int, int]:
+        # The assignment listing decides which assignments are reported, and in what order
+        if assignment_order is None:
+            assignment_order = self._get_assignment_columns(course)['id']
+        wanted = set(assignment_ids) if assignment_ids is not None else None
+        order = {}
+        for assignment_id in assignment_order:
+            if wanted is None or assignment_id in wanted:
+                order[assignment_id] = len(order)
+        return order
+
+    def _iter_submission_columns_bulk(self, course: Course, assignment_ids: List[int] = None,
+                                      student_ids: List[int] = None, order: Dict[int, int] = None,
+                                      batch_size: int = None, **filters) -> Iterator[Dict[str, List]]:
+        if order is None:
+            order = self._assignment_positions(course, assignment_ids)
+        if not order:
+            return
+
+        if assignment_ids is None:
+            chunks = [None]
+        else:
+            ids = list(order.keys())
+            chunks = [ids[i:i + self.BULK_ASSIGNMENT_CHUNK] for i in range(0, len(ids), self.BULK_ASSIGNMENT_CHUNK)]
+
+        for chunk in chunks:
+            kwargs = dict(filters)
+            kwargs['student_ids'] = student_ids if student_ids is not None else ['all']
+            if chunk:
+                kwargs['assignment_ids'] = chunk
+            submissions = self._records('courses/%d/students/submissions' % course.id, course.get_multiple_submissions,
+                                        per_page=100, **kwargs)
+            yield from self._project_batches((sub for sub in submissions if self._field(sub, 'assignment_id') in order),
+                                             CanvasConnection.SUBMISSION_FIELDS, {'course_id': course.id}, batch_size,
+                                             'submissions', course.id)
+
+    def _get_submission_columns_bulk(self, course: Course, assignment_ids: List[int] = None,
+                                     student_ids: List[int] = None, assignment_order: List[int] = None,
+                                     **filters) -> Dict[str, List]:
+        order = self._assignment_positions(course, assignment_ids, assignment_order)
+        if not order:
+            return {}
+        parts = list(self._iter_submission_columns_bulk(course, assignment_ids, student_ids, order, **filters))
+        columns = CanvasConnection._order_by_assignment(
+            CanvasConnection._concat_columns(parts, CanvasConnection.SUBMISSION_FIELDS), order)
+        logging.info('%d submissions after adding %d assignments', len(columns['id']), len(order))
+        return columns
+
+    @staticmethod
+    def _order_by_assignment(columns: Dict[str, List], order: Dict[int, int]) -> Dict[str, List]:
+        # Canvas groups these by student; restore the per-assignment order (sort is stable within an assignment)
+        positions = [order[assignment_id] for assignment_id in columns['assignment_id']]
+        permutation = sorted(range(len(positions)), key=positions.__getitem__)
+        return {field: [values[i] for i in permutation] for field, values in columns.items()}
+
+    def get_assignment_submissions_bulk(self, course: Course, assignment_ids: List[int] = None,
+                                        student_ids: List[int] = None, assignment_order: List[int] = None,
+                                        **filters) -> List[Dict]:
+        """
+        Returns the same rows as get_assignment_submissions_by_assignment, fetched from
+        GET /courses/:id/students/submissions?student_ids[]=all instead of one listing per assignment.
+        If assignment_ids is given, only those assignments are requested (in chunks); student_ids
+        likewise restricts the students, and any other filters (e.g. graded_since, submitted_since)
+        are passed through to Canvas.  assignment_order, the course's assignment ids in listing
+        order, saves re-listing the assignments when the caller already has them.
+        """
+        return CanvasConnection._to_rows(self._get_submission_columns_bulk(
+            course, assignment_ids, student_ids, assignment_order, **filters))
+
+    def _iter_submission_columns_by_assignment(self, course: Course,
+                                               batch_size: int = None) -> Iterator[Dict[str, List]]:
+        count = 0
         try:
+            assignments = self._shared_records(course.id, 'courses/%d/assignments' % course.id,
+                                               course.get_assignments, per_page=100)
             for assignment in assignments:
-                submissions = []
-                # CanvasConnection._get_paginated(submissions, assignment.get_submissions(per_page=100))
-                submissions = assignment.get_submissions(per_page=100)
-            #     for submission in submissions:
-            #         ret.append(vars(submission))
-            #         print(vars(submission).keys())
-            #         ret[-1]['assignment_id'] = assignment.id
-            #         del(ret[-1]['_requester'])
-                ret.extend([{'id': sub.id,
-                        'assignment_id': sub.assignment_id,
-                        'user_id': sub.user_id,
-                        'grade': sub.grade,
-                        'submitted_at': sub.submitted_at,
-                        'graded_at': sub.graded_at,
-                        'grader_id': sub.grader_id,
-                        'score': sub.score,
-                        'excused': sub.excused,
-                        'late_policy_status': sub.late_policy_status,
-                        'points_deducted': sub.points_deducted,
-                        'late': sub.late,
-                        'missing': sub.missing,
-                        'entered_grade': sub.entered_grade,
-                        'entered_score': sub.entered_score,
-                        'course_id': sub.course_id,
-                        } for sub in submissions])
-                print('%d submissions after adding assignment %d'%(len(ret),assignment.id))
-            # print('%d assignment submissions'%len(assignments))
-        except ResourceDoesNotExist:
-            pass
-        except Forbidden:
-            pass
-        return ret
+                assignment_id = self._field(assignment, 'id')
+                listing = None if self.raw_json else assignment.get_submissions
+                submissions = self._records('courses/%d/assignments/%d/submissions' % (course.id, assignment_id),
+                                            listing, per_page=100)
+                for columns in self._project_batches(submissions, CanvasConnection.SUBMISSION_FIELDS,
+                                                     {'course_id': course.id}, batch_size, 'submissions', course.id):
+                    count += len(columns['id'])
+                    yield columns
+                logging.info('%d submissions after adding assignment %d', count, assignment_id)
+        except ResourceDoesNotExist as error:
+            self._skip(error, 'No submissions found for course %s', course)
+        except Forbidden as error:
+            self._skip(error, 'Unauthorized to access submissions for course %s', course)
+
+    def _get_submission_columns_by_assignment(self, course: Course) -> Dict[str, List]:
+        return CanvasConnection._concat_columns(list(self._iter_submission_columns_by_assignment(course)),
+                                                CanvasConnection.SUBMISSION_FIELDS)
+
+    def get_assignment_submissions_by_assignment(self, course: Course) -> List[Dict]:
+        """
+        Returns a list of dictionaries containing the assignment submissions for a course,
+        making one paginated request per assignment.
+        """
+        return CanvasConnection._to_rows(self._get_submission_columns_by_assignment(course))
     
-    def get_assignment_submissions_df(self, course: Course) -> pd.DataFrame:
-        return pd.DataFrame(self.get_assignment_submissions(course))
\ No newline at end of file
+    def get_assignment_submissions_df(self, course: Course, bulk: bool = True) -> pd.DataFrame:
+        return self.build_frame(self._get_submission_columns(course, bulk), 'submissions')
+
+    # The record field filled from each column of the listings above
+    COURSE_RECORD_FIELDS = {'course_uuid': 'id', 'name': 'name', 'starts': 'start_at', 'ends': 'end_at'}
+
+    ASSIGNMENT_RECORD_FIELDS = {'assignment_uuid': 'id', 'name': 'name', 'due': 'due_at', 'late': 'lock_at',
+                                'points': 'points_possible'}
+
+    PERSON_RECORD_FIELDS = {'data_id': 'id', 'student_id': 'sis_user_id', 'name': 'name', 'user_id': 'login_id'}
+
+    SUBMISSION_RECORD_FIELDS = {'submission_uuid': 'id', 'assignment_uuid': 'assignment_id', 'data_id': 'user_id',
+                                'score': 'score', 'grade': 'grade', 'submitted': 'submitted_at',
+                                'graded': 'graded_at', 'late': 'late', 'missing': 'missing', 'excused': 'excused'}
+
+    MODULE_RECORD_FIELDS = {'module_uuid': 'id', 'name': 'name', 'published': 'published', 'unlock': 'unlock_at'}
+
+    @staticmethod
+    def _record_batch(record_type, columns: Dict[str, List], fields: Dict[str, str]) -> RecordBatch:
+        # The batch shares the column lists rather than copying them
+        return RecordBatch(record_type, {field: columns.get(column, []) for field, column in fields.items()})
+
+    @staticmethod
+    def _row_columns(rows: List[Dict], fields: Dict[str, str]) -> Dict[str, List]:
+        return {column: [row.get(column) for row in rows] for column in fields.values()}
+
+    @staticmethod
+    def _person_batch(columns: Dict[str, List]) -> RecordBatch:
+        # Student columns as Person records; Canvas gives a student at most one email
+        batch = CanvasConnection._record_batch(course_info.Person, columns, CanvasConnection.PERSON_RECORD_FIELDS)
+        batch.columns['emails'] = [[email] if email is not None else [] for email in columns['email']]
+        batch.columns['role'] = ['student'] * len(batch)
+        return batch
+
+    def get_course_records(self) -> RecordBatch:
+        """
+        get_course_list as CourseDetails records.
+        """
+        fields = CanvasConnection.COURSE_RECORD_FIELDS
+        return CanvasConnection._record_batch(course_info.CourseDetails,
+                                              CanvasConnection._row_columns(self.get_course_list(), fields), fields)
+
+    def get_assignment_records(self, course: Course) -> RecordBatch:
+        """
+        get_assignments as Assignment records, with lock_at as the late deadline and no
+        ec_points or weight, which Canvas assignments do not have.
+        """
+        return CanvasConnection._record_batch(course_info.Assignment, self._get_assignment_columns(course, True),
+                                              CanvasConnection.ASSIGNMENT_RECORD_FIELDS)
+
+    def get_student_records(self, course: Course) -> RecordBatch:
+        """
+        get_students as Person records: data_id is the Canvas user id, student_id the SIS id
+        and user_id the login.
+        """
+        return CanvasConnection._person_batch(self._get_student_columns(course, True))
+
+    def get_submission_records(self, course: Course, bulk: bool = True) -> RecordBatch:
+        """
+        get_assignment_submissions as Submission records.
+        """
+        return CanvasConnection._record_batch(course_info.Submission, self._get_submission_columns(course, bulk),
+                                              CanvasConnection.SUBMISSION_RECORD_FIELDS)
+
+    def get_module_records(self, course: Course) -> RecordBatch:
+        """
+        get_modules as Module records.
+        """
+        fields = CanvasConnection.MODULE_RECORD_FIELDS
+        return CanvasConnection._record_batch(course_info.Module,
+                                              CanvasConnection._row_columns(self.get_modules(course), fields), fields)
@@ -0,0 +1,81 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Tuple
+import threading
+
+
+def _freeze(value) -> Any:
+    # Parameters as a hashable key: lists become tuples, dictionaries sorted tuples of pairs
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class RunScope(object):
+    """
+    The listings a connection has loaded during one run (see CanvasConnection.run_scope),
+    keyed by course, endpoint and parameters, so that each is requested from Canvas once
+    however many options need it.  A caller asking for a listing that another thread is
+    still loading waits for that load rather than starting its own.  A load that fails is
+    not kept: its waiters get the error, and the next caller loads again.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'coalesced': 0, 'misses': 0}
+
+    def get(self, course_id: int, endpoint: str, params: Dict, load: Callable[[], Any]) -> Any:
+        """
+        The result of load() for this course, endpoint and params, calling it only if no
+        caller in the run has.
+        """
+        key = (course_id, endpoint, _freeze(params))
+        with self._lock:
+            future = self._entries.get(key)
+            if future is None:
+                future = self._entries[key] = Future()
+                self.stats['misses'] += 1
+            else:
+                self.stats['hits' if future.done() else 'coalesced'] += 1
+                load = None
+
+        if load is not None:
+            try:
+                future.set_result(load())
+            except BaseException as error:
+                with self._lock:
+                    if self._entries.get(key) is future:
+                        del self._entries[key]
+                future.set_exception(error)
+                raise
+        return future.result()
+
+    def release(self, course_id: int) -> None:
+        """
+        Forgets the listings of a course that the run has finished with.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == course_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
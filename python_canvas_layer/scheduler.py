@@ -0,0 +1,212 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from typing import Dict, Optional
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from python_canvas_layer.cache import ResponseCache
+from python_canvas_layer.metrics import MetricsHook, RequestEvent
+
+
+class RateLimitScheduler(object):
+    """
+    Controls how many requests may be in flight against Canvas at once.
+
+    Canvas throttles each token with a leaky bucket and reports the bucket level in
+    X-Rate-Limit-Remaining and the cost of each request in X-Request-Cost.  The scheduler
+    grows its concurrency limit additively while the bucket has headroom, halves it when
+    the bucket runs low or a request is throttled, and computes jittered backoff delays
+    for retrying throttled requests.  Responses arriving within decrease_interval seconds
+    of a halving report the same shortage, so they do not halve the limit again.
+    """
+
+    def __init__(self, initial_concurrency: int = 4, min_concurrency: int = 1, max_concurrency: int = 32,
+                 low_water: float = 150.0, max_retries: int = 6, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 decrease_interval: float = 0.5):
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.low_water = low_water
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.decrease_interval = decrease_interval
+
+        self.limit = float(max(min_concurrency, min(initial_concurrency, max_concurrency)))
+        self.in_flight = 0
+        self.remaining = None
+        self.request_cost = None
+        self.throttled = 0
+        self.throttle_wait = 0.0
+
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def budget(self) -> Dict:
+        """
+        Snapshot of the scheduler's view of the rate limit and its current concurrency.
+        """
+        with self._cond:
+            return {'remaining': self.remaining,
+                    'request_cost': self.request_cost,
+                    'concurrency_limit': int(self.limit),
+                    'in_flight': self.in_flight,
+                    'throttled': self.throttled,
+                    'throttle_wait': self.throttle_wait}
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a request slot if one is free, without waiting (for callers that wait some other way).
+        """
+        with self._cond:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, headers=None, throttled: bool = False) -> None:
+        """
+        Give back a request slot, adjusting the concurrency limit from the response headers.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if headers is not None:
+                self._observe(headers, throttled)
+            self._cond.notify_all()
+
+    def _observe(self, headers, throttled: bool) -> None:
+        try:
+            self.remaining = float(headers['X-Rate-Limit-Remaining'])
+        except (KeyError, TypeError, ValueError):
+            pass
+        try:
+            self.request_cost = float(headers['X-Request-Cost'])
+        except (KeyError, TypeError, ValueError):
+            pass
+
+        if throttled:
+            self.throttled += 1
+            self._decrease()
+        elif self.remaining is not None and self.remaining - (self.request_cost or 1.0) * self.in_flight < self.low_water:
+            # Not enough left in the bucket to cover what is already in flight
+            self._decrease()
+        elif self.limit < self.max_concurrency:
+            # Additive increase: about one more slot per limit's worth of successful responses
+            self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+
+    def _decrease(self) -> None:
+        # Responses that were already in flight report the same shortage; only react once per burst
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_interval:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_concurrency), self.limit / 2)
+        logging.debug('Canvas rate limit: concurrency reduced to %d (remaining %s)', int(self.limit), self.remaining)
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Full-jitter exponential backoff for the given retry attempt (0-based).
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        with self._cond:
+            self.throttle_wait += delay
+        return delay
+
+    @staticmethod
+    def is_throttled(response: requests.Response) -> bool:
+        if response.status_code == 429:
+            return True
+        return response.status_code == 403 and b'Rate Limit Exceeded' in (response.content or b'')
+
+
+class ScheduledSession(requests.Session):
+    """
+    A requests.Session whose requests are admitted by a RateLimitScheduler, with throttled
+    requests retried after a jittered backoff.  The last throttled response is returned if
+    the retries run out, so the caller sees Canvas' own error.
+
+    If a ResponseCache is given, GETs are answered from it while fresh (without using any
+    rate-limit budget) and revalidated with If-None-Match once stale.
+
+    If a MetricsHook is given, it is told of every attempt, cache hit and backoff.
+    """
+
+    def __init__(self, scheduler: Optional[RateLimitScheduler] = None, cache: Optional[ResponseCache] = None,
+                 metrics: Optional[MetricsHook] = None):
+        super().__init__()
+        self.scheduler = scheduler or RateLimitScheduler()
+        self.cache = cache
+        self.metrics = metrics
+
+    def request(self, method, url, *args, **kwargs):
+        if self.cache is None or method != 'GET':
+            return self._scheduled_request(method, url, *args, **kwargs)
+
+        key = ResponseCache.key(method, url, kwargs.get('params'), kwargs.get('headers'))
+        entry, fresh = self.cache.lookup(key, url)
+        if fresh:
+            if self.metrics is not None:
+                self.metrics.on_request(RequestEvent(method, url, 200, 0.0, len(entry.body), cached=True))
+            return entry.to_response()
+
+        if entry is not None and entry.etag:
+            kwargs['headers'] = dict(kwargs.get('headers') or {})
+            kwargs['headers']['If-None-Match'] = entry.etag
+        response = self._scheduled_request(method, url, *args, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.cache.refresh(key)
+            return entry.to_response()
+        self.cache.store(key, response)
+        return response
+
+    def _scheduled_request(self, method, url, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.scheduler.acquire()
+            start = time.perf_counter()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except BaseException:
+                self.scheduler.release()
+                raise
+
+            throttled = RateLimitScheduler.is_throttled(response)
+            self.scheduler.release(response.headers, throttled)
+            if self.metrics is not None:
+                self.metrics.on_request(RequestEvent(method, response.url or url, response.status_code,
+                                                     time.perf_counter() - start, len(response.content or b''),
+                                                     attempt, throttled))
+            if not throttled or attempt >= self.scheduler.max_retries:
+                return response
+
+            delay = self.scheduler.backoff(attempt)
+            logging.info('Canvas rate limit exceeded for %s, retrying in %.2fs', url, delay)
+            if self.metrics is not None:
+                self.metrics.on_throttle(url, delay)
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,197 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+Declared column types for the frames CanvasConnection produces.
+
+Each schema maps a column to one of:
+    'id'        nullable 64-bit integer (Canvas ids, which may be missing)
+    'count'     nullable 32-bit integer
+    'float'     float64, with NaN for missing
+    'datetime'  timezone-aware UTC timestamp, parsed from Canvas' ISO 8601 strings
+    'boolean'   nullable boolean
+    'category'  pandas categorical, for short strings that repeat down the column
+Columns without a declared type are left as pandas infers them.
+"""
+
+from typing import Dict, List, Union
+import numpy as np
+import pandas as pd
+
+COURSES = {
+    'id': 'id',
+    'start_at': 'datetime',
+    'end_at': 'datetime',
+    'workflow_state': 'category',
+    'is_public': 'boolean',
+}
+
+STUDENTS = {
+    'id': 'id',
+    'created_at': 'datetime',
+    'course_id': 'id',
+}
+
+ASSIGNMENTS = {
+    'id': 'id',
+    'due_at': 'datetime',
+    'unlock_at': 'datetime',
+    'lock_at': 'datetime',
+    'points_possible': 'float',
+    'allowed_attempts': 'count',
+    'muted': 'boolean',
+    'course_id': 'id',
+}
+
+SUBMISSIONS = {
+    'id': 'id',
+    'assignment_id': 'id',
+    'user_id': 'id',
+    'grade': 'category',
+    'submitted_at': 'datetime',
+    'graded_at': 'datetime',
+    'grader_id': 'id',
+    'score': 'float',
+    'excused': 'boolean',
+    'late_policy_status': 'category',
+    'points_deducted': 'float',
+    'late': 'boolean',
+    'missing': 'boolean',
+    'entered_grade': 'category',
+    'entered_score': 'float',
+    'course_id': 'id',
+}
+
+SUMMARIES = {
+    'id': 'id',
+    'page_views': 'count',
+    'max_page_views': 'count',
+    'participations': 'count',
+    'max_participations': 'count',
+    'course_id': 'id',
+}
+
+MODULES = {
+    'id': 'id',
+    'published': 'boolean',
+    'unlock_at': 'datetime',
+    'course_id': 'id',
+}
+
+MODULE_ITEMS = {
+    'module_id': 'id',
+    'module_name': 'category',
+    'id': 'id',
+    'type': 'category',
+    'published': 'boolean',
+}
+
+QUIZZES = {
+    'id': 'id',
+    'published': 'boolean',
+    'unlock_at': 'datetime',
+    'due_at': 'datetime',
+    'lock_at': 'datetime',
+    'course_id': 'id',
+}
+
+SCHEMAS = {
+    'courses': COURSES,
+    'students': STUDENTS,
+    'assignments': ASSIGNMENTS,
+    'submissions': SUBMISSIONS,
+    'summaries': SUMMARIES,
+    'modules': MODULES,
+    'module_items': MODULE_ITEMS,
+    'quizzes': QUIZZES,
+}
+
+
+def _to_datetime(values):
+    try:
+        return pd.to_datetime(values, utc=True, format='ISO8601')
+    except (TypeError, ValueError):
+        # pandas < 2.0 has no 'ISO8601' format, but infers it quickly anyway
+        return pd.to_datetime(values, utc=True)
+
+
+def convert_column(values, kind: str):
+    """
+    Converts one column (a list, or anything pandas accepts) to the given schema type.
+    """
+    if kind == 'id':
+        return pd.array(values, dtype='Int64')
+    elif kind == 'count':
+        return pd.array(values, dtype='Int32')
+    elif kind == 'float':
+        return np.asarray(values, dtype=np.float64)
+    elif kind == 'datetime':
+        return _to_datetime(values)
+    elif kind == 'boolean':
+        return pd.array(values, dtype='boolean')
+    elif kind == 'category':
+        return pd.Categorical(values)
+    raise ValueError('Unknown column type %s' % kind)
+
+
+def columns_from_rows(rows: List[Dict]) -> Dict[str, List]:
+    """
+    Transposes a list of row dictionaries into one list per column (None where a row lacks a key).
+    """
+    names = {}
+    for row in rows:
+        for name in row:
+            names.setdefault(name, None)
+    return {name: [row.get(name) for row in rows] for name in names}
+
+
+def build_frame(data: Union[List[Dict], Dict[str, List]], schema: Dict[str, str] = None) -> pd.DataFrame:
+    """
+    Builds a frame column by column from row dictionaries or column lists, converting the
+    columns named in schema.  No rows gives an empty frame without columns, as pd.DataFrame([]) does.
+    """
+    if schema is None and not isinstance(data, dict):
+        return pd.DataFrame(data)
+    columns = data if isinstance(data, dict) else columns_from_rows(data)
+    if not columns or not len(next(iter(columns.values()))):
+        return pd.DataFrame()
+    if schema is None:
+        return pd.DataFrame(columns)
+    return pd.DataFrame({name: convert_column(values, schema[name]) if name in schema else values
+                         for name, values in columns.items()})
+
+
+def apply_schema(frame: pd.DataFrame, schema: Dict[str, str]) -> pd.DataFrame:
+    """
+    Converts the declared columns of an existing frame in place, e.g. after adding a course_id.
+    """
+    for name, kind in schema.items():
+        if name in frame.columns:
+            frame[name] = convert_column(frame[name].to_numpy(dtype=object), kind)
+    return frame
+
+
+def compare_memory(untyped: pd.DataFrame, typed: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-column deep memory usage, in bytes, of the same frame without and with its schema.
+    """
+    before = untyped.memory_usage(deep=True, index=False)
+    after = typed.memory_usage(deep=True, index=False)
+    ret = pd.DataFrame({'untyped': before, 'typed': after, 'untyped_dtype': untyped.dtypes.astype(str),
+                        'typed_dtype': typed.dtypes.astype(str)})
+    ret.loc['total', ['untyped', 'typed']] = [before.sum(), after.sum()]
+    ret['ratio'] = ret['typed'] / ret['untyped']
+    return ret
@@ -0,0 +1,177 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from python_canvas_layer.canvas_status import CanvasStatus
+from python_canvas_layer.course_info import CourseWrapper
+from python_canvas_layer.metrics import EventRecorder
+from python_canvas_layer.sinks import FrameSink
+from canvasapi.course import Course
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import math
+import multiprocessing
+import pandas as pd
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+# Set in each worker process by _init_worker
+_status: Optional[CanvasStatus] = None
+_sink_factory: Optional[Callable[[], FrameSink]] = None
+
+
+def _init_worker(canvas_url: str, tokens, options: List[str], kwargs: Dict,
+                 sink_factory: Optional[Callable[[], FrameSink]], record_metrics: bool) -> None:
+    global _status, _sink_factory
+    # Each worker takes its own token, and so its own connection and rate-limit bucket.  Its
+    # metrics events are recorded, to be replayed into the parent's hook
+    if record_metrics:
+        kwargs = dict(kwargs, metrics=EventRecorder())
+    _status = CanvasStatus(canvas_url, tokens.get(), [], options, False, **kwargs)
+    _sink_factory = sink_factory
+
+
+def _run_shard(courses: List[Dict]) -> Tuple[Tuple[Any], List[Tuple], pd.DataFrame]:
+    """
+    Harvests one shard in a worker.  Returns its courses' students, assignments, submissions
+    and summaries frames, as CanvasStatus.get_course_info returns them, the metrics events
+    recorded meanwhile (if there is a hook) and the shard's failed units (see get_errors).
+    """
+    status = _status
+    status.sink = _sink_factory() if _sink_factory is not None else None
+    try:
+        frames = status._harvest([Course(status.canvas._requester, course) for course in courses])
+        events = status.canvas.metrics.drain() if status.canvas.metrics is not None else []
+        errors = status.get_errors()
+        errors = errors[errors['course_id'].isin([course['id'] for course in courses])]
+        return frames, events, errors
+    finally:
+        if status.sink is not None:
+            status.sink.close()
+            status.sink = None
+
+
+def _course_attributes(course: Course) -> Dict:
+    # A course's JSON, less its requester and the *_date values canvasapi derives from dates
+    attributes = vars(course)
+    return {name: value for name, value in attributes.items()
+            if name != '_requester' and not (name.endswith('_date') and name[:-5] in attributes)}
+
+
+class ShardedCanvasStatus(CourseWrapper):
+    """
+    Runs CanvasStatus over the courses in a pool of processes, so that building objects and
+    frames is not held to one interpreter (and its GIL), and, given several API tokens, not
+    to one token's rate limit either.
+
+    The courses are listed once, here, as CanvasStatus would list them, and split into
+    shards of shard_size courses (by default, about four per process).  Each worker
+    process has its own CanvasStatus, with the next of canvas_keys (cycling through them if
+    there are fewer tokens than processes), and takes the next shard whenever it finishes
+    one, so a worker whose courses turn out small simply harvests more of them.
+    get_course_info returns the same frames as CanvasStatus.get_course_info, in course order.
+
+    The remaining keyword arguments are given to each worker's CanvasStatus, so they must
+    be picklable; max_workers there is the threads within each process.  A sink cannot be
+    shared between processes: sink_factory (a picklable function, such as a
+    functools.partial of ParquetSink) makes one sink for the course list and one for each
+    shard, each closed when done.  Log lines of different shards interleave.
+
+    A metrics hook is not itself run in the workers: each worker records its events, and
+    they are replayed into the hook here as each shard finishes, so the hook sees every
+    request and row (though not as they happen), and its on_run_end is called once, at the
+    end.  A checkpoint or sync_store file is opened by every worker, each writing its own
+    courses' rows (the stores allow for that; see CheckpointStore); the units that failed
+    are returned by get_errors once get_course_info has finished.
+    """
+
+    def __init__(self, canvas_url, canvas_keys: Union[str, List[str]], filter_course_ids: List[str],
+                 options: List[str], active: bool, processes: int = 4, shard_size: int = None,
+                 account_id: int = None, term_id: int = None, sink_factory: Callable[[], FrameSink] = None,
+                 **kwargs):
+        self.canvas_url = canvas_url
+        self.canvas_keys = [canvas_keys] if isinstance(canvas_keys, str) else list(canvas_keys)
+        if not self.canvas_keys:
+            raise ValueError('At least one API token is needed')
+        if 'sink' in kwargs:
+            raise ValueError('Sinks are not shared between processes; give a sink_factory instead')
+        self.options = options
+        self.processes = processes
+        self.shard_size = shard_size
+        self.sink_factory = sink_factory
+        self.metrics = kwargs.pop('metrics', None)
+        self.kwargs = kwargs
+        self._errors = None
+        # Lists the courses, with the first token (and the metrics hook, as CanvasStatus would)
+        self.lister = CanvasStatus(canvas_url, self.canvas_keys[0], filter_course_ids, options, active,
+                                   account_id=account_id, term_id=term_id, typed=kwargs.get('typed', False),
+                                   metrics=self.metrics)
+
+    def _shards(self, courses: List[Course]) -> List[List[Dict]]:
+        size = self.shard_size or max(1, math.ceil(len(courses) / (4 * self.processes)))
+        attributes = [_course_attributes(course) for course in courses]
+        return [attributes[i:i + size] for i in range(0, len(attributes), size)]
+
+    def get_errors(self) -> pd.DataFrame:
+        """
+        The units of the last get_course_info that failed, as CanvasStatus.get_errors reports
+        them for its courses (empty without a checkpoint, since the first error then ends
+        the run).
+        """
+        if self._errors is None:
+            return self.lister.get_errors()
+        return self._errors
+
+    def get_course_info(self) -> Tuple[Any]:
+        courses = self.lister._get_courses()
+        canvas_courses = self.lister.canvas.get_course_list_df(courses)
+        if self.sink_factory is not None:
+            sink = self.sink_factory()
+            try:
+                sink.write('courses', None, canvas_courses)
+                sink.finish_course(None)
+            finally:
+                sink.close()
+
+        results = ([], [], [], [])
+        shards = self._shards(courses)
+        if not shards:
+            self._errors = self.lister.get_errors()
+            self.lister._end_run(self._errors)
+            return (canvas_courses,) + results
+        processes = min(self.processes, len(shards))
+        logging.info('Harvesting %d courses in %d shards on %d processes', len(courses), len(shards), processes)
+
+        context = multiprocessing.get_context()
+        tokens = context.Queue()
+        for i in range(processes):
+            tokens.put(self.canvas_keys[i % len(self.canvas_keys)])
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.canvas_url, tokens, self.options, self.kwargs,
+                                           self.sink_factory, self.metrics is not None)) as pool:
+            # Idle workers take the next shard; the results are merged in shard (and so course) order
+            futures = [pool.submit(_run_shard, shard) for shard in shards]
+            errors = []
+            for future in futures:
+                frames, events, shard_errors = future.result()
+                for merged, shard_frames in zip(results, frames):
+                    merged.extend(shard_frames)
+                if self.metrics is not None:
+                    EventRecorder.replay(events, self.metrics)
+                errors.append(shard_errors)
+
+        self._errors = pd.concat(errors, ignore_index=True).sort_values(['course_id', 'option'], ignore_index=True)
+        self.lister._end_run(self._errors)
+        return (canvas_courses,) + results
@@ -0,0 +1,90 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+from typing import Optional
+import os
+
+import pandas as pd
+
+
+class FrameSink(object):
+    """
+    Base class for destinations of the frames CanvasStatus harvests, written a batch at a
+    time instead of being collected in memory.  entity is one of 'courses', 'students',
+    'assignments', 'submissions' or 'summaries'; course_id is None for the course list.
+    CanvasStatus serializes its calls to write, so sinks need not be thread-safe.
+    """
+
+    def write(self, entity: str, course_id: Optional[int], frame: pd.DataFrame) -> None:
+        raise NotImplementedError()
+
+    def finish_course(self, course_id: Optional[int]) -> None:
+        """
+        Called once everything for a course has been written, so that a sink can complete
+        that course's output.
+        """
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CollectingSink(FrameSink):
+    """
+    Keeps every frame written, by entity; mainly useful for small runs and for testing.
+    """
+
+    def __init__(self):
+        self.frames = {}
+
+    def write(self, entity: str, course_id: Optional[int], frame: pd.DataFrame) -> None:
+        self.frames.setdefault(entity, []).append(frame)
+
+    def get_frame(self, entity: str) -> pd.DataFrame:
+        frames = self.frames.get(entity)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+class CsvSink(FrameSink):
+    """
+    Appends each entity's batches to <directory>/<entity>.csv, writing the header only
+    when the file is first created.  Columns are taken from the first batch of each entity.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._columns = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, entity: str) -> str:
+        return os.path.join(self.directory, entity + '.csv')
+
+    def write(self, entity: str, course_id: Optional[int], frame: pd.DataFrame) -> None:
+        if not len(frame):
+            return
+        path = self.path(entity)
+        header = not os.path.exists(path) or os.path.getsize(path) == 0
+        if header:
+            self._columns[entity] = list(frame.columns)
+        elif entity not in self._columns:
+            self._columns[entity] = list(pd.read_csv(path, nrows=0).columns)
+        frame.reindex(columns=self._columns[entity]).to_csv(path, mode='a', header=header, index=False)
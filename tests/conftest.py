@@ -0,0 +1,34 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+Fixtures shared by the tests: a small synthetic institution served by a local
+FakeCanvasServer, with short pages so that pagination is exercised.
+"""
+
+from python_canvas_layer.fake_canvas import FakeInstitution, FakeCanvasServer
+import pytest
+
+
+@pytest.fixture
+def institution() -> FakeInstitution:
+    return FakeInstitution(courses=4, students=15, assignments=6, modules=3, items_per_module=4)
+
+
+@pytest.fixture
+def server(institution: FakeInstitution):
+    with FakeCanvasServer(institution, max_per_page=10) as srv:
+        yield srv
@@ -0,0 +1,139 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+AsyncCanvasConnection against CanvasConnection on the same fake server: every coroutine
+gives the same frames, including the per-assignment fallback when the bulk endpoint is
+refused; HTTP errors map to canvasapi's exceptions; and listings are paged in a window.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.async_canvas import AsyncCanvasConnection
+from canvasapi.exceptions import BadRequest, CanvasException, Conflict, Forbidden, InvalidAccessToken, \
+    ResourceDoesNotExist, Unauthorized, UnprocessableEntity
+from python_canvas_layer.fake_canvas import FakeCanvasServer
+import asyncio
+import pandas.testing as pdt
+import pytest
+
+pytest.importorskip('aiohttp')
+
+COURSE_IDS = [100, 101]
+
+FRAME_METHODS = ['get_assignments_df', 'get_students_df', 'get_assignment_submissions_df', 'get_quizzes_df',
+                 'get_modules_df', 'get_module_items_df', 'get_student_summaries_df']
+
+RECORD_METHODS = ['get_assignment_records', 'get_student_records', 'get_submission_records', 'get_module_records']
+
+
+def _run(server, coroutine, **kwargs):
+    async def run():
+        async with AsyncCanvasConnection(server.url, 'token', **kwargs) as canvas:
+            return await coroutine(canvas)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('typed', [False, True])
+def test_frames_match_canvas_connection(server, typed):
+    canvas = CanvasConnection(server.url, 'token', typed=typed)
+    courses = canvas.get_courses_by_id(COURSE_IDS)
+
+    async def frames(async_canvas):
+        ret = {'courses': await async_canvas.get_course_list_df()}
+        for method in FRAME_METHODS:
+            ret[method] = await async_canvas.gather(method, COURSE_IDS)
+        ret['by_assignment'] = await async_canvas.gather('get_assignment_submissions_df', COURSE_IDS, bulk=False)
+        return ret
+
+    got = _run(server, frames, typed=typed)
+    pdt.assert_frame_equal(got['courses'], canvas.get_course_list_df())
+    for method in FRAME_METHODS:
+        for course, frame in zip(courses, got[method]):
+            pdt.assert_frame_equal(frame, getattr(canvas, method)(course), obj=method)
+    for course, frame in zip(courses, got['by_assignment']):
+        pdt.assert_frame_equal(frame, canvas.get_assignment_submissions_df(course, bulk=False))
+
+
+def test_records_match_canvas_connection(server):
+    canvas = CanvasConnection(server.url, 'token')
+    course = canvas.get_courses_by_id([COURSE_IDS[0]])[0]
+
+    async def records(async_canvas):
+        ret = {'get_course_records': await async_canvas.get_course_records()}
+        for method in RECORD_METHODS:
+            ret[method] = await getattr(async_canvas, method)(COURSE_IDS[0])
+        return ret
+
+    got = _run(server, records)
+    pdt.assert_frame_equal(got['get_course_records'].to_frame(), canvas.get_course_records().to_frame())
+    for method in RECORD_METHODS:
+        assert list(got[method]) == list(getattr(canvas, method)(course)), method
+
+
+def test_refused_bulk_endpoint_falls_back(server, monkeypatch):
+    canvas = CanvasConnection(server.url, 'token')
+    course = canvas.get_courses_by_id([COURSE_IDS[0]])[0]
+    expected = canvas.get_assignment_submissions_df(course, bulk=False)
+
+    get = AsyncCanvasConnection._get
+
+    async def refuse_bulk(self, url, params=None):
+        if url.endswith('/students/submissions'):
+            raise Forbidden('bulk submissions are disabled')
+        return await get(self, url, params)
+
+    monkeypatch.setattr(AsyncCanvasConnection, '_get', refuse_bulk)
+    server.reset_counts()
+    got = _run(server, lambda async_canvas: async_canvas.get_assignment_submissions_df(COURSE_IDS[0]))
+    pdt.assert_frame_equal(got, expected)
+    # Every assignment's own listing was read
+    assert server.requests['assignment_submissions'] >= len(server.institution.assignments[COURSE_IDS[0]])
+
+
+@pytest.mark.parametrize('status, headers, error', [
+    (400, {}, BadRequest), (401, {'WWW-Authenticate': 'Bearer'}, InvalidAccessToken), (401, {}, Unauthorized),
+    (403, {}, Forbidden), (404, {}, ResourceDoesNotExist), (409, {}, Conflict), (422, {}, UnprocessableEntity),
+    (500, {}, CanvasException)])
+def test_error_mapping(status, headers, error):
+    assert type(AsyncCanvasConnection._error(status, b'{"errors": []}', headers)) is error
+
+
+def test_missing_course(server):
+    async def get(async_canvas):
+        with pytest.raises(ResourceDoesNotExist):
+            await async_canvas.get_course(999)
+        return await async_canvas.get_courses_by_id([999, COURSE_IDS[0]])
+
+    assert [course['id'] for course in _run(server, get)] == [COURSE_IDS[0]]
+
+
+def test_pages_read_in_window(institution, monkeypatch):
+    in_flight = [0, 0]
+    get = AsyncCanvasConnection._get
+
+    async def counted(self, url, params=None):
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        try:
+            return await get(self, url, params)
+        finally:
+            in_flight[0] -= 1
+
+    monkeypatch.setattr(AsyncCanvasConnection, '_get', counted)
+    with FakeCanvasServer(institution, max_per_page=1, latency=0.01) as server:
+        students = _run(server, lambda async_canvas: async_canvas.get_students(COURSE_IDS[0]), page_window=3)
+    assert [row['id'] for row in students] == [user['id'] for user in institution.users[COURSE_IDS[0]]]
+    assert in_flight[1] == 3
@@ -0,0 +1,87 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+The response cache: fresh entries are served without a request, stale ones are
+revalidated with If-None-Match, and a change on the server is never hidden.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.cache import DiskResponseCache, MemoryResponseCache
+import pandas.testing as pdt
+import pytest
+
+COURSE_ID = 100
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def make_cache(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryResponseCache
+    return lambda **kwargs: DiskResponseCache(str(tmp_path / 'cache.db'), **kwargs)
+
+
+def test_fresh_entries_need_no_request(server, make_cache):
+    cache = make_cache(ttls=[], default_ttl=3600)
+    canvas = CanvasConnection(server.url, 'token', cache=cache)
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    first = canvas.get_assignments_df(course)
+
+    server.reset_counts()
+    pdt.assert_frame_equal(canvas.get_assignments_df(course), first)
+    assert server.request_count == 0
+    assert cache.stats['hits'] > 0
+
+
+def test_stale_entries_are_revalidated(server, make_cache):
+    cache = make_cache(ttls=[], default_ttl=0)
+    canvas = CanvasConnection(server.url, 'token', cache=cache)
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    first = canvas.get_assignment_submissions_df(course)
+
+    server.reset_counts()
+    pdt.assert_frame_equal(canvas.get_assignment_submissions_df(course), first)
+    # Every page is asked for again, and every one comes back 304 Not Modified
+    assert server.request_count > 0
+    assert server.not_modified == server.request_count
+    assert cache.stats['revalidated'] == server.not_modified
+
+
+def test_revalidation_sees_changes(server, tmp_path):
+    cache = DiskResponseCache(str(tmp_path / 'cache.db'), ttls=[], default_ttl=0)
+    canvas = CanvasConnection(server.url, 'token', cache=cache)
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    canvas.get_assignment_submissions_df(course)
+
+    submission = server.institution.submissions[COURSE_ID][0]
+    submission['score'] = 0.5
+    changed = canvas.get_assignment_submissions_df(course)
+    assert changed.loc[changed['id'] == submission['id'], 'score'].tolist() == [0.5]
+    pdt.assert_frame_equal(changed, CanvasConnection(server.url, 'token').get_assignment_submissions_df(course))
+
+
+def test_cache_is_shared_across_connections(server, tmp_path):
+    path = str(tmp_path / 'cache.db')
+    canvas = CanvasConnection(server.url, 'token', cache=DiskResponseCache(path))
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    first = canvas.get_students_df(course)
+
+    # A later run with the same file (and token) reads the students from it
+    server.reset_counts()
+    canvas = CanvasConnection(server.url, 'token', cache=DiskResponseCache(path))
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    pdt.assert_frame_equal(canvas.get_students_df(course), first)
+    assert server.requests['users'] == 0
@@ -0,0 +1,71 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+CanvasStatus.get_course_info: the courses frame lists the courses harvested, each
+option's list has one frame per course, and a concurrent run matches a sequential one
+while keeping only a bounded number of units queued.
+"""
+
+from python_canvas_layer.canvas_status import CanvasStatus
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import pandas.testing as pdt
+import pytest
+
+
+@pytest.mark.parametrize('filter_course_ids, active', [([101, 100], False), ([], True), ([], False)])
+def test_courses_frame_lists_harvested_courses(server, institution, filter_course_ids, active):
+    info = CanvasStatus(server.url, 'token', filter_course_ids, ['students'], active).get_course_info()
+    if filter_course_ids:
+        expected = filter_course_ids
+    else:
+        # The current courses, or without active every course visible to the token
+        expected = [course['id'] for course in institution.courses if course['enrollment_term_id'] == 1 or not active]
+    assert list(info[0]['id']) == expected
+    assert [frame['course_id'].iloc[0] for frame in info[1]] == expected
+
+
+def test_concurrent_matches_sequential(server):
+    expected = CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False).get_course_info()
+    got = CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False, max_workers=3).get_course_info()
+    pdt.assert_frame_equal(expected[0], got[0])
+    for expected_frames, got_frames in zip(expected[1:], got[1:]):
+        assert len(expected_frames) == len(got_frames)
+        for expected_frame, got_frame in zip(expected_frames, got_frames):
+            pdt.assert_frame_equal(expected_frame, got_frame)
+
+
+def test_bounded_map_window():
+    release = threading.Event()
+    started = []
+
+    def unit(n):
+        started.append(n)
+        if n == 0:
+            release.wait(5)
+        return n * n
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = CanvasStatus._bounded_map(pool, unit, range(20), 4)
+        first = threading.Thread(target=lambda: started.append(('first', next(results))))
+        first.start()
+        first.join(0.2)
+        # While the first unit is stuck, only the window's worth were submitted
+        assert sorted(n for n in started if isinstance(n, int)) == [0, 1, 2, 3]
+        release.set()
+        first.join(5)
+        assert list(results) == [n * n for n in range(1, 20)]
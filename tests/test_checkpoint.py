@@ -0,0 +1,74 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+Resuming CanvasStatus from a checkpoint: a failed unit is recorded and retried by the
+next run, which skips the finished ones and returns the same frames as an uninterrupted run.
+"""
+
+from python_canvas_layer.canvas_status import CanvasStatus
+from python_canvas_layer.checkpoint import CheckpointStore
+import pandas as pd
+import pandas.testing as pdt
+
+FAILING_COURSE = 102
+
+
+def _assert_same_info(expected, got) -> None:
+    pdt.assert_frame_equal(expected[0], got[0])
+    for expected_frames, got_frames in zip(expected[1:], got[1:]):
+        assert len(expected_frames) == len(got_frames)
+        for expected_frame, got_frame in zip(expected_frames, got_frames):
+            pdt.assert_frame_equal(expected_frame, got_frame)
+
+
+def test_resume_retries_only_failed_units(server, tmp_path):
+    path = str(tmp_path / 'checkpoint.db')
+    expected = CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False).get_course_info()
+
+    # The fake server fails, dropping the connection, on a course whose submissions are missing
+    saved = server.institution.submissions.pop(FAILING_COURSE)
+    status = CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False, checkpoint=path)
+    status.get_course_info()
+    errors = status.get_errors()
+    assert errors[['course_id', 'option']].values.tolist() == [[FAILING_COURSE, 'submissions']]
+
+    server.institution.submissions[FAILING_COURSE] = saved
+    server.reset_counts()
+    status = CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False, checkpoint=path)
+    resumed = status.get_course_info()
+    assert len(status.get_errors()) == 0
+    # Only the failed unit (and the course list and assignment order it needs) is fetched again
+    assert set(server.requests) == {'courses', 'assignments', 'student_submissions'}
+    _assert_same_info(expected, resumed)
+
+
+def test_checkpoint_store_records_units(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoint.db'))
+    frame = pd.DataFrame({'id': [1, 2], 'name': ['a', 'b']})
+    store.mark_failed(100, 'students', RuntimeError('boom'))
+    assert not store.is_done(100, 'students')
+    store.mark_done(100, 'students', frame)
+    assert store.is_done(100, 'students')
+    pdt.assert_frame_equal(store.get_frame(100, 'students'), frame)
+    assert len(store.get_errors()) == 0
+
+    store.mark_failed(101, 'submissions', RuntimeError('boom'))
+    store.mark_failed(101, 'submissions', RuntimeError('again'))
+    errors = store.get_errors()
+    assert errors[['course_id', 'option', 'attempts']].values.tolist() == [[101, 'submissions', 2]]
+    assert errors['error'][0] == 'RuntimeError: again'
+    store.close()
@@ -0,0 +1,77 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+course_info records: value equality and hashing, RecordBatch built column-wise and from
+records, the records of a CanvasConnection, and CourseApi's abstract methods.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.course_info import Assignment, CourseApi, Person, RecordBatch, Submission
+import pytest
+
+COURSE_ID = 100
+
+
+def test_record_equality_and_hash():
+    first = Assignment(1, 'Homework 1', points=10)
+    same = Assignment(assignment_uuid=1, name='Homework 1', points=10)
+    assert first == same and hash(first) == hash(same)
+    assert len({first, same, Assignment(2, 'Homework 2')}) == 2
+    assert first != Assignment(1, 'Homework 1')
+    # Records of different types are never equal
+    assert Submission(1, 'Homework 1') != Assignment(1, 'Homework 1')
+    assert first.as_dict()['ec_points'] is None
+    with pytest.raises(TypeError):
+        Assignment(1, bonus=5)
+
+
+def test_batch_round_trip():
+    records = [Person('1', 'S1', 'Ann', ['ann@example.edu'], 'ann', 'student'),
+               Person('2', 'S2', 'Bo', [], 'bo', 'student')]
+    batch = RecordBatch.from_records(Person, records)
+    assert len(batch) == 2
+    assert list(batch) == records
+    assert batch[1] == records[1]
+    frame = batch.to_frame()
+    assert list(frame.columns) == list(Person.__slots__)
+    assert frame['name'].tolist() == ['Ann', 'Bo']
+    with pytest.raises(ValueError):
+        RecordBatch(Person, {'data_id': ['1'], 'name': []})
+
+
+def test_connection_records(server, institution):
+    canvas = CanvasConnection(server.url, 'token')
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    assignments = canvas.get_assignment_records(course)
+    expected = institution.assignments[COURSE_ID]
+    assert [record.assignment_uuid for record in assignments] == [row['id'] for row in expected]
+    # lock_at stands for the late deadline; Canvas has no extra credit or weight per assignment
+    assert [record.late for record in assignments] == [row['lock_at'] for row in expected]
+    assert set(assignments.columns['ec_points']) == {None} and set(assignments.columns['weight']) == {None}
+
+    submissions = canvas.get_submission_records(course)
+    assert len(submissions) == len(institution.submissions[COURSE_ID])
+    assert len(set(submissions)) == len(submissions)
+
+
+def test_course_api_is_abstract():
+    class Partial(CourseApi):
+        def get_course_list(self):
+            return []
+
+    with pytest.raises(TypeError):
+        Partial()
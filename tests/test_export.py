@@ -0,0 +1,152 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+ParquetSink and read_dataset: frames written per course come back the same, in Parquet
+and Arrow; a later run appends with the dataset's schema, or replaces the courses it
+writes; and finish_course completes a course's files before the run ends.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.canvas_status import CanvasStatus
+import glob
+import os
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+pytest.importorskip('pyarrow')
+from python_canvas_layer.export import ParquetSink, read_dataset, read_schema, FORMATS
+
+COURSE_IDS = [100, 101]
+ENTITIES = {'students': 'get_students_df', 'assignments': 'get_assignments_df',
+            'submissions': 'get_assignment_submissions_df'}
+
+
+@pytest.fixture
+def frames(server):
+    """
+    Each entity's typed frame for each course, with its course_id.
+    """
+    canvas = CanvasConnection(server.url, 'token', typed=True)
+    ret = {}
+    for course in canvas.get_courses_by_id(COURSE_IDS):
+        for entity, method in ENTITIES.items():
+            frame = getattr(canvas, method)(course)
+            frame['course_id'] = pd.array([course.id] * len(frame), dtype='Int64')
+            ret[(entity, course.id)] = frame
+    return ret
+
+
+def _write(sink: ParquetSink, frames) -> None:
+    for course_id in COURSE_IDS:
+        for entity in ENTITIES:
+            frame = frames[(entity, course_id)]
+            # In two batches, as CanvasStatus streams them
+            sink.write(entity, course_id, frame.iloc[:5])
+            sink.write(entity, course_id, frame.iloc[5:])
+        sink.finish_course(course_id)
+
+
+def _expected(frames, entity: str, copies: int = 1) -> pd.DataFrame:
+    parts = [frames[(entity, course_id)] for course_id in COURSE_IDS for _ in range(copies)]
+    return pd.concat(parts, ignore_index=True)
+
+
+def _assert_same(got: pd.DataFrame, expected: pd.DataFrame) -> None:
+    # Categories are unified across courses on reading, so compare them as values
+    keys = ['course_id', 'id']
+    got = got.sort_values(keys, kind='stable', ignore_index=True)
+    expected = expected.sort_values(keys, kind='stable', ignore_index=True)[list(got.columns)]
+    pdt.assert_frame_equal(got, expected, check_dtype=False, check_categorical=False)
+
+
+@pytest.mark.parametrize('format', list(FORMATS))
+def test_round_trip(tmp_path, frames, format):
+    sink = ParquetSink(str(tmp_path), format=format)
+    _write(sink, frames)
+    sink.close()
+
+    for entity in ENTITIES:
+        got = read_dataset(str(tmp_path), entity, format)
+        assert sorted(got.columns) == sorted(frames[(entity, COURSE_IDS[0])].columns)
+        _assert_same(got, _expected(frames, entity))
+    one = read_dataset(str(tmp_path), 'submissions', format, columns=['id', 'score'], course_ids=[COURSE_IDS[1]])
+    assert list(one.columns) == ['id', 'score']
+    assert len(one) == len(frames[('submissions', COURSE_IDS[1])])
+
+
+@pytest.mark.parametrize('format', list(FORMATS))
+def test_append_reuses_schema(tmp_path, frames, format):
+    sink = ParquetSink(str(tmp_path), format=format)
+    _write(sink, frames)
+    sink.close()
+
+    # Nothing graded this time: on its own, the column would be inferred as null
+    later = dict(frames)
+    for course_id in COURSE_IDS:
+        later[('submissions', course_id)] = frames[('submissions', course_id)].assign(points_deducted=None)
+    sink = ParquetSink(str(tmp_path), format=format)
+    _write(sink, later)
+    sink.close()
+
+    paths = sorted(glob.glob(os.path.join(str(tmp_path), 'submissions', '*', '*' + FORMATS[format])))
+    assert len(paths) == 2 * len(COURSE_IDS)
+    assert len(set(str(read_schema(path, format)) for path in paths)) == 1
+    got = read_dataset(str(tmp_path), 'submissions', format)
+    assert len(got) == len(_expected(frames, 'submissions', 2))
+    assert got['points_deducted'].isna().sum() == \
+        len(_expected(frames, 'submissions')) + _expected(frames, 'submissions')['points_deducted'].isna().sum()
+
+
+def test_replace(tmp_path, frames):
+    sink = ParquetSink(str(tmp_path))
+    _write(sink, frames)
+    sink.close()
+
+    # The second run writes only the first course
+    sink = ParquetSink(str(tmp_path), replace=True)
+    sink.write('students', COURSE_IDS[0], frames[('students', COURSE_IDS[0])])
+    sink.close()
+    got = read_dataset(str(tmp_path), 'students')
+    _assert_same(got, _expected(frames, 'students'))
+    # Course 101's earlier file is kept, as are the entities the run did not write
+    assert len(read_dataset(str(tmp_path), 'submissions')) == len(_expected(frames, 'submissions'))
+
+
+@pytest.mark.parametrize('format', list(FORMATS))
+def test_finish_course(tmp_path, frames, format):
+    sink = ParquetSink(str(tmp_path), format=format)
+    first, second = COURSE_IDS
+    sink.write('submissions', first, frames[('submissions', first)])
+    sink.write('submissions', second, frames[('submissions', second)])
+    sink.finish_course(first)
+
+    # The finished course can be read while the other is still being written
+    got = read_dataset(str(tmp_path), 'submissions', format, course_ids=[first])
+    _assert_same(got, frames[('submissions', first)])
+    sink.close()
+    _assert_same(read_dataset(str(tmp_path), 'submissions', format), _expected(frames, 'submissions'))
+
+
+def test_course_info_to_sink(server, tmp_path):
+    expected = CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False, typed=True).get_course_info()
+    sink = ParquetSink(str(tmp_path))
+    CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False, typed=True, sink=sink).get_course_info()
+    sink.close()
+
+    courses = read_dataset(str(tmp_path), 'courses')
+    pdt.assert_frame_equal(courses, expected[0], check_dtype=False, check_categorical=False)
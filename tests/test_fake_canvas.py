@@ -0,0 +1,76 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+The fake Canvas server itself: listings are split into linked pages, every request
+is counted, and an unchanged page is answered 304 when its ETag is sent back.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+import json
+import re
+import pytest
+
+COURSE_ID = 100
+
+
+def _get(url: str, etag: str = None):
+    headers = {'Authorization': 'Bearer token'}
+    if etag:
+        headers['If-None-Match'] = etag
+    return urlopen(Request(url, headers=headers))
+
+
+def test_listings_are_paginated(server, institution):
+    url = '%s/api/v1/courses/%d/users?per_page=100' % (server.url, COURSE_ID)
+    seen = []
+    while url:
+        response = _get(url)
+        seen.extend(json.loads(response.read()))
+        links = {rel: link for link, rel in re.findall(r'<([^>]+)>; rel="(\w+)"', response.headers['Link'])}
+        url = links.get('next')
+    assert [u['id'] for u in seen] == [u['id'] for u in institution.users[COURSE_ID]]
+    # max_per_page=10 caps the requested 100
+    assert server.requests['users'] == (len(seen) + 9) // 10
+
+
+def test_connection_reads_every_row(server, institution):
+    canvas = CanvasConnection(server.url, 'token')
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    assert sorted(canvas.get_students_df(course)['id']) == sorted(u['id'] for u in institution.users[COURSE_ID])
+    assert list(canvas.get_assignments_df(course)['id']) == [a['id'] for a in institution.assignments[COURSE_ID]]
+    assert len(canvas.get_assignment_submissions_df(course)) == len(institution.submissions[COURSE_ID])
+
+
+def test_etag_revalidation(server):
+    url = '%s/api/v1/courses/%d/assignments' % (server.url, COURSE_ID)
+    etag = _get(url).headers['ETag']
+    with pytest.raises(HTTPError) as err:
+        _get(url, etag)
+    assert err.value.code == 304
+    assert server.not_modified == 1
+    assert server.requests['assignments'] == 2
+
+    server.reset_counts()
+    assert server.request_count == 0 and server.not_modified == 0
+
+
+def test_unknown_course(server):
+    with pytest.raises(HTTPError) as err:
+        _get('%s/api/v1/courses/999/assignments' % server.url)
+    assert err.value.code == 404
@@ -0,0 +1,159 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+Gradebook against plain pandas over the same frames: the score block is a pivot of the
+submissions, the masks are pivots of their flags, the totals are group-bys, and a
+gradebook updated with new students and assignments equals one built from scratch.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.gradebook import Gradebook
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+COURSE_IDS = [100, 101]
+
+
+@pytest.fixture
+def frames(server):
+    """
+    The submissions, assignments and students frames of two courses, with course_id columns.
+    """
+    canvas = CanvasConnection(server.url, 'token')
+    ret = {'submissions': [], 'assignments': [], 'students': []}
+    for course in canvas.get_courses_by_id(COURSE_IDS):
+        for entity, frame in (('submissions', canvas.get_assignment_submissions_df(course)),
+                              ('assignments', canvas.get_assignments_df(course)),
+                              ('students', canvas.get_students_df(course))):
+            ret[entity].append(frame.assign(course_id=course.id))
+    return {entity: pd.concat(parts, ignore_index=True) for entity, parts in ret.items()}
+
+
+def _pivot(frame: pd.DataFrame, values: pd.Series, course_id: int, gradebook: Gradebook) -> pd.DataFrame:
+    course = gradebook.courses[course_id]
+    rows = frame.assign(value=values)[frame['course_id'] == course_id]
+    pivot = rows.pivot(index='user_id', columns='assignment_id', values='value')
+    return pivot.reindex(index=course.student_ids, columns=course.assignment_ids)
+
+
+def _reference(frames) -> pd.DataFrame:
+    # One row per submission, with the quantities the totals are sums and means of
+    subs = frames['submissions'].merge(
+        frames['assignments'][['course_id', 'id', 'points_possible']].rename(columns={'id': 'assignment_id'}),
+        on=['course_id', 'assignment_id'])
+    excused = subs['excused'].astype('boolean').fillna(False).astype(bool)
+    score = pd.to_numeric(subs['score']).astype(float)
+    graded = ~excused & score.notna()
+    return pd.DataFrame({
+        'course_id': subs['course_id'], 'user_id': subs['user_id'], 'assignment_id': subs['assignment_id'],
+        'assignments': ~excused, 'graded': graded, 'submitted': subs['submitted_at'].notna(),
+        'missing': subs['missing'].astype('boolean').fillna(False).astype(bool),
+        'late': subs['late'].astype('boolean').fillna(False).astype(bool), 'excused': excused,
+        'points': score.where(graded, 0.0),
+        'points_graded': subs['points_possible'].astype(float).where(graded, 0.0),
+        'points_possible': subs['points_possible'].astype(float).where(~excused, 0.0),
+        'score': score.where(graded),
+    })
+
+
+def test_scores_match_pivot(frames):
+    gradebook = Gradebook(frames['submissions'], frames['assignments'], frames['students'])
+    subs = frames['submissions']
+    for course_id in COURSE_IDS:
+        expected = _pivot(subs, pd.to_numeric(subs['score']).astype(float), course_id, gradebook)
+        pdt.assert_frame_equal(gradebook.scores_frame(course_id), expected,
+                               check_names=False, check_index_type=False, check_column_type=False)
+        # Every enrolled student and every assignment has a cell
+        assert gradebook.scores_frame(course_id).shape == \
+            ((frames['students']['course_id'] == course_id).sum(),
+             (frames['assignments']['course_id'] == course_id).sum())
+
+
+@pytest.mark.parametrize('flag', ['excused', 'missing', 'late', 'submitted', 'present'])
+def test_masks_match_pivot(frames, flag):
+    gradebook = Gradebook(frames['submissions'], frames['assignments'], frames['students'])
+    subs = frames['submissions']
+    if flag == 'submitted':
+        values = subs['submitted_at'].notna()
+    elif flag == 'present':
+        values = pd.Series(True, index=subs.index)
+    else:
+        values = subs[flag].astype('boolean').fillna(False).astype(bool)
+    for course_id in COURSE_IDS:
+        expected = _pivot(subs, values, course_id, gradebook).fillna(False).astype(bool)
+        got = gradebook.mask_frame(flag, course_id)
+        pdt.assert_frame_equal(got, expected, check_names=False, check_index_type=False, check_column_type=False)
+    # The synthetic data has every flag somewhere
+    assert any(gradebook.mask_frame(flag, course_id).to_numpy().any() for course_id in COURSE_IDS)
+
+
+def test_student_totals(frames):
+    gradebook = Gradebook(frames['submissions'], frames['assignments'], frames['students'])
+    reference = _reference(frames).drop(columns=['assignment_id', 'score'])
+    expected = reference.groupby(['course_id', 'user_id'], sort=False).sum().reset_index()
+    expected['percent'] = 100.0 * expected['points'] / expected['points_graded'].where(expected['points_graded'] > 0)
+    expected['percent_total'] = 100.0 * expected['points'] / \
+        expected['points_possible'].where(expected['points_possible'] > 0)
+
+    got = gradebook.student_totals()
+    keys = ['course_id', 'user_id']
+    got = got.sort_values(keys, ignore_index=True)
+    expected = expected.sort_values(keys, ignore_index=True)[list(got.columns)]
+    pdt.assert_frame_equal(got, expected, check_dtype=False)
+
+
+def test_assignment_totals(frames):
+    gradebook = Gradebook(frames['submissions'], frames['assignments'], frames['students'])
+    reference = _reference(frames)
+    groups = reference.groupby(['course_id', 'assignment_id'])
+    expected = groups[['graded', 'submitted', 'missing', 'late', 'excused']].sum()
+    expected['mean_score'] = groups['score'].mean()
+    expected['median_score'] = groups['score'].median()
+    points_possible = frames['assignments'].set_index(['course_id', 'id'])['points_possible'].astype(float)
+    points_possible = points_possible.rename_axis(expected.index.names).reindex(expected.index)
+    expected['mean_percent'] = 100.0 * expected['mean_score'] / points_possible
+
+    got = gradebook.assignment_totals().set_index(['course_id', 'assignment_id']).sort_index()
+    pdt.assert_frame_equal(got[list(expected.columns)], expected.sort_index(), check_dtype=False,
+                           check_names=False)
+    np.testing.assert_array_equal(got['points_possible'], points_possible.sort_index())
+
+
+def test_update_matches_fresh_build(frames):
+    fresh = Gradebook(frames['submissions'], frames['assignments'], frames['students'])
+
+    # Start from the first few students and assignments of each course, then add the rest
+    def first(frame, n):
+        return frame.groupby('course_id', sort=False).head(n)
+
+    students = first(frames['students'], 10)
+    assignments = first(frames['assignments'], 4)
+    subs = frames['submissions']
+    early = subs['user_id'].isin(students['id']) & subs['assignment_id'].isin(assignments['id'])
+    gradebook = Gradebook(subs[early], assignments, students)
+
+    changed = gradebook.update(subs[~early], frames['assignments'].drop(assignments.index),
+                               frames['students'].drop(students.index))
+    assert sorted(changed) == COURSE_IDS
+    for course_id in COURSE_IDS:
+        pdt.assert_frame_equal(gradebook.scores_frame(course_id), fresh.scores_frame(course_id))
+        for flag in ['excused', 'missing', 'late', 'submitted', 'present']:
+            pdt.assert_frame_equal(gradebook.mask_frame(flag, course_id), fresh.mask_frame(flag, course_id))
+    pdt.assert_frame_equal(gradebook.student_totals(), fresh.student_totals())
+    pdt.assert_frame_equal(gradebook.assignment_totals(), fresh.assignment_totals())
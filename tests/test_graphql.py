@@ -0,0 +1,64 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+GraphQLCanvasConnection against the REST CanvasConnection on the same fake server: the
+same assignment and submission frames, with submissions on several GraphQL pages.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.graphql_canvas import GraphQLCanvasConnection
+from python_canvas_layer.canvas_status import CanvasStatus
+import pandas.testing as pdt
+import pytest
+
+COURSE_ID = 100
+
+
+@pytest.fixture
+def small_pages(monkeypatch) -> None:
+    # Fewer assignments and submissions per query than the course has, so both are paged
+    monkeypatch.setattr(GraphQLCanvasConnection, 'PAGE_SIZE', 4)
+    monkeypatch.setattr(GraphQLCanvasConnection, 'SUBMISSIONS_PER_ASSIGNMENT', 4)
+
+
+@pytest.mark.parametrize('typed', [False, True])
+def test_frames_match_rest(server, small_pages, typed):
+    rest = CanvasConnection(server.url, 'token', typed=typed)
+    graphql = GraphQLCanvasConnection(server.url, 'token', typed=typed)
+    course = rest.get_courses_by_id([COURSE_ID])[0]
+
+    pdt.assert_frame_equal(graphql.get_assignments_df(course), rest.get_assignments_df(course))
+    server.reset_counts()
+    pdt.assert_frame_equal(graphql.get_assignment_submissions_df(course), rest.get_assignment_submissions_df(course))
+    assert server.requests['graphql'] > 1
+    pdt.assert_frame_equal(graphql.get_assignment_submissions_df(course, bulk=False),
+                           rest.get_assignment_submissions_df(course, bulk=False))
+
+
+def test_course_info_matches_rest(server, small_pages):
+    expected = CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False).get_course_info()
+    got = CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False, backend='graphql').get_course_info()
+    pdt.assert_frame_equal(expected[0], got[0])
+    for expected_frames, got_frames in zip(expected[1:], got[1:]):
+        assert len(expected_frames) == len(got_frames)
+        for expected_frame, got_frame in zip(expected_frames, got_frames):
+            pdt.assert_frame_equal(expected_frame, got_frame)
+
+
+def test_raw_json_is_required(server):
+    with pytest.raises(ValueError):
+        GraphQLCanvasConnection(server.url, 'token', raw_json=False)
@@ -0,0 +1,117 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+IncrementalSync against a full refresh: after the institution changes, syncing only the
+changes must give the same submissions as pulling them all again.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.incremental import IncrementalSync, SyncStore
+from canvasapi.exceptions import Forbidden
+import pandas.testing as pdt
+import pytest
+
+COURSE_ID = 100
+# Later than any date in the synthetic data, so these rows are past every high-water mark
+LATER = '2099-01-01T00:00:00Z'
+
+
+def _change(institution) -> None:
+    """
+    A regrade, a new submission, a dropped and an enrolled student, a new assignment and
+    an edited one.
+    """
+    submissions = institution.submissions[COURSE_ID]
+    submissions[5].update(score=1.0, graded_at=LATER)
+    submissions[17].update(submitted_at=LATER)
+
+    users = institution.users[COURSE_ID]
+    dropped = users.pop(3)
+    submissions[:] = [sub for sub in submissions if sub['user_id'] != dropped['id']]
+    users.append(dict(users[0], id=99999, login_id='student99999'))
+    for assignment in institution.assignments[COURSE_ID]:
+        submissions.append(dict(submissions[0], id=8000000 + assignment['id'], user_id=99999,
+                                assignment_id=assignment['id'], submitted_at=None, graded_at=None))
+
+    assignments = institution.assignments[COURSE_ID]
+    assignments.append(dict(assignments[0], id=29999, name='New homework'))
+    for user in users:
+        submissions.append(dict(submissions[0], id=9000000 + user['id'], user_id=user['id'], assignment_id=29999,
+                                submitted_at=None, graded_at=None))
+    assignments[2]['points_possible'] = 77.0
+
+
+def test_incremental_matches_full_refresh(server, tmp_path):
+    canvas = CanvasConnection(server.url, 'token')
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    sync = IncrementalSync(canvas, SyncStore(str(tmp_path / 'incremental.db')))
+    first = sync.get_assignment_submissions_df(course)
+    pdt.assert_frame_equal(first, canvas.get_assignment_submissions_df(course))
+
+    _change(server.institution)
+    server.reset_counts()
+    incremental = sync.get_assignment_submissions_df(course)
+    assert server.requests['student_submissions'] > 0
+
+    full = IncrementalSync(canvas, SyncStore(str(tmp_path / 'full.db'))).get_assignment_submissions_df(course)
+    direct = canvas.get_assignment_submissions_df(course)
+    pdt.assert_frame_equal(full, direct)
+    pdt.assert_frame_equal(incremental, full)
+    assert 99999 in set(incremental['user_id'])
+    assert 29999 in set(incremental['assignment_id'])
+
+
+def test_unchanged_course_fetches_no_submissions_twice(server, tmp_path):
+    canvas = CanvasConnection(server.url, 'token')
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    sync = IncrementalSync(canvas, SyncStore(str(tmp_path / 'sync.db')))
+    first = sync.get_assignment_submissions_df(course)
+
+    server.reset_counts()
+    again = sync.get_assignment_submissions_df(course)
+    pdt.assert_frame_equal(first, again)
+    # Only the two since-filtered listings, each of which comes back (nearly) empty
+    assert server.requests['student_submissions'] == 2
+
+
+def test_refused_bulk_endpoint_falls_back_to_full_refresh(server, tmp_path, monkeypatch):
+    canvas = CanvasConnection(server.url, 'token')
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    expected = canvas.get_assignment_submissions_df(course)
+
+    def refuse(*args, **kwargs):
+        raise Forbidden('bulk submissions are disabled')
+
+    monkeypatch.setattr(canvas, '_get_submission_columns_bulk', refuse)
+    sync = IncrementalSync(canvas, SyncStore(str(tmp_path / 'sync.db')))
+    pdt.assert_frame_equal(sync.get_assignment_submissions_df(course), expected)
+    pdt.assert_frame_equal(sync.get_assignment_submissions_df(course), expected)
+
+
+@pytest.mark.parametrize('listing', ['refused', 'empty'])
+def test_missing_student_listing_keeps_submissions(server, tmp_path, monkeypatch, listing):
+    canvas = CanvasConnection(server.url, 'token')
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    sync = IncrementalSync(canvas, SyncStore(str(tmp_path / 'sync.db')))
+    expected = sync.get_assignment_submissions_df(course)
+
+    if listing == 'refused':
+        # As after CanvasConnection skips a Forbidden listing
+        monkeypatch.setattr(canvas, '_iter_student_columns', lambda *args, **kwargs: iter([]))
+    else:
+        server.institution.users[COURSE_ID] = []
+    pdt.assert_frame_equal(sync.get_assignment_submissions_df(course), expected)
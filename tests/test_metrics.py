@@ -0,0 +1,74 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+RunMetrics: requests are counted per endpoint and course, rows once per listing handed
+back, latency is kept per course, and an empty run still summarizes.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.metrics import RunMetrics
+
+COURSE_ID = 100
+
+
+def test_requests_counted(server, institution):
+    metrics = RunMetrics()
+    canvas = CanvasConnection(server.url, 'token', metrics=metrics)
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    server.reset_counts()
+    metrics.reset()
+    canvas.get_students_df(course)
+
+    summary = metrics.summary('course')
+    assert summary.loc[COURSE_ID, 'requests'] == server.request_count
+    assert summary.loc[COURSE_ID, 'pages'] == server.requests['users']
+    assert metrics.rows().set_index('entity')['rows']['students'] == len(institution.users[COURSE_ID])
+    assert metrics.latency_histogram('/api/v1/courses/:id/search_users').sum() == server.requests['users']
+
+
+def test_rows_counted_once(server, institution):
+    metrics = RunMetrics()
+    canvas = CanvasConnection(server.url, 'token', metrics=metrics)
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    canvas.get_assignments_df(course)
+    # Reads the assignment listing again, for the order of the submissions
+    canvas.get_assignment_submissions_df(course)
+
+    rows = metrics.rows().set_index('entity')['rows']
+    assert rows['assignments'] == len(institution.assignments[COURSE_ID])
+    assert rows['submissions'] == len(institution.submissions[COURSE_ID])
+
+
+def test_latency_by_course(server):
+    metrics = RunMetrics()
+    canvas = CanvasConnection(server.url, 'token', metrics=metrics)
+    for course in canvas.get_courses_by_id([COURSE_ID, COURSE_ID + 1]):
+        canvas.get_students_df(course)
+
+    endpoint = '/api/v1/courses/:id/search_users'
+    first = metrics.latency_histogram(endpoint, COURSE_ID).sum()
+    second = metrics.latency_histogram(endpoint, COURSE_ID + 1).sum()
+    assert first > 0 and second > 0
+    assert metrics.latency_histogram(endpoint).sum() == first + second
+
+
+def test_empty_summary():
+    metrics = RunMetrics()
+    assert len(metrics.summary('endpoint')) == 0
+    assert list(metrics.summary('endpoint').columns) == RunMetrics.COUNTERS
+    assert list(metrics.summary('course').columns) == RunMetrics.COUNTERS + ['rows']
+    metrics.on_run_end()
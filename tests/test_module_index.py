@@ -0,0 +1,93 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+ModuleItemIndex against the scan of the module items frame it replaces, on random titles
+and on the module items the fake server serves.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.module_index import ModuleItemIndex
+import numpy as np
+import pandas as pd
+import random
+
+TYPES = ['Quiz', 'ExternalUrl', 'Page']
+
+
+def _scan(module_items: pd.DataFrame, index: str, typ: str):
+    # The original get_matching_module_url: the first match in frame order, by filtering
+    matches = module_items[module_items['title'].apply(lambda title: title.startswith(index))]
+    if len(matches):
+        matches = matches[matches['type'] == typ]
+    if len(matches):
+        if typ == 'Quiz':
+            return matches['html_url'].array[0]
+        else:
+            return matches['external_url'].array[0]
+
+
+def _missing_as_none(value):
+    return None if value is None or (isinstance(value, float) and np.isnan(value)) else value
+
+
+def _random_items(rng: random.Random) -> pd.DataFrame:
+    rows = []
+    for i in range(rng.randint(1, 40)):
+        typ = rng.choice(TYPES)
+        # A small alphabet, so that titles share prefixes and repeat
+        row = {'title': ''.join(rng.choice('ab1 é') for _ in range(rng.randint(0, 5))), 'type': typ,
+               'html_url': 'https://canvas.example.edu/items/%d' % i}
+        if typ == 'ExternalUrl':
+            row['external_url'] = 'https://example.com/%d' % i
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def test_index_matches_scan_on_random_titles():
+    rng = random.Random(1)
+    for _ in range(150):
+        module_items = _random_items(rng)
+        index = ModuleItemIndex(module_items)
+        prefixes = [''.join(rng.choice('ab1 é') for _ in range(rng.randint(0, 4))) for _ in range(20)]
+        for typ in TYPES + ['File']:
+            if 'external_url' not in module_items.columns and typ != 'Quiz':
+                # The scan fails without the column; the index treats the URLs as missing
+                continue
+            expected = [_missing_as_none(_scan(module_items, prefix, typ)) for prefix in prefixes]
+            assert [_missing_as_none(url) for url in index.lookup_many(prefixes, typ)] == expected
+            assert [_missing_as_none(index.lookup(prefix, typ)) for prefix in prefixes] == expected
+
+
+def test_index_matches_scan_on_served_module_items(server):
+    canvas = CanvasConnection(server.url, 'token')
+    for course in canvas.get_course_list_objs():
+        module_items = canvas.get_module_items_df(course)
+        index = canvas.get_module_item_index(course)
+        prefixes = sorted(set(title[:n] for title in module_items['title'] for n in (0, 3, len(title)))) + ['None']
+        for typ in ['Quiz', 'ExternalUrl']:
+            expected = [_missing_as_none(_scan(module_items, prefix, typ)) for prefix in prefixes]
+            assert [_missing_as_none(url) for url in canvas.get_matching_module_urls(index, prefixes, typ)] == \
+                expected
+            assert [_missing_as_none(canvas.get_matching_module_url(module_items, prefix, typ))
+                    for prefix in prefixes] == expected
+
+
+def test_empty_frame():
+    index = ModuleItemIndex(pd.DataFrame())
+    assert index.size == 0
+    assert index.lookup('Quiz 1', 'Quiz') is None
+    assert index.lookup_many(['a', 'b'], 'Quiz') == [None, None]
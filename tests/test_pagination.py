@@ -0,0 +1,160 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+PageFetcher: numbered pages are read concurrently and yielded in order, within the
+window; bookmark links, a missing last link and meta.pagination are followed one page
+at a time; and a failed page ends the listing with its error.
+"""
+
+from python_canvas_layer.pagination import PageFetcher
+from canvasapi.exceptions import Forbidden
+from canvasapi.requester import Requester
+from urllib.parse import parse_qs, urlsplit
+import json
+import threading
+import time
+import requests
+import pytest
+
+BASE = 'https://canvas.test/api/v1/'
+
+
+class StubRequester(object):
+    """
+    Serves items in pages of per_page, linked as Canvas does with page=N (style
+    'numbered'), with opaque bookmarks ('bookmark'), without a last link ('no_last'), or
+    with meta.pagination in the body ('meta').  Records the pages asked for and the most
+    requests in flight at once.
+    """
+
+    def __init__(self, items, per_page=2, style='numbered', delay=0.0, fail_page=None):
+        self.items = items
+        self.per_page = per_page
+        self.style = style
+        self.delay = delay
+        self.fail_page = fail_page
+        self.requested = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def last(self) -> int:
+        return (len(self.items) + self.per_page - 1) // self.per_page
+
+    def _url(self, page: int) -> str:
+        if self.style == 'bookmark':
+            return BASE + 'items?page=bookmark:%d&per_page=%d' % (page, self.per_page)
+        return BASE + 'items?page=%d&per_page=%d' % (page, self.per_page)
+
+    def request(self, method, endpoint=None, _url=None, **kwargs):
+        page = 1
+        if _url:
+            page = int(parse_qs(urlsplit(_url).query)['page'][0].replace('bookmark:', ''))
+        with self._lock:
+            self.requested.append(page)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if page == self.fail_page:
+                raise Forbidden('page %d' % page)
+            return self._response(page)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _response(self, page: int) -> requests.Response:
+        body = self.items[(page - 1) * self.per_page:page * self.per_page]
+        next_url = self._url(page + 1) if page < self.last else None
+        response = requests.Response()
+        response.status_code = 200
+        if self.style == 'meta':
+            body = {'items': body, 'meta': {'pagination': {'next': next_url}}}
+        else:
+            links = ['<%s>; rel="current"' % self._url(page)]
+            if next_url:
+                links.append('<%s>; rel="next"' % next_url)
+            if self.style != 'no_last':
+                links.append('<%s>; rel="last"' % self._url(self.last))
+            response.headers['Link'] = ','.join(links)
+        response._content = json.dumps(body).encode('utf-8')
+        return response
+
+
+def _items(responses):
+    ret = []
+    for response in responses:
+        page = response.json()
+        ret.extend(page['items'] if isinstance(page, dict) else page)
+    return ret
+
+
+def test_numbered_pages_concurrent_and_in_order():
+    items = list(range(40))
+    requester = StubRequester(items, delay=0.02)
+    fetcher = PageFetcher(requester, max_workers=4)
+    assert _items(fetcher.pages('GET', 'items')) == items
+    assert sorted(requester.requested) == list(range(1, requester.last + 1))
+    assert requester.max_in_flight > 1
+    fetcher.close()
+
+
+@pytest.mark.parametrize('style', ['bookmark', 'no_last', 'meta'])
+def test_unnumbered_pages_follow_next(style):
+    items = list(range(9))
+    requester = StubRequester(items, delay=0.01, style=style)
+    fetcher = PageFetcher(requester, max_workers=4)
+    assert _items(fetcher.pages('GET', 'items')) == items
+    # One page at a time, in order
+    assert requester.requested == list(range(1, requester.last + 1))
+    assert requester.max_in_flight == 1
+
+
+def test_window_bounds_pages_ahead():
+    requester = StubRequester(list(range(40)), delay=0.001)
+    fetcher = PageFetcher(requester, max_workers=4, window=3)
+    consumed = 0
+    for _ in fetcher.pages('GET', 'items'):
+        consumed += 1
+        # Give the pool time to run ahead if it could
+        time.sleep(0.02)
+        assert len(requester.requested) <= consumed + 3
+    assert consumed == requester.last
+    fetcher.close()
+
+
+def test_error_after_first_page():
+    requester = StubRequester(list(range(40)), delay=0.01, fail_page=3)
+    fetcher = PageFetcher(requester, max_workers=4, window=2)
+    seen = []
+    with pytest.raises(Forbidden):
+        for response in fetcher.pages('GET', 'items'):
+            seen.extend(response.json())
+    assert seen == list(range(4))
+    time.sleep(0.05)
+    # The pages queued behind the failure were dropped rather than read
+    assert len(requester.requested) < requester.last
+    fetcher.close()
+
+
+def test_fake_server_listing(server, institution):
+    fetcher = PageFetcher(Requester(server.url, 'token'), max_workers=4)
+    users = _items(fetcher.pages('GET', 'courses/100/users', _kwargs=[('per_page', 100)]))
+    assert [user['id'] for user in users] == [user['id'] for user in institution.users[100]]
+    assert server.requests['users'] == 2
+    fetcher.close()
@@ -0,0 +1,52 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+The raw-JSON transport against canvasapi objects: the same students, assignments and
+submissions frames, including for a course with none of them.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+import pandas.testing as pdt
+import pytest
+
+COURSE_ID = 100
+EMPTY_COURSE_ID = 101
+
+METHODS = ['get_students_df', 'get_assignments_df', 'get_assignment_submissions_df']
+
+
+@pytest.fixture
+def empty_course(institution):
+    for table in (institution.users, institution.assignments, institution.submissions):
+        table[EMPTY_COURSE_ID] = []
+
+
+@pytest.mark.parametrize('typed', [False, True])
+@pytest.mark.parametrize('course_id', [COURSE_ID, EMPTY_COURSE_ID])
+def test_raw_json_matches_objects(server, empty_course, typed, course_id):
+    objects = CanvasConnection(server.url, 'token', typed=typed)
+    raw = CanvasConnection(server.url, 'token', typed=typed, raw_json=True)
+    course = objects.get_courses_by_id([course_id])[0]
+
+    for method in METHODS:
+        expected = getattr(objects, method)(course)
+        pdt.assert_frame_equal(getattr(raw, method)(course), expected, obj=method)
+        assert (len(expected) == 0) == (course_id == EMPTY_COURSE_ID)
+    pdt.assert_frame_equal(raw.get_assignment_submissions_df(course, bulk=False),
+                           objects.get_assignment_submissions_df(course, bulk=False))
+    assert raw.get_students(course) == objects.get_students(course)
+    assert raw.get_assignment_submissions(course) == objects.get_assignment_submissions(course)
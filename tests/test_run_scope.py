@@ -0,0 +1,124 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+RunScope: concurrent callers of one listing share a single load, a failed load is not
+kept, and release forgets a course's listings; and within CanvasConnection.run_scope a
+course's assignments are listed once for all of the options that read them.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.run_scope import RunScope
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import pandas.testing as pdt
+import pytest
+
+COURSE_ID = 100
+
+
+def test_concurrent_callers_share_one_load():
+    scope = RunScope()
+    started = threading.Event()
+    finish = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        started.set()
+        finish.wait(5)
+        return ['row']
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        first = pool.submit(scope.get, COURSE_ID, 'assignments', {'per_page': 100, 'include': ['a', 'b']}, load)
+        started.wait(5)
+        # The same key, with its parameters in another order and form
+        others = [pool.submit(scope.get, COURSE_ID, 'assignments', {'include': ('a', 'b'), 'per_page': 100}, load)
+                  for _ in range(3)]
+        finish.set()
+        results = [first.result()] + [future.result() for future in others]
+
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert scope.stats['misses'] == 1
+    assert scope.stats['hits'] + scope.stats['coalesced'] == 3
+    assert scope.get(COURSE_ID, 'assignments', {'include': ['a', 'b'], 'per_page': 100}, load) is results[0]
+    assert len(calls) == 1
+
+
+def test_keys_include_params():
+    scope = RunScope()
+    assert scope.get(COURSE_ID, 'modules', {'include': ['items']}, lambda: 'a') == 'a'
+    assert scope.get(COURSE_ID, 'modules', {'include': ['items']}, lambda: 'b') == 'a'
+    assert scope.get(COURSE_ID, 'modules', {}, lambda: 'c') == 'c'
+    assert scope.get(COURSE_ID + 1, 'modules', {'include': ['items']}, lambda: 'd') == 'd'
+
+
+def test_failed_load_not_kept():
+    scope = RunScope()
+    started = threading.Event()
+    finish = threading.Event()
+
+    def fail():
+        started.set()
+        finish.wait(5)
+        raise RuntimeError('Canvas is down')
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(scope.get, COURSE_ID, 'assignments', {}, fail)
+        started.wait(5)
+        waiter = pool.submit(scope.get, COURSE_ID, 'assignments', {}, lambda: 'unused')
+        finish.set()
+        # The caller waiting on the failed load gets its error too
+        for future in (first, waiter):
+            with pytest.raises(RuntimeError):
+                future.result()
+
+    assert scope.get(COURSE_ID, 'assignments', {}, lambda: 'loaded') == 'loaded'
+    assert scope.stats['misses'] == 2
+
+
+def test_release_drops_course():
+    scope = RunScope()
+    scope.get(COURSE_ID, 'assignments', {}, lambda: 'a')
+    scope.get(COURSE_ID, 'modules', {}, lambda: 'm')
+    scope.get(COURSE_ID + 1, 'assignments', {}, lambda: 'other')
+    scope.release(COURSE_ID)
+
+    assert scope.get(COURSE_ID, 'assignments', {}, lambda: 'a2') == 'a2'
+    assert scope.get(COURSE_ID, 'modules', {}, lambda: 'm2') == 'm2'
+    assert scope.get(COURSE_ID + 1, 'assignments', {}, lambda: 'again') == 'other'
+
+
+def test_connection_lists_assignments_once(server):
+    canvas = CanvasConnection(server.url, 'token')
+    course = canvas.get_courses_by_id([COURSE_ID])[0]
+    expected = canvas.get_assignments_df(course), canvas.get_assignment_submissions_df(course)
+
+    server.reset_counts()
+    with canvas.run_scope():
+        got = canvas.get_assignments_df(course), canvas.get_assignment_submissions_df(course)
+        assert server.requests['assignments'] == 1
+        canvas.release_course(course.id)
+        canvas.get_assignments_df(course)
+        assert server.requests['assignments'] == 2
+    for frame, expected_frame in zip(got, expected):
+        pdt.assert_frame_equal(frame, expected_frame)
+
+    # Outside a scope, every call lists them again
+    canvas.get_assignments_df(course)
+    canvas.get_assignments_df(course)
+    assert server.requests['assignments'] == 4
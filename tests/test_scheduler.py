@@ -0,0 +1,160 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+RateLimitScheduler and ScheduledSession: the concurrency limit grows additively and is
+halved once per burst of shortages, slots can be taken without waiting, and throttled
+requests (429, or 403 Rate Limit Exceeded) are retried after a bounded jittered backoff.
+"""
+
+from python_canvas_layer.pycanvas import CanvasConnection
+from python_canvas_layer.fake_canvas import FakeCanvasServer
+from python_canvas_layer.scheduler import RateLimitScheduler, ScheduledSession
+from python_canvas_layer import scheduler as scheduler_module
+from requests.adapters import HTTPAdapter
+import requests
+import pytest
+
+PLENTY = {'X-Rate-Limit-Remaining': '700.0', 'X-Request-Cost': '1.0'}
+LOW = {'X-Rate-Limit-Remaining': '10.0', 'X-Request-Cost': '1.0'}
+
+
+def _respond(scheduler: RateLimitScheduler, headers, throttled: bool = False) -> None:
+    scheduler.acquire()
+    scheduler.release(headers, throttled)
+
+
+def test_additive_increase():
+    scheduler = RateLimitScheduler(initial_concurrency=4, max_concurrency=6)
+    limits = []
+    for _ in range(20):
+        _respond(scheduler, PLENTY)
+        limits.append(scheduler.limit)
+    # About one more slot per limit's worth of responses, up to max_concurrency
+    assert limits == sorted(limits)
+    assert int(limits[4]) == 5
+    assert int(limits[3]) == 4
+    assert scheduler.limit == 6.0
+    assert scheduler.budget['remaining'] == 700.0
+
+
+@pytest.mark.parametrize('throttled', [True, False])
+def test_halved_once_per_burst(monkeypatch, throttled):
+    now = [1000.0]
+    monkeypatch.setattr(scheduler_module.time, 'monotonic', lambda: now[0])
+    scheduler = RateLimitScheduler(initial_concurrency=16, decrease_interval=2.0)
+    headers = PLENTY if throttled else LOW
+    for _ in range(5):
+        _respond(scheduler, headers, throttled)
+    assert scheduler.limit == 8.0
+
+    now[0] += 1.0
+    _respond(scheduler, headers, throttled)
+    assert scheduler.limit == 8.0
+    now[0] += 1.5
+    _respond(scheduler, headers, throttled)
+    assert scheduler.limit == 4.0
+    assert scheduler.throttled == (7 if throttled else 0)
+
+    for _ in range(5):
+        now[0] += 10.0
+        _respond(scheduler, headers, throttled)
+    assert scheduler.limit == scheduler.min_concurrency
+
+
+def test_try_acquire():
+    scheduler = RateLimitScheduler(initial_concurrency=2)
+    assert scheduler.try_acquire()
+    assert scheduler.try_acquire()
+    assert not scheduler.try_acquire()
+    assert scheduler.budget['in_flight'] == 2
+    scheduler.release()
+    assert scheduler.try_acquire()
+
+
+class ScriptedAdapter(HTTPAdapter):
+    """
+    Answers each request with the next of the given (status, body) pairs.
+    """
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = list(script)
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        status, body = self.script[min(self.sent, len(self.script) - 1)]
+        self.sent += 1
+        response = requests.Response()
+        response.status_code = status
+        response._content = body
+        response.headers.update(PLENTY)
+        response.url = request.url
+        response.request = request
+        return response
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    ret = []
+    monkeypatch.setattr(scheduler_module.time, 'sleep', ret.append)
+    return ret
+
+
+def _session(script, **kwargs):
+    session = ScheduledSession(RateLimitScheduler(**kwargs))
+    adapter = ScriptedAdapter(script)
+    session.mount('https://', adapter)
+    return session, adapter
+
+
+@pytest.mark.parametrize('throttle', [(429, b''), (403, b'403 Forbidden (Rate Limit Exceeded)')])
+def test_throttled_requests_retried_with_backoff(sleeps, throttle):
+    session, adapter = _session([throttle] * 3 + [(200, b'[]')], backoff_base=0.5, backoff_max=1.5)
+    response = session.get('https://canvas.test/api/v1/courses')
+    assert response.status_code == 200
+    assert adapter.sent == 4
+    assert len(sleeps) == 3
+    for attempt, delay in enumerate(sleeps):
+        assert 0 <= delay <= min(1.5, 0.5 * 2 ** attempt)
+    assert session.scheduler.throttled == 3
+    assert session.scheduler.throttle_wait == pytest.approx(sum(sleeps))
+
+
+def test_retries_run_out(sleeps):
+    session, adapter = _session([(429, b'')], max_retries=2)
+    assert session.get('https://canvas.test/api/v1/courses').status_code == 429
+    assert adapter.sent == 3
+    assert len(sleeps) == 2
+
+
+def test_other_forbidden_not_retried(sleeps):
+    session, adapter = _session([(403, b'{"errors": [{"message": "user not authorized"}]}'), (200, b'[]')])
+    assert session.get('https://canvas.test/api/v1/courses').status_code == 403
+    assert adapter.sent == 1
+    assert sleeps == []
+
+
+def test_throttled_fake_server(institution):
+    # A bucket far smaller than the listing, refilled slowly enough that Canvas says no
+    with FakeCanvasServer(institution, max_per_page=2, rate_limit=2.0, refill_per_second=20.0) as server:
+        scheduler = RateLimitScheduler(initial_concurrency=4, backoff_base=0.05, max_retries=10, low_water=0.0)
+        canvas = CanvasConnection(server.url, 'token', scheduler=scheduler)
+        course = canvas.get_courses_by_id([100])[0]
+        students = canvas.get_students_df(course)
+        assert sorted(students['id']) == sorted(user['id'] for user in institution.users[100])
+        assert server.throttled > 0
+        assert scheduler.throttled == server.throttled
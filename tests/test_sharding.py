@@ -0,0 +1,70 @@
+#####################################################################################################################
+##
+## Copyright (C) 2022-23 by Zachary G. Ives
+##
+## Licensed under the Apache License, Version 2.0 (the "License");
+## you may not use this file except in compliance with the License.
+## You may obtain a copy of the License at http://www.apache.org/licenses/LICENSE-2.0.
+##
+## Unless required by applicable law or agreed to in writing, software
+## distributed under the License is distributed on an "AS IS" BASIS,
+## WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+## See the License for the specific language governing permissions and
+## limitations under the License.
+##
+#####################################################################################################################
+
+"""
+ShardedCanvasStatus against a single CanvasStatus: the same frames in the same order, the
+same metrics in the caller's hook, and the same failed units.
+"""
+
+from python_canvas_layer.canvas_status import CanvasStatus
+from python_canvas_layer.sharding import ShardedCanvasStatus
+from python_canvas_layer.metrics import RunMetrics
+import pandas.testing as pdt
+import pytest
+
+
+def _assert_same_info(expected, got) -> None:
+    pdt.assert_frame_equal(expected[0], got[0])
+    for expected_frames, got_frames in zip(expected[1:], got[1:]):
+        assert len(expected_frames) == len(got_frames)
+        for expected_frame, got_frame in zip(expected_frames, got_frames):
+            pdt.assert_frame_equal(expected_frame, got_frame)
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_sharded_matches_single_process(server, processes):
+    single_metrics = RunMetrics()
+    expected = CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False,
+                            metrics=single_metrics).get_course_info()
+
+    sharded_metrics = RunMetrics()
+    sharded = ShardedCanvasStatus(server.url, ['token1', 'token2'], [], CanvasStatus.OPTION_ORDER, False,
+                                  processes=processes, shard_size=1, metrics=sharded_metrics)
+    _assert_same_info(expected, sharded.get_course_info())
+
+    # The workers' requests and rows reach the caller's hook
+    pdt.assert_frame_equal(single_metrics.rows().sort_values(['course_id', 'entity'], ignore_index=True),
+                           sharded_metrics.rows().sort_values(['course_id', 'entity'], ignore_index=True))
+    assert sharded_metrics.summary('endpoint')['requests'].sum() == \
+        single_metrics.summary('endpoint')['requests'].sum()
+
+
+def test_sharded_checkpoint_and_errors(server, tmp_path):
+    path = str(tmp_path / 'checkpoint.db')
+    expected = CanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False).get_course_info()
+
+    # Both SQLite files are written by all of the worker processes at once
+    saved = server.institution.submissions.pop(102)
+    sharded = ShardedCanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False, processes=2,
+                                  shard_size=1, checkpoint=path, sync_store=str(tmp_path / 'sync.db'))
+    sharded.get_course_info()
+    assert sharded.get_errors()[['course_id', 'option']].values.tolist() == [[102, 'submissions']]
+
+    server.institution.submissions[102] = saved
+    sharded = ShardedCanvasStatus(server.url, 'token', [], CanvasStatus.OPTION_ORDER, False, processes=2,
+                                  shard_size=1, checkpoint=path)
+    _assert_same_info(expected, sharded.get_course_info())
+    assert len(sharded.get_errors()) == 0